@@ -0,0 +1,280 @@
+"""
+ Binary framing with checksum, acks and selective retransmit
+     (test3.ino: "verbinding betrouwbaar maken! add checksum, ack, retries")
+
+ Frame:  SYNC | len | seq | type | payload (len bytes) | crc16 (big endian)
+     crc16 is CRC-CCITT over len..payload, a frame with a bad crc is dropped
+     and the decoder searches for the next SYNC.
+
+ ArqLink sends frames in a sliding window, every frame is acked on its own
+ (ACK frame with the seq), frames that are not acked in time are sent again
+ one by one. The receiver delivers in order and drops duplicates. A frame
+ with a good crc whose payload does not decode (FrameError) is not acked,
+ so it is sent again.
+
+ TextLink has the same interface for the current firmware, which only
+ knows CR terminated text; negotiate() picks the one the board supports.
+ transport.AsyncBluno(transport, arq=True) negotiates at the start and then
+ runs its commands through the link.
+
+ Encoder samples are sent as zigzag varint deltas, a few bytes per sample
+ instead of the 15-18 bytes of "Enc: %d, %d\\r".
+"""
+import time, struct, binascii
+from collections import OrderedDict
+
+from framing import FrameAssembler
+
+SYNC = 0xB5
+
+# frame types
+DATA     = 0x01     # command or text reply
+ACK      = 0x02
+ENCODERS = 0x03     # batch of encoder samples
+SETPOINT = 0x04     # motor, int32 value
+
+HEADER   = 4        # sync, len, seq, type
+TRAILER  = 2        # crc16
+MAXPAYLOAD = 255
+
+
+class FrameError(ValueError):
+    """ a payload that does not decode """
+
+
+def crc16(data) -> int:
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def encodeFrame(seq: int, ftype: int, payload: bytes = b'') -> bytes:
+    if len(payload) > MAXPAYLOAD:
+        raise ValueError(f'payload of {len(payload)} bytes too long')
+    body = bytes((len(payload), seq & 0xFF, ftype)) + payload
+    return bytes((SYNC,)) + body + struct.pack('>H', crc16(body))
+
+
+class FrameDecoder:
+    """ cuts a byte stream into (seq, type, payload) frames """
+
+    def __init__(self):
+        self.buf       = bytearray()
+        self.crcErrors = 0
+        self.skipped   = 0        # bytes thrown away while searching for SYNC
+
+    def feed(self, data) -> list:
+        self.buf += data
+        frames = []
+        while True:
+            start = self.buf.find(SYNC)
+            if start < 0:
+                self.skipped += len(self.buf)
+                self.buf.clear()
+                break
+            if start:
+                self.skipped += start
+                del self.buf[:start]
+            if len(self.buf) < HEADER:
+                break
+            length = self.buf[1]
+            end = HEADER + length + TRAILER
+            if len(self.buf) < end:
+                break
+            body = bytes(self.buf[1:HEADER + length])
+            crc, = struct.unpack('>H', self.buf[HEADER + length:end])
+            if crc != crc16(body):
+                # not a frame after all, search from the next byte
+                self.crcErrors += 1
+                del self.buf[:1]
+                continue
+            del self.buf[:end]
+            frames.append((body[1], body[2], body[3:]))
+        return frames
+
+
+# payload codecs
+def zigzag(n: int) -> int:
+    return (n << 1) ^ (n >> 63)
+
+
+def unzigzag(n: int) -> int:
+    return (n >> 1) ^ -(n & 1)
+
+
+def putVarint(out: bytearray, n: int):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def getVarint(data, pos):
+    result = shift = 0
+    while True:
+        if pos >= len(data):
+            raise FrameError('payload ends in a varint')
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def encodeEncoders(samples) -> bytes:
+    """ [(enc1, enc2), ...] -> deltas from the previous sample (the first from 0, 0) """
+    out = bytearray()
+    prev1 = prev2 = 0
+    for enc1, enc2 in samples:
+        putVarint(out, zigzag(enc1 - prev1))
+        putVarint(out, zigzag(enc2 - prev2))
+        prev1, prev2 = enc1, enc2
+    return bytes(out)
+
+
+def decodeEncoders(payload) -> list:
+    samples = []
+    pos = 0
+    enc1 = enc2 = 0
+    while pos < len(payload):
+        d1, pos = getVarint(payload, pos)
+        d2, pos = getVarint(payload, pos)
+        enc1 += unzigzag(d1)
+        enc2 += unzigzag(d2)
+        samples.append((enc1, enc2))
+    return samples
+
+
+def encodeSetpoint(motor: int, value: int) -> bytes:
+    return struct.pack('<Bi', motor, value)
+
+
+def decodeSetpoint(payload):
+    try:
+        return struct.unpack('<Bi', payload)
+    except struct.error as ex:
+        raise FrameError(f'setpoint: {ex}')
+
+
+# payloads that are checked before a frame is acked
+DECODERS = {ENCODERS: decodeEncoders, SETPOINT: decodeSetpoint}
+
+
+class ArqLink:
+    """ reliable frames over an unreliable notification stream
+
+        send(bytes) writes to the link, deliver(type, payload) gets the
+        received frames in order. Call poll() periodically for retransmits.
+    """
+    def __init__(self, send, deliver, window=8, timeout=0.25, clock=time.monotonic):
+        self.send     = send
+        self.deliver  = deliver
+        self.window   = min(window, 127)      # selective repeat needs window <= seq space / 2
+        self.timeout  = timeout
+        self.clock    = clock
+        self.decoder  = FrameDecoder()
+
+        self.nextSeq  = 0
+        self.unacked  = OrderedDict()         # seq -> [frame, sent time]
+        self.queued   = []                    # (type, payload) waiting for the window
+        self.expected = 0                     # next seq to deliver
+        self.received = {}                    # out of order frames, seq -> (type, payload)
+
+        # counters
+        self.retransmits = 0
+        self.duplicates  = 0
+        self.rejected    = 0                  # frames with a payload that does not decode
+        self.framesSent  = 0
+        self.bytesSent   = 0
+
+    def submit(self, ftype: int, payload: bytes = b''):
+        self.queued.append((ftype, payload))
+        self.fill()
+
+    def fill(self):
+        while self.queued and len(self.unacked) < self.window:
+            ftype, payload = self.queued.pop(0)
+            seq = self.nextSeq
+            self.nextSeq = (self.nextSeq + 1) & 0xFF
+            frame = encodeFrame(seq, ftype, payload)
+            self.unacked[seq] = [frame, self.clock()]
+            self.transmit(frame)
+
+    def transmit(self, frame):
+        self.framesSent += 1
+        self.bytesSent += len(frame)
+        self.send(frame)
+
+    def poll(self):
+        """ send frames again that were not acked in time """
+        now = self.clock()
+        for entry in list(self.unacked.values()):
+            if now - entry[1] >= self.timeout:
+                entry[1] = now
+                self.retransmits += 1
+                self.transmit(entry[0])
+
+    def dataReceived(self, data):
+        for seq, ftype, payload in self.decoder.feed(data):
+            if ftype == ACK:
+                if self.unacked.pop(seq, None) is not None:
+                    self.fill()
+                continue
+            if ftype in DECODERS:
+                try:
+                    DECODERS[ftype](payload)
+                except FrameError:
+                    self.rejected += 1
+                    continue
+            # ack everything, also duplicates: the earlier ack may be lost
+            self.transmit(encodeFrame(seq, ACK))
+            offset = (seq - self.expected) & 0xFF
+            if offset >= 128 or seq in self.received:
+                self.duplicates += 1
+                continue
+            self.received[seq] = (ftype, payload)
+            while self.expected in self.received:
+                ftype, payload = self.received.pop(self.expected)
+                self.expected = (self.expected + 1) & 0xFF
+                self.deliver(ftype, payload)
+
+    def pending(self) -> int:
+        return len(self.unacked) + len(self.queued)
+
+
+class TextLink:
+    """ same interface as ArqLink for the text protocol of test3.ino (no checksum, no retries) """
+
+    def __init__(self, send, deliver):
+        self.send      = send
+        self.deliver   = deliver
+        self.assembler = FrameAssembler(callback=lambda frame: self.deliver(DATA, frame))
+        self.retransmits = 0
+        self.duplicates  = 0
+
+    def submit(self, ftype: int, payload: bytes = b''):
+        if ftype == SETPOINT:
+            motor, value = decodeSetpoint(payload)
+            if motor not in (0, 1):
+                raise ValueError(f'motor {motor}, the bluno has motor 0 (l) and 1 (r)')
+            payload = b'p%c%d' % (b'lr'[motor], value)
+        elif ftype != DATA:
+            raise ValueError(f'frame type {ftype} not supported in text mode')
+        self.send(payload + b'\r')
+
+    def poll(self):
+        pass
+
+    def dataReceived(self, data):
+        self.assembler.feed(data)
+
+    def pending(self) -> int:
+        return 0
+
+
+def negotiate(reply: bytes, send, deliver, **options):
+    """ the link for a board, reply is its answer on the text command 'B1'.
+        Firmware without binary mode answers 'ack' and gets a TextLink.
+    """
+    if reply.startswith(b'Bin'):
+        return ArqLink(send, deliver, **options)
+    return TextLink(send, deliver)
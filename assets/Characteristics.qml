@@ -82,7 +82,7 @@ Rectangle {
         }
 
         onDisconnected: {
-            pageLoader.source = "main.qml"
+            pageLoader.sourceComponent = undefined
         }
 
 	// for Python/Qml interaction. Nog nodig?
@@ -113,15 +113,15 @@ Rectangle {
                 anchors.fill: parent
                 onClicked: {
 		    // test if correct Bluno service is selected
-                    pageLoader.source = "ControlBluno.qml";
-                    device.controlBluno(modelData);
+                    pageLoader.sourceComponent = back.controlPage;
+                    device.controlBluno(model.info);
                 }
             }
 
 
             Label {
                 id: characteristicName
-                textContent: modelData.characteristicName
+                textContent: model.characteristicName
                 anchors.top: parent.top
                 anchors.topMargin: 5
             }
@@ -129,7 +129,7 @@ Rectangle {
             Label {
                 id: characteristicUuid
                 font.pointSize: characteristicName.font.pointSize*0.7
-                textContent: modelData.characteristicUuid
+                textContent: model.characteristicUuid
                 anchors.top: characteristicName.bottom
                 anchors.topMargin: 5
             }
@@ -137,7 +137,7 @@ Rectangle {
             Label {
                 id: characteristicValue
                 font.pointSize: characteristicName.font.pointSize*0.7
-                textContent: ("Value: " + modelData.characteristicValue)
+                textContent: ("Value: " + model.characteristicValue)
                 anchors.bottom: characteristicHandle.top
                 horizontalAlignment: Text.AlignHCenter
                 anchors.topMargin: 5
@@ -146,7 +146,7 @@ Rectangle {
             Label {
                 id: characteristicHandle
                 font.pointSize: characteristicName.font.pointSize*0.7
-                textContent: ("Handlers: " + modelData.characteristicHandle)
+                textContent: ("Handlers: " + model.characteristicHandle)
                 anchors.bottom: characteristicPermission.top
                 anchors.topMargin: 5
             }
@@ -154,7 +154,7 @@ Rectangle {
             Label {
                 id: characteristicPermission
                 font.pointSize: characteristicName.font.pointSize*0.7
-                textContent: modelData.characteristicPermission
+                textContent: model.characteristicPermission
                 anchors.bottom: parent.bottom
                 anchors.topMargin: 5
                 anchors.bottomMargin: 5
@@ -169,7 +169,7 @@ Rectangle {
         menuText: device.update
         menuHeight: (parent.height/6)
         onButtonClick: {
-            pageLoader.source = "Services.qml"
+            pageLoader.sourceComponent = back.servicesPage
             device.update = "Back"
         }
     }
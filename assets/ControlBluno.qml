@@ -28,7 +28,7 @@ Rectangle {
 
         onDisconnected: {
 	    print('Bij disconnecting ...');
-            pageLoader.source = "main.qml"
+            pageLoader.sourceComponent = undefined
         }
     }
 
@@ -61,6 +61,20 @@ Rectangle {
 	}
     }
 
+    // encoder telemetry
+    Row {
+	id: rowid3
+	spacing: 2
+	anchors.top: rowid2.bottom
+	QtControls.Button {
+	    text: device.telemetry.running ? 'Stop' : 'Stream'
+	    onClicked: device.telemetry.running ? device.telemetry.stop() : device.telemetry.start()
+	}
+	Text {
+	    text: 'Enc: ' + device.telemetry.latest.join(', ')
+	}
+    }
+
     Menu {
         id: menu
         anchors.bottom: parent.bottom
@@ -68,7 +82,7 @@ Rectangle {
         menuHeight: (parent.height/6)
         menuText: device.update
         onButtonClick: {
-            pageLoader.source = "Characteristics.qml"
+            pageLoader.sourceComponent = back.characteristicsPage
             device.update = "Back from control"
         }
     }
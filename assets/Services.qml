@@ -88,7 +88,12 @@ Rectangle {
         }
 
         onDisconnected: {
-            pageLoader.source = "main.qml"
+            pageLoader.sourceComponent = undefined
+        }
+
+        // known device: the Serial channel is ready without selecting it
+        onSerialReady: {
+            pageLoader.sourceComponent = back.controlPage
         }
     }
 
@@ -116,20 +121,20 @@ Rectangle {
                 anchors.fill: parent
                 onClicked: {
 		    // test op goede service
-                    pageLoader.source = "Characteristics.qml";
-                    device.connectToService(modelData.serviceUuid);
+                    pageLoader.sourceComponent = back.characteristicsPage;
+                    device.connectToService(model.serviceUuid);
                 }
             }
 
             Label {
                 id: serviceName
-                textContent: modelData.serviceName
+                textContent: model.serviceName
                 anchors.top: parent.top
                 anchors.topMargin: 5
             }
 
             Label {
-                textContent: modelData.serviceType
+                textContent: model.serviceType
                 font.pointSize: serviceName.font.pointSize * 0.5
                 anchors.top: serviceName.bottom
             }
@@ -137,7 +142,7 @@ Rectangle {
             Label {
                 id: serviceUuid
                 font.pointSize: serviceName.font.pointSize * 0.5
-                textContent: modelData.serviceUuid
+                textContent: model.serviceUuid
                 anchors.bottom: servicebox.bottom
                 anchors.bottomMargin: 5
             }
@@ -152,7 +157,7 @@ Rectangle {
         menuHeight: (parent.height/6)
         onButtonClick: {
             device.disconnectFromDevice()
-            pageLoader.source = "main.qml"
+            pageLoader.sourceComponent = undefined
             device.update = "Search from servs"
         }
     }
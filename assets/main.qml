@@ -61,6 +61,12 @@ Window {
     width: 300
     height: 600
     property bool deviceState: device.state
+
+    // pages are compiled in the background while this one is shown,
+    // switching pages does not load QML anymore
+    property Component servicesPage: Qt.createComponent("Services.qml", Component.Asynchronous)
+    property Component characteristicsPage: Qt.createComponent("Characteristics.qml", Component.Asynchronous)
+    property Component controlPage: Qt.createComponent("ControlBluno.qml", Component.Asynchronous)
     onDeviceStateChanged: {
         if (!deviceState)
             info.visible = false;
@@ -104,21 +110,21 @@ Window {
             MouseArea {
                 anchors.fill: parent
                 onClicked: {
-                    device.scanServices(modelData.deviceAddress);
-                    pageLoader.source = "Services.qml"
+                    device.scanServices(model.deviceAddress);
+                    pageLoader.sourceComponent = back.servicesPage
                 }
             }
 
             Label {
                 id: deviceName
-                textContent: modelData.deviceName
+                textContent: model.deviceName
                 anchors.top: parent.top
                 anchors.topMargin: 5
             }
 
             Label {
                 id: deviceAddress
-                textContent: modelData.deviceAddress
+                textContent: model.deviceAddress + "   " + model.deviceRssi + " dBm"
                 font.pointSize: deviceName.font.pointSize*0.7
                 anchors.bottom: box.bottom
                 anchors.bottomMargin: 5
@@ -132,7 +138,7 @@ Window {
 
         menuWidth: parent.width
         anchors.bottom: menu.top
-        menuText: { if (device.devicesList.length)
+        menuText: { if (device.devicesList.count)
                         visible = true
                     else
                         visible = false
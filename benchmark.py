@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+
+"""
+ Benchmarks for the bluno communication
+
+   python3 benchmark.py ringbuffer     cost per notification, ring buffer vs bytes +=
+   python3 benchmark.py protocol       round trip latency and throughput of the command set
+   python3 benchmark.py listmodel      cost of adding discovered items to a ListView (needs PyQt5, QtQuick)
+   python3 benchmark.py stop           latency of c0 behind a flood of setpoints and polls, FIFO vs priority lanes
+   python3 benchmark.py replies        typed reply parsing, per reply and bulk (an hour of 'e' at 100 Hz)
+   python3 benchmark.py startup        time to the first frame and the first scan of main.py (needs PyQt5)
+   python3 benchmark.py bulk           bytes/s of a bulk transfer vs setpoint commands, on the emulator
+
+ Without --address the protocol benchmark runs against the loopback stand-in,
+ so it works without a board. --emulate runs protocol and stop against the
+ firmware emulator behind a link model instead (emulator.py, --interval,
+ --jitter, --loss, ..). Use --json to write the results for comparing runs.
+"""
+import os, sys, time, json, asyncio, argparse, platform, tempfile, subprocess
+
+from framing import FrameAssembler
+from transport import AsyncBluno, LoopbackTransport, BluepyTransport
+from emulator import EmulatedTransport, addLinkArguments, linkFromArgs
+
+
+# notification path
+#   replies are left to pile up (no CR), the cost per notification
+#   should not depend on how much is already buffered.
+def bench_ringbuffer(args):
+    notification = b'Enc: 12345, -6789 '[:20]
+    perBlock = 1000
+    results = {}
+    for name in ('bytes', 'ring'):
+        costs = []
+        if name == 'ring':
+            assembler = FrameAssembler(capacity=perBlock * args.blocks * len(notification))
+            feed = assembler.feed
+        else:
+            buffer = [b'']
+
+            def feed(data):
+                buffer[0] += data    # the old MyDelegate.handleNotification
+        for block in range(args.blocks):
+            start = time.perf_counter()
+            for _ in range(perBlock):
+                feed(notification)
+            costs.append((time.perf_counter() - start) / perBlock * 1e9)
+        results[name] = costs
+        print(f'{name:6s} ns/notification after ' +
+              ', '.join(f'{(i + 1) * perBlock}: {c:.0f}' for i, c in enumerate(costs)
+                        if i in (0, len(costs) // 2, len(costs) - 1)))
+    return results
+
+
+# protocol
+#   commands of test3.ino, 'p' setpoints are padded to the wanted payload size
+def commandOfSize(cmd, size):
+    if cmd[0] != 'p' or size <= len(cmd):
+        return cmd
+    return cmd[:2] + cmd[2:].rjust(size - 2, '0')
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+async def runProtocol(bluno, commands, count, pipelined):
+    latencies = []
+    txBytes = rxBytes = 0
+    start = time.perf_counter()
+    if pipelined:
+        # keep the window full, but do not count time waiting for the window as latency
+        window = asyncio.Semaphore(bluno.pipeline.window)
+
+        async def one(cmd):
+            async with window:
+                t = time.perf_counter()
+                reply = await bluno.request(cmd)
+                latencies.append(time.perf_counter() - t)
+            return reply
+        replies = await asyncio.gather(*[one(commands[i % len(commands)]) for i in range(count)])
+    else:
+        replies = []
+        for i in range(count):
+            t = time.perf_counter()
+            replies.append(await bluno.request(commands[i % len(commands)]))
+            latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+    for i, reply in enumerate(replies):
+        txBytes += len(commands[i % len(commands)]) + 1
+        rxBytes += len(reply) + 1
+    return {
+        'p50_ms': percentile(latencies, 50) * 1e3,
+        'p95_ms': percentile(latencies, 95) * 1e3,
+        'p99_ms': percentile(latencies, 99) * 1e3,
+        'commands_per_s': count / elapsed,
+        'bytes_per_s': (txBytes + rxBytes) / elapsed,
+        'tx_bytes': txBytes,
+        'rx_bytes': rxBytes,
+    }
+
+
+def makeTransport(args):
+    if getattr(args, 'address', None):
+        return BluepyTransport(args.address)
+    if args.emulate:
+        return EmulatedTransport(link=linkFromArgs(args))
+    return LoopbackTransport(delay=args.delay)
+
+
+def transportName(args):
+    if getattr(args, 'address', None):
+        return 'bluepy'
+    return 'emulator' if args.emulate else 'loopback'
+
+
+async def protocolRuns(args):
+    runs = []
+    for window in args.windows:
+        for size in args.sizes:
+            commands = [commandOfSize(c, size) for c in args.commands.split(',')]
+            transport = makeTransport(args)
+            bluno = AsyncBluno(transport, window=window, timeout=args.timeout)
+            async with bluno:
+                result = await runProtocol(bluno, commands, args.count, pipelined=window > 1)
+            result.update(mode='pipelined' if window > 1 else 'stop-and-wait',
+                          window=window, size=size, count=args.count,
+                          packets=bluno.packets.packets, packets_saved=bluno.packets.saved)
+            if isinstance(transport, EmulatedTransport):
+                result.update(link_packets=transport.link.packets, link_lost=transport.link.lost)
+            print(f"{result['mode']:13s} window {window:2d} size {size:2d}: "
+                  f"p50 {result['p50_ms']:7.2f} ms  p95 {result['p95_ms']:7.2f} ms  "
+                  f"p99 {result['p99_ms']:7.2f} ms  {result['commands_per_s']:8.1f} cmd/s  "
+                  f"{result['bytes_per_s']:9.1f} B/s")
+            runs.append(result)
+    return runs
+
+
+def bench_protocol(args):
+    runs = asyncio.run(protocolRuns(args))
+    return {
+        'transport': transportName(args),
+        'address': args.address,
+        'delay': None if args.address or args.emulate else args.delay,
+        'link': {k: getattr(args, k) for k in ('interval', 'perEvent', 'jitter', 'loss', 'seed')}
+                if args.emulate and not args.address else None,
+        'commands': args.commands,
+        'runs': runs,
+    }
+
+
+# list models
+#   a ListView like the device list of main.qml, laid out after every item
+#   (the view sees one change per frame while a scan runs):
+#   old: the list property is set again and the view resets, its delegates are made anew
+#   new: ObjectListModel only announces the inserted row
+LISTVIEW = b"""
+import QtQuick 2.0
+ListView {
+    property int created: 0
+    width: 400
+    height: %d
+    delegate: Rectangle {
+        width: 400
+        height: 100
+        Text { text: %s }
+        Text { text: %s; anchors.bottom: parent.bottom }
+        Component.onCompleted: ListView.view.created++
+    }
+}
+"""
+
+
+def bench_listmodel(args):
+    from PyQt5.QtCore import QObject, QVariant, QMetaObject, QUrl, pyqtProperty
+    from PyQt5.QtGui import QGuiApplication
+    from PyQt5.QtQml import QQmlEngine, QQmlComponent
+    from models import ObjectListModel
+
+    app = QGuiApplication.instance() or QGuiApplication(sys.argv)
+    engine = QQmlEngine()
+
+    class Item(QObject):
+        def __init__(self, n):
+            super().__init__()
+            self.n = n
+
+        def getName(self):
+            return f'device {self.n}'
+
+        def getAddress(self):
+            return f'00:00:00:00:{self.n // 256:02X}:{self.n % 256:02X}'
+
+        name = pyqtProperty(str, getName, constant=True)
+        address = pyqtProperty(str, getAddress, constant=True)
+
+    def listView(name, address):
+        component = QQmlComponent(engine)
+        component.setData(LISTVIEW % (args.height, name, address), QUrl())
+        view = component.create()
+        if view is None:
+            raise RuntimeError(component.errorString())
+        return component, view
+
+    def layout(view):
+        QMetaObject.invokeMethod(view, 'forceLayout')
+
+    results = {}
+    items = [Item(n) for n in range(args.items)]
+
+    component, view = listView(b'modelData.name', b'modelData.address')
+    start = time.perf_counter()
+    objects = []
+    for item in items:
+        objects.append(item)
+        view.setProperty('model', QVariant(list(objects)))     # devicesUpdated of the list property
+        layout(view)
+    results['list_ms'] = (time.perf_counter() - start) * 1e3
+    results['list_delegates'] = view.property('created')
+
+    component, view = listView(b'model.name', b'model.address')
+    model = ObjectListModel([('name', Item.getName), ('address', Item.getAddress)])
+    view.setProperty('model', model)
+    start = time.perf_counter()
+    for item in items:
+        model.append(item)
+        layout(view)
+    results['model_ms'] = (time.perf_counter() - start) * 1e3
+    results['model_delegates'] = view.property('created')
+    if view.property('count') != args.items:
+        raise RuntimeError(f"the view has {view.property('count')} rows, not {args.items}")
+
+    print(f"{args.items} items, view of {args.height} px: "
+          f"list property {results['list_ms']:.1f} ms ({results['list_delegates']} delegates), "
+          f"list model {results['model_ms']:.1f} ms ({results['model_delegates']} delegates)")
+    return results
+
+
+# stop latency under load
+#   a burst of setpoints and polls is queued, then c0: FIFO sends it last,
+#   the scheduler sends it first (with its extra slot) and drops superseded setpoints
+async def stopRun(args, scheduler):
+    async with AsyncBluno(makeTransport(args), window=args.window,
+                          scheduler=scheduler) as bluno:
+        flood = []
+        for i in range(args.burst):
+            flood.append(asyncio.ensure_future(bluno.request(f'p{"lr"[i % 2]}{i}', timeout=60)))
+            flood.append(asyncio.ensure_future(bluno.request('e', timeout=60)))
+        await asyncio.sleep(0)
+        start = time.perf_counter()
+        await bluno.request('c0', timeout=60)
+        latency = time.perf_counter() - start
+        await asyncio.gather(*flood)
+        return latency, bluno.packets.writes
+
+
+def bench_stop(args):
+    from scheduler import CommandScheduler
+    results = {}
+    for name, scheduler in (('fifo', None), ('lanes', CommandScheduler())):
+        latency, writes = asyncio.run(stopRun(args, scheduler))
+        results[f'{name}_stop_ms'] = latency * 1e3
+        results[f'{name}_commands'] = writes
+        print(f'{name:5s}: c0 after {latency * 1e3:7.1f} ms, {writes} commands written')
+    results['transport'] = transportName(args)
+    return results
+
+
+# bulk transfer
+#   the same bytes as int16 setpoint commands (pl<value>, with response,
+#   an int32 does not fit in the 9 characters of a command)
+#   and as one bulk block (write without response, credits), on the emulator
+async def commandBytes(args, data, window):
+    from emulator import Bluno
+
+    loop = asyncio.get_event_loop()
+    transport = EmulatedTransport(Bluno(clock=loop.time), linkFromArgs(args))
+    async with AsyncBluno(transport, window=window) as bluno:
+        values = [int.from_bytes(data[i:i + 2], 'little', signed=True) for i in range(0, len(data), 2)]
+        slots = asyncio.Semaphore(window)
+
+        async def one(value):
+            async with slots:
+                return await bluno.request(f'pl{value}', timeout=args.timeout)
+        start = time.perf_counter()
+        replies = await asyncio.gather(*[one(v) for v in values], return_exceptions=True)
+        rate = len(data) / (time.perf_counter() - start)
+        return rate, sum(isinstance(r, Exception) for r in replies)
+
+
+async def bulkBytes(args, data):
+    from emulator import Bluno
+    from bulk import bulkWrite
+
+    loop = asyncio.get_event_loop()
+    transport = EmulatedTransport(Bluno(bulk=True, clock=loop.time), linkFromArgs(args))
+    async with AsyncBluno(transport) as bluno:
+        start = time.perf_counter()
+        sender = await bulkWrite(bluno, data, segment=args.segment)
+        rate = len(data) / (time.perf_counter() - start)
+        if bytes(transport.board.eeprom[:len(data)]) != data:
+            raise RuntimeError('bulk transfer stored other bytes')
+        return rate, sender
+
+
+def bench_bulk(args):
+    data = os.urandom(args.size - args.size % 2)
+    results = {'bytes': len(data), 'link': {k: getattr(args, k) for k in ('interval', 'perEvent', 'jitter', 'loss', 'seed')}}
+    for window in (1, 4):
+        rate, failed = asyncio.run(commandBytes(args, data, window))
+        results[f'commands_window{window}_bytes_per_s'] = rate
+        results[f'commands_window{window}_failed'] = failed
+        print(f'setpoint commands, window {window}: {rate:8.0f} B/s  ({failed} failed)')
+    rate, sender = asyncio.run(bulkBytes(args, data))
+    results.update(bulk_bytes_per_s=rate, bulk_opens=sender.opens, bulk_checks=sender.checks,
+                   bulk_restarts=sender.restarts, bulk_bytes_sent=sender.bytesSent)
+    print(f'bulk transfer:                {rate:8.0f} B/s  ({sender.opens} W, {sender.checks} S, '
+          f'{sender.restarts} restarts, {sender.bytesSent} bytes sent)')
+    return results
+
+
+# reply parsing
+#   old: decode() and split per reply, new: replies.parseReply and the bulk decoder
+def bench_replies(args):
+    import numpy as np
+    from replies import parseReply, decodeStream
+
+    rng = np.random.default_rng(1)
+    n = int(args.seconds * args.rate)
+    pairs = rng.integers(-30000, 30000, (n, 2))
+    stream = b''.join(b'Enc: %d, %d\r' % (a, b) for a, b in pairs)
+    frames = stream.split(b'\r')[:-1]
+    results = {'replies': n}
+
+    start = time.perf_counter()
+    for frame in frames[:100000]:
+        first, second = frame.decode()[5:].split(',')
+        int(first), int(second)
+    results['decode_us'] = (time.perf_counter() - start) / min(n, 100000) * 1e6
+
+    start = time.perf_counter()
+    for frame in frames[:100000]:
+        parseReply(frame)
+    results['parse_us'] = (time.perf_counter() - start) / min(n, 100000) * 1e6
+
+    start = time.perf_counter()
+    decoded = decodeStream(stream)
+    results['bulk_s'] = time.perf_counter() - start
+    if not (decoded['enc']['enc1'] == pairs[:, 0]).all():
+        raise RuntimeError('bulk decoding is wrong')
+
+    print(f"per reply: decode/split {results['decode_us']:.2f} us, parseReply {results['parse_us']:.2f} us")
+    print(f"bulk: {n} replies ({len(stream) / 1e6:.1f} MB) in {results['bulk_s'] * 1e3:.0f} ms")
+    return results
+
+
+# startup of the gui
+#   main.py writes its milestones (s since the start of the process) to
+#   BLUNO_STARTUP_FILE, starts a scan after the first frame and quits
+STARTUP = ('qmlLoaded', 'firstFrame', 'agentCreated', 'scanStarted', 'firstDevice', 'scanFinished')
+
+
+def bench_startup(args):
+    here = os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    for run in range(args.runs):
+        with tempfile.TemporaryDirectory() as tmp:
+            report = os.path.join(tmp, 'startup.json')
+            env = dict(os.environ, BLUNO_STARTUP_FILE=report)
+            start = time.perf_counter()
+            subprocess.run([sys.executable, os.path.join(here, 'main.py')], cwd=here, env=env,
+                           timeout=args.timeout, stdout=subprocess.DEVNULL)
+            wall = time.perf_counter() - start
+            if not os.path.exists(report):
+                print(f'run {run}: no startup report, did main.py start?')
+                continue
+            with open(report) as f:
+                milestones = json.load(f)
+        milestones['wall'] = wall
+        runs.append(milestones)
+        print(f'run {run}: ' + ', '.join(f'{name} {milestones[name] * 1e3:.0f} ms'
+                                         for name in STARTUP if name in milestones))
+
+    results = {'runs': runs}
+    for name in STARTUP:
+        values = [r[name] for r in runs if name in r]
+        if values:
+            results[f'{name}_p50_ms'] = percentile(values, 50) * 1e3
+    firstFrame = results.get('firstFrame_p50_ms')
+    if firstFrame is not None:
+        print(f'first frame {firstFrame:.0f} ms (p50 of {len(runs)} runs)')
+    firstScan = results.get('scanStarted_p50_ms')
+    if firstScan is not None:
+        print(f'first scan  {firstScan:.0f} ms')
+    if args.budget and (firstFrame is None or firstFrame > args.budget):
+        print(f'first frame over the budget of {args.budget:.0f} ms')
+        results['overBudget'] = True
+    return results
+
+
+def intList(text):
+    return [int(v) for v in text.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for the bluno communication')
+    parser.add_argument('--json', help='write the results to this file')
+    sub = parser.add_subparsers(dest='bench')
+    p = sub.add_parser('ringbuffer', help='cost per notification in the notification path')
+    p.add_argument('--blocks', type=int, default=50, help='blocks of 1000 notifications')
+    p.set_defaults(func=bench_ringbuffer)
+
+    p = sub.add_parser('protocol', help='round trip latency and throughput')
+    p.add_argument('--address', help='bluno address, default the loopback stand-in')
+    p.add_argument('--delay', type=float, default=0.0075,
+                   help='reply delay of the loopback in s (default one 7.5 ms connection interval)')
+    p.add_argument('--commands', default='i,e,pl100,c1', help='comma separated commands')
+    p.add_argument('--count', type=int, default=200, help='commands per run')
+    p.add_argument('--windows', type=intList, default=[1, 4, 8], help='in flight windows, 1 is stop-and-wait')
+    p.add_argument('--sizes', type=intList, default=[3, 6, 9], help='setpoint command sizes in bytes')
+    p.add_argument('--timeout', type=float, default=2.0)
+    p.add_argument('--emulate', action='store_true', help='firmware emulator instead of the loopback')
+    addLinkArguments(p)
+    p.set_defaults(func=bench_protocol)
+
+    p = sub.add_parser('listmodel', help='adding discovered items to the views')
+    p.add_argument('--items', type=int, default=200)
+    p.add_argument('--height', type=int, default=800, help='height of the view in px, delegates are 100')
+    p.set_defaults(func=bench_listmodel)
+
+    p = sub.add_parser('stop', help='latency of c0 behind a flood of setpoints and polls')
+    p.add_argument('--burst', type=int, default=100, help='setpoint + poll pairs before the c0')
+    p.add_argument('--window', type=int, default=4)
+    p.add_argument('--delay', type=float, default=0.0075, help='reply delay of the loopback in s')
+    p.add_argument('--emulate', action='store_true', help='firmware emulator instead of the loopback')
+    addLinkArguments(p)
+    p.set_defaults(func=bench_stop)
+
+    p = sub.add_parser('replies', help='typed reply parsing, per reply and bulk')
+    p.add_argument('--seconds', type=float, default=3600, help='length of the stream')
+    p.add_argument('--rate', type=float, default=100, help='replies per s')
+    p.set_defaults(func=bench_replies)
+
+    p = sub.add_parser('bulk', help='bulk transfer vs setpoint commands on the emulator')
+    p.add_argument('--size', type=int, default=1024, help='bytes, at most the 1024 of the EEPROM')
+    p.add_argument('--timeout', type=float, default=2.0, help='s per setpoint command')
+    p.add_argument('--segment', type=int, default=512, help='bulk bytes per checked segment')
+    addLinkArguments(p)
+    p.set_defaults(func=bench_bulk)
+
+    p = sub.add_parser('startup', help='time to the first frame and the first scan of the gui')
+    p.add_argument('--runs', type=int, default=5)
+    p.add_argument('--timeout', type=float, default=60.0, help='s per run')
+    p.add_argument('--budget', type=float, help='exit with 2 when the first frame takes longer (ms)')
+    p.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    if args.bench is None:
+        parser.print_help()
+        sys.exit(1)
+    results = args.func(args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'benchmark': args.bench,
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': platform.python_version(),
+                       'results': results}, f, indent=2)
+    if isinstance(results, dict) and results.get('overBudget'):
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
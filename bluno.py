@@ -0,0 +1,14 @@
+"""
+ Known bluno boards and the uuids of the bluno serial service
+"""
+
+Pianos = {
+    'Piano 001': '50:65:83:99:4B:54',
+    'Piano 002': '50:65:83:99:48:3A',
+    'Piano 003': '50:65:83:99:4B:5E',
+}
+
+PrimarService         = '0000dfb0-0000-1000-8000-00805f9b34fb'
+ModelNumberStringUUID = '00002a24-0000-1000-8000-00805f9b34fb'
+CommandUUID           = '0000dfb2-0000-1000-8000-00805f9b34fb'
+SerialPortUUID        = '0000dfb1-0000-1000-8000-00805f9b34fb'
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+"""
+ Batch runs of command scripts against one or more blunos, without the gui
+     commands are pipelined (see pipeline.py), every reply is written as a
+     CSV or JSONL row with timestamps as soon as it arrives.
+
+   python3 blunoBatch.py calibrate.txt C8:DF:84:24:27:E6 -o run.csv
+   python3 blunoBatch.py calibrate.txt loopback --format jsonl
+   python3 blunoBatch.py calibrate.txt emulator --loss 0.01 --jitter 0.002
+   python3 blunoBatch.py calibrate.txt emulator --loss 0.05 --arq
+
+ Script, one item per line, # starts a comment:
+     pl100              a command for test3.ino (i, e, pl.., pr.., c0, c1, q, X0, X1)
+     wait 0.5           pause, s
+     sync               wait for the replies of everything sent
+     repeat 10          the lines up to 'end' 10 times
+     for v 0 500 50     the lines up to 'end' with {v} = 0, 50, .. 500
+     end
+"""
+import sys, csv, json, time, string, asyncio, argparse, itertools
+
+from transport import AsyncBluno, LoopbackTransport, BluepyTransport
+from pipeline import ReplyLost
+from replies import replyType, expectedReply
+from emulator import EmulatedTransport, addLinkArguments, linkFromArgs
+
+FIELDS = ('address', 'index', 'line', 'command', 'sent', 'received', 'latency_ms', 'reply', 'error')
+
+
+class ScriptError(ValueError):
+    pass
+
+
+def number(text, lineno):
+    try:
+        return float(text) if '.' in text else int(text)
+    except ValueError:
+        raise ScriptError(f'line {lineno}: {text!r} is not a number')
+
+
+def checkCommand(word, lineno, loops):
+    """ {name} must be the variable of a for around the command, and the
+        command has to fit the 10 byte buffer of test3.ino with every value
+    """
+    try:
+        fields = [f for _, f, _, _ in string.Formatter().parse(word) if f is not None]
+    except ValueError as ex:
+        raise ScriptError(f'line {lineno}: {word!r}: {ex}')
+    for field in fields:
+        if field not in loops:
+            raise ScriptError(f'line {lineno}: {{{field}}} in {word!r} is not the variable of a for around it')
+    used = sorted(set(fields))
+    for values in itertools.product(*(loops[name] for name in used)):
+        try:
+            text = word.format(**dict(zip(used, values)))
+        except ValueError as ex:
+            raise ScriptError(f'line {lineno}: {word!r}: {ex}')
+        # test3.ino reads commands into a 10 byte buffer
+        if len(text) > 9:
+            raise ScriptError(f'line {lineno}: command {text!r} longer than 9 characters')
+
+
+def parseScript(lines):
+    """ script text -> nested items
+          ('cmd', lineno, text), ('wait', lineno, s), ('sync', lineno),
+          ('repeat', lineno, n, body), ('for', lineno, name, values, body)
+    """
+    stack = [[]]
+    opened = []
+    for lineno, line in enumerate(lines, 1):
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        word, *rest = line.split()
+        if word == 'wait' and len(rest) == 1:
+            stack[-1].append(('wait', lineno, float(number(rest[0], lineno))))
+        elif word == 'sync' and not rest:
+            stack[-1].append(('sync', lineno))
+        elif word == 'repeat' and len(rest) == 1:
+            count = number(rest[0], lineno)
+            if not isinstance(count, int):
+                raise ScriptError(f'line {lineno}: repeat needs a whole number')
+            opened.append(('repeat', lineno, count))
+            stack.append([])
+        elif word == 'for' and len(rest) == 4:
+            start, stop, step = (number(v, lineno) for v in rest[1:])
+            if step == 0:
+                raise ScriptError(f'line {lineno}: step 0')
+            values = []
+            v = start
+            while (v <= stop) if step > 0 else (v >= stop):
+                values.append(v)
+                v += step
+            opened.append(('for', lineno, rest[0], values))
+            stack.append([])
+        elif word == 'end' and not rest:
+            if not opened:
+                raise ScriptError(f'line {lineno}: end without repeat or for')
+            body = stack.pop()
+            stack[-1].append(opened.pop() + (body,))
+        elif rest:
+            raise ScriptError(f'line {lineno}: unknown statement {line!r}')
+        else:
+            checkCommand(word, lineno, {o[2]: o[3] for o in opened if o[0] == 'for'})
+            stack[-1].append(('cmd', lineno, word))
+    if opened:
+        raise ScriptError(f'line {opened[-1][1]}: {opened[-1][0]} without end')
+    return stack[0]
+
+
+def expand(items, names=None):
+    """ the flat sequence of ('cmd', lineno, text) / ('wait', ..) / ('sync', ..) """
+    names = names or {}
+    for item in items:
+        kind = item[0]
+        if kind == 'cmd':
+            yield 'cmd', item[1], item[2].format(**names)
+        elif kind == 'repeat':
+            for _ in range(item[2]):
+                yield from expand(item[3], names)
+        elif kind == 'for':
+            for value in item[3]:
+                yield from expand(item[4], dict(names, **{item[2]: value}))
+        else:
+            yield item
+
+
+class RowWriter:
+    """ CSV or JSONL rows, flushed per row so a long run can be followed with tail -f """
+
+    def __init__(self, out, fmt):
+        self.out = out
+        self.fmt = fmt
+        self.rows = 0
+        if fmt == 'csv':
+            self.csv = csv.DictWriter(out, FIELDS)
+            self.csv.writeheader()
+
+    def write(self, row):
+        if self.fmt == 'csv':
+            self.csv.writerow(row)
+        else:
+            self.out.write(json.dumps(row) + '\n')
+        self.out.flush()
+        self.rows += 1
+
+
+def makeTransport(address, args):
+    if address == 'loopback':
+        return LoopbackTransport(delay=args.delay)
+    if address == 'emulator':
+        return EmulatedTransport(link=linkFromArgs(args), binary=args.arq)
+    return BluepyTransport(address, args.addrType)
+
+
+async def runBoard(address, items, args, rows, t0):
+    """ the script on one board, returns the number of failed commands """
+    failed = 0
+    async with AsyncBluno(makeTransport(address, args), window=args.window, timeout=args.timeout,
+                          arq=args.arq) as bluno:
+        slots = asyncio.Semaphore(args.window)
+        outstanding = set()
+
+        async def one(index, lineno, cmd):
+            nonlocal failed
+            sent = time.monotonic()
+            reply, error = None, ''
+            try:
+                reply = await bluno.request(cmd)
+                expected, got = expectedReply(cmd), replyType(reply)
+                if got not in expected:
+                    error = f'reply {got or "unknown"}, expected {" or ".join(expected)}'
+            except ReplyLost:
+                error = 'lost'
+            except (asyncio.TimeoutError, TimeoutError):
+                error = 'timeout'
+            except ConnectionError as ex:
+                error = f'connection: {ex}'
+            finally:
+                slots.release()
+            received = time.monotonic()
+            failed += bool(error)
+            rows.write({'address': address, 'index': index, 'line': lineno, 'command': cmd,
+                        'sent': round(sent - t0, 6), 'received': round(received - t0, 6),
+                        'latency_ms': round((received - sent) * 1e3, 3),
+                        'reply': reply.decode(errors='replace') if reply is not None else '',
+                        'error': error})
+
+        index = 0
+        for item in expand(items):
+            if item[0] == 'cmd':
+                await slots.acquire()
+                task = asyncio.ensure_future(one(index, item[1], item[2]))
+                outstanding.add(task)
+                task.add_done_callback(outstanding.discard)
+                index += 1
+            elif item[0] == 'wait':
+                await asyncio.sleep(item[2])
+            elif outstanding:
+                await asyncio.wait(set(outstanding))
+        if outstanding:
+            await asyncio.wait(set(outstanding))
+    return failed
+
+
+async def runAll(items, args, rows):
+    t0 = time.monotonic()
+    results = await asyncio.gather(*(runBoard(address, items, args, rows, t0) for address in args.addresses),
+                                   return_exceptions=True)
+    failed = 0
+    for address, result in zip(args.addresses, results):
+        if isinstance(result, Exception):
+            print(f'{address}: {type(result).__name__}: {result}', file=sys.stderr)
+            failed += 1
+        else:
+            failed += result
+    return failed, time.monotonic() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a command script against blunos')
+    parser.add_argument('script', help="script file, '-' for stdin")
+    parser.add_argument('addresses', nargs='+', help="bluno addresses, 'loopback' for the stand-in, "
+                                                           "'emulator' for the firmware emulator")
+    parser.add_argument('-o', '--output', help='output file, default stdout')
+    parser.add_argument('--format', choices=('csv', 'jsonl'),
+                        help='default from the output file extension, csv on stdout')
+    parser.add_argument('--window', type=int, default=4, help='commands in flight per board')
+    parser.add_argument('--timeout', type=float, default=2.0, help='s per reply')
+    parser.add_argument('--random', dest='addrType', action='store_const', const='random', default='public',
+                        help='random address type')
+    parser.add_argument('--arq', action='store_true',
+                        help='binary link with acks and retries (arq.py) on boards that have it, '
+                             'the emulator then has it')
+    parser.add_argument('--delay', type=float, default=0.0075, help='reply delay of the loopback in s')
+    addLinkArguments(parser)
+    args = parser.parse_args()
+
+    with (sys.stdin if args.script == '-' else open(args.script)) as f:
+        try:
+            items = parseScript(f)
+        except ScriptError as ex:
+            print(f'{args.script}: {ex}', file=sys.stderr)
+            sys.exit(1)
+
+    fmt = args.format or ('jsonl' if args.output and args.output.endswith(('.jsonl', '.json')) else 'csv')
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    rows = RowWriter(out, fmt)
+    try:
+        failed, elapsed = asyncio.run(runAll(items, args, rows))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f'{rows.rows} replies from {len(args.addresses)} board(s) in {elapsed:.2f} s, {failed} failed',
+          file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
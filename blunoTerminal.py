@@ -4,33 +4,150 @@
  Simple controller for bluno, working on linux
       Bluetooth low energy
 """
-import sys, serial, threading, time, queue
+import os, sys, time, select, threading, queue
 
 # BLE stuff
-from bluepy.btle import DefaultDelegate, Peripheral
+from bluepy.btle import DefaultDelegate, Peripheral, BTLEException
+
+from framing import FrameAssembler
+from packets import PacketWriter, DEFAULT_MTU
+from bluno import Pianos
+from gattcache import bluepySerialHandle
+from replies import replyType, expectedReply
 
 # globals
-global q, buffer
+#   q: complete replies (without CR) from the bluno
+global q
 
 # callback class
 class MyDelegate(DefaultDelegate):
     def __init__(self):
         DefaultDelegate.__init__(self)
+        self.assembler = FrameAssembler(callback=self.frameReceived)
 
     def handleNotification(self, cHandle, data):
-        global q, buffer
         # perhaps check cHandle
         # print(f'next data: {data}')
-        buffer += data
-        # print(f'buffer: {buffer}')
+        self.assembler.feed(data)
+
+    def frameReceived(self, frame):
+        q.put(frame)
+
+# BlunoDevice           = Pianos['Piano 001']
+# BlunoDevice           = Pianos['Piano 002']
+BlunoDevice           = Pianos['Piano 003']
+
+
+class BlunoIO(threading.Thread):
+    """ the only thread that uses the Peripheral
+          writes come in through a queue, in between the thread sleeps in
+          poll() on the output of bluepy-helper and a wakeup pipe: a
+          notification or a write wakes it, idle it does not wake at all.
+          Without the helper pipe it polls every 'interval' s.
+          closed() is called when the thread ends, default: None on q.
+    """
+    def __init__(self, per, interval=0.01, closed=None):
+        super().__init__(daemon=True)
+        self.per = per
+        self.interval = interval
+        self.closed = closed if closed is not None else lambda: q.put(None)
+
+        # get the characteristic, the handle is cached for known devices
+        self.handle = bluepySerialHandle(per)
+        # writes are split on the payload size of the negotiated MTU
+        self.packets = PacketWriter(self.writeSerial, mtu=self.negotiatedMtu(per))
+
+        self.writes = queue.SimpleQueue()
+        self.stopping = threading.Event()
+        self.finished = False
+        self.error = None
+        # write() and stop() wake the io thread through this pipe
+        self.wakeup, self.waker = os.pipe()
+        os.set_blocking(self.waker, False)
+        self.wakeLock = threading.Lock()
+
+    @staticmethod
+    def negotiatedMtu(per):
+        try:
+            return int(per.status().get('mtu', [DEFAULT_MTU])[0])
+        except Exception:
+            return DEFAULT_MTU
+
+    # from other threads, nothing happens once the io thread has ended
+    def write(self, data):
+        if not self.finished:
+            self.writes.put(data)
+            self.wake()
+
+    def wake(self):
+        with self.wakeLock:
+            if self.waker is None:
+                return
+            try:
+                os.write(self.waker, b'w')
+            except BlockingIOError:
+                pass            # full, the thread wakes anyway
+
+    def stop(self):
+        self.stopping.set()
+        self.wake()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+            self.closePipe()
+
+    def closePipe(self):
+        with self.wakeLock:
+            if self.waker is not None:
+                os.close(self.waker)
+                os.close(self.wakeup)
+                self.waker = self.wakeup = None
 
-# BlunoDevice           = "50:65:83:99:4B:54"      # Piano 001
-# BlunoDevice           = "50:65:83:99:48:3A"      # Piano 002
-BlunoDevice           = "50:65:83:99:4B:5E"      # Piano 003
-PrimarService         = '0000dfb0-0000-1000-8000-00805f9b34fb'
-ModelNumberStringUUID = '00002a24-0000-1000-8000-00805f9b34fb'
-CommandUUID           = '0000dfb2-0000-1000-8000-00805f9b34fb'
-SerialPortUUID        = '0000dfb1-0000-1000-8000-00805f9b34fb'
+    # io thread
+    def writeSerial(self, data):
+        self.per.writeCharacteristic(self.handle, data)
+
+    def poller(self):
+        """ poll() on the bluepy-helper output (bluepy internals) and the wakeup pipe """
+        helper = getattr(self.per, '_helper', None)
+        if helper is None or helper.stdout is None:
+            return None
+        poller = select.poll()
+        poller.register(helper.stdout, select.POLLIN)
+        poller.register(self.wakeup, select.POLLIN)
+        return poller
+
+    def waitForEvents(self, poller):
+        if poller is None:
+            self.per.waitForNotifications(self.interval)
+            return
+        for fd, _ in poller.poll():
+            if fd == self.wakeup:
+                os.read(self.wakeup, 4096)
+            else:
+                # a line of the helper is there, a short timeout: it can be a status line
+                self.per.waitForNotifications(0.001)
+
+    def run(self):
+        try:
+            poller = self.poller()
+            while not self.stopping.is_set():
+                if not self.writes.empty():
+                    # everything queued goes out together, packed in packets
+                    while not self.writes.empty():
+                        self.packets.write(self.writes.get_nowait())
+                    self.packets.flush()
+                # returns at the first notification or write
+                self.waitForEvents(poller)
+        except BTLEException as ex:
+            self.error = ex
+            print(f'Connection lost: {ex}')
+        finally:
+            self.finished = True
+            self.closed()
+            try:
+                self.per.disconnect()
+            except Exception:
+                pass
 
 
 class ControlBluno:
@@ -38,9 +155,8 @@ class ControlBluno:
 
         # set callback for notifications
         per.withDelegate(MyDelegate())
-
-        # get the characteristic
-        self.c = per.getCharacteristics(uuid=SerialPortUUID)[0]
+        self.io = BlunoIO(per)
+        self.done = threading.Event()
         # enable notification
         # setup_data = b'\0x01'
         # self.c.write(setup_data, withResponse=True)
@@ -48,11 +164,34 @@ class ControlBluno:
         
     def start(self):
         self.alive = True
+        self.io.start()
         self.transmitter_thread = threading.Thread(target=self.writer, daemon=True)
         self.transmitter_thread.start()
 
+    def stop(self):
+        self.alive = False
+        self.io.stop()
+
+    def request(self, cmd, timeout=1.0):
+        """ send cmd and wait for its reply, returns None on timeout.
+            A reply of another type is a late one of an earlier request, it is skipped.
+        """
+        # replies of earlier requests that timed out are stale now
+        while not q.empty():
+            q.get_nowait()
+        self.io.write((cmd + '\r').encode())
+        expected = expectedReply(cmd)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                reply = q.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                return None
+            # None: the io thread has ended
+            if reply is None or replyType(reply) in expected:
+                return reply
+
     def writer(self):
-        global buffer
         try:
             while self.alive:
                 try:
@@ -62,16 +201,12 @@ class ControlBluno:
                     if line[0] == 'q':
                         self.alive = False
                         break
-                    else:
-                        line += '\r'
-                        self.c.write(line.encode())
-                    time.sleep(0.1)
-                    next_line = buffer
-                    if (len(next_line) == 0) or next_line[-1] != ord('\r'):  # beetje knullig
-                        time.sleep(0.3)
-                        next_line = buffer
-                        print("even gewacht")
-                    buffer = b''
+                    next_line = self.request(line)
+                    if not self.io.is_alive():
+                        break
+                    if next_line is None:
+                        print("no reply")
+                        continue
 
                     # process result
                     print(f'{next_line.decode()}')
@@ -86,42 +221,39 @@ class ControlBluno:
             message = template.format(type(ex).__name__, ex.args)
             print (message)
             self.alive = False
+        finally:
+            self.done.set()
 
 #  Start of program
 
 
 def mainprog(device):
-    global q, buffer
+    global q
     if len(sys.argv) == 2:
         device = str(sys.argv[1])
     elif len(sys.argv) != 1:
         print('Usage: blueTerminal [device]')
         sys.exit(1)
 
-    buffer = b''
     q = queue.SimpleQueue()
     
     try:
-        blunocon = ControlBluno(device)
-    except serial.SerialException as e:
+        # connect to device
+        per = Peripheral(device, "public")
+        blunocon = ControlBluno(per)
+    except BTLEException as e:
         sys.stderr.write("could not open device %r: %s\n" % (device, e))
         sys.exit(1)
     
     blunocon.start()
 
-    while True:
-        if per.waitForNotifications(0.5):
-            continue
-        try:
-            blunocon.transmitter_thread.join(0.05)
-        except KeyboardInterrupt:
-            print("keyboard interrupt")
-            sys.exit(0)
-        if not blunocon.transmitter_thread.isAlive():
-            break
+    # the io thread does the work, wait for the user to quit
+    try:
+        blunocon.done.wait()
+    except KeyboardInterrupt:
+        print("keyboard interrupt")
+    finally:
+        blunocon.stop()
 
 if __name__ == '__main__':
-
-    # connect to device
-    per = Peripheral(BlunoDevice, "public")
-    mainprog(per)
+    mainprog(BlunoDevice)
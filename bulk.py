@@ -0,0 +1,255 @@
+"""
+ Bulk transfer of a block into the EEPROM of the bluno
+     streams the bytes with write without response instead of one
+     request/response per command, paced by credits from the board. Progress
+     is confirmed by the board, so a transfer resumes where it stopped, and
+     checked with a CRC over what the board has stored.
+
+ Bulk mode (not in test3.ino yet, emulator.Bluno(bulk=True) has it):
+     W<offset>:<count>   -> Bulk: <credit>   the next count bytes are data for offset..
+     data                -> Got: <n>         every credit/2 bytes, n bytes stored so far
+                         -> End: <n>         after the last byte, or after IDLE s without data
+     S<offset>:<count>   -> Sum: <crc16>     CRC-CCITT (arq.crc16) of the stored bytes
+     Firmware without bulk mode answers W with 'ack'.
+
+ The block is sent in segments of at most 'segment' bytes, at most credit
+ bytes are sent that the board did not confirm. After the End of a segment
+ the stored bytes from the start of the block are checked with S: the next
+ segment starts at the confirmed position, after a wrong checksum (a lost
+ write shifts the bytes after it) at the end of the last good check. The
+ check after the last segment covers the whole block. When nothing is heard
+ for timeout the segment is opened again. After a reconnect the same
+ BulkSender is started on the new link.
+
+     sender = await bulkWrite(bluno, pidTable(20, 1, 0, 20, 1, 0, 0, 0))
+     print(sender.bytesPerSecond())
+"""
+import time, struct, asyncio
+
+from arq import crc16
+from replies import parseReply, Ack, Bulk, Got, End, Sum
+
+EEPROMSIZE = 1024
+IDLE       = 0.25     # s without data before the board leaves bulk mode
+# EEPROM layout of test3.ino: pval1, ival1, dval1, pval2, ival2, dval2 (unsigned), pos1, pos2 (int)
+EEPROMLAYOUT = struct.Struct('<6I2i')
+
+# states of a BulkSender
+STOPPED   = 'stopped'
+OPENING   = 'opening'
+STREAMING = 'streaming'
+VERIFYING = 'verifying'
+DONE      = 'done'
+FAILED    = 'failed'
+
+
+class BulkError(Exception):
+    pass
+
+
+def pidTable(pval1, ival1, dval1, pval2, ival2, dval2, pos1, pos2) -> bytes:
+    """ the parameter block at EEPROM address 0, ValueError for values that do not fit """
+    values = (pval1, ival1, dval1, pval2, ival2, dval2, pos1, pos2)
+    for i, value in enumerate(values):
+        if i < 6 and not 0 <= value < 2 ** 32:
+            raise ValueError(f'PID value {value} is not an unsigned 32 bit number')
+        if i >= 6 and not -2 ** 31 <= value < 2 ** 31:
+            raise ValueError(f'position {value} is not a 32 bit number')
+    return EEPROMLAYOUT.pack(*values)
+
+
+class BulkSender:
+    """ one block to the board, without I/O of its own
+
+        write(bytes) sends without response, replyReceived(frame) gets the
+        replies while the transfer runs, call poll() periodically.
+        progress(confirmed, total) is called when the board confirms bytes,
+        confirmed is where a new transfer of the same block can resume.
+    """
+    def __init__(self, data, offset=0, write=None, payload=20, segment=512, timeout=0.5, retries=5,
+                 progress=None, confirmed=0, clock=time.monotonic):
+        if offset < 0 or offset + len(data) > EEPROMSIZE:
+            raise ValueError(f'block of {len(data)} bytes at {offset} does not fit in the EEPROM')
+        self.data      = bytes(data)
+        self.offset    = offset
+        self.write     = write
+        self.payload   = payload
+        self.segmentSize = segment
+        self.timeout   = timeout
+        self.retries   = retries
+        self.progress  = progress
+        self.clock     = clock
+
+        self.state     = STOPPED
+        self.error     = ''
+        self.confirmed = confirmed     # bytes stored on the board
+        self.verified  = confirmed     # bytes with a good checksum
+        self.segment   = confirmed     # where the open W started
+        self.segmentEnd = confirmed
+        self.sent      = confirmed
+        self.credit    = 0
+        self.heard     = 0.0
+        self.started   = None
+        self.finished  = None
+
+        # counters
+        self.opens     = 0             # W commands
+        self.checks    = 0             # S commands
+        self.restarts  = 0             # stalls and checksum failures
+        self.failures  = 0             # restarts since verified last advanced
+        self.bytesSent = 0             # data bytes, resends included
+
+    @property
+    def total(self) -> int:
+        return len(self.data)
+
+    def running(self) -> bool:
+        return self.state in (OPENING, STREAMING, VERIFYING)
+
+    def command(self, text: bytes):
+        self.heard = self.clock()
+        self.write(text + b'\r')
+
+    def start(self):
+        """ open the next segment at the confirmed position """
+        if self.started is None:
+            self.started = self.clock()
+        self.error = ''
+        self.segment = self.sent = self.confirmed
+        self.segmentEnd = min(self.total, self.confirmed + max(1, self.segmentSize))
+        self.credit = 0
+        if self.confirmed == self.total:
+            self.verify()
+            return
+        self.state = OPENING
+        self.opens += 1
+        self.command(b'W%d:%d' % (self.offset + self.confirmed, self.segmentEnd - self.confirmed))
+
+    def verify(self):
+        """ checksum of the stored bytes from the start of the block """
+        self.state = VERIFYING
+        self.checks += 1
+        self.command(b'S%d:%d' % (self.offset, self.confirmed))
+
+    def pump(self):
+        while self.sent < self.segmentEnd and self.sent - self.confirmed < self.credit:
+            n = min(self.payload, self.segmentEnd - self.sent, self.credit - (self.sent - self.confirmed))
+            self.write(self.data[self.sent:self.sent + n])
+            self.sent += n
+            self.bytesSent += n
+
+    def advance(self, count):
+        self.setConfirmed(min(self.segmentEnd, max(self.confirmed, self.segment + count)))
+
+    def setConfirmed(self, confirmed):
+        if confirmed != self.confirmed:
+            self.confirmed = confirmed
+            if self.progress is not None:
+                self.progress(confirmed, self.total)
+
+    def replyReceived(self, frame) -> bool:
+        """ False for replies that are not for the transfer """
+        if not self.running():
+            return False
+        reply = parseReply(frame)
+        kind = type(reply)
+        if kind is Ack and self.state == OPENING:
+            self.fail('firmware without bulk mode')
+        elif kind is Bulk and self.state == OPENING:
+            self.credit = reply.credit
+            self.state = STREAMING
+            self.pump()
+        elif kind is Got and self.state == STREAMING:
+            self.advance(reply.count)
+            self.pump()
+        elif kind is End and self.state == STREAMING:
+            # end of the segment, or the board timed out waiting for lost bytes
+            self.advance(reply.count)
+            self.verify()
+        elif kind is Sum and self.state == VERIFYING:
+            if reply.crc != crc16(self.data[:self.confirmed]):
+                # a lost write shifted the bytes after it, back to the last good check
+                self.setConfirmed(self.verified)
+                self.restart('checksum mismatch')
+            else:
+                if self.confirmed > self.verified:
+                    self.failures = 0
+                self.verified = self.confirmed
+                if self.confirmed == self.total:
+                    self.state = DONE
+                    self.finished = self.clock()
+                else:
+                    self.start()
+        else:
+            return False
+        self.heard = self.clock()
+        return True
+
+    def restart(self, reason):
+        """ retries counts the restarts in a row, a good check with progress resets it """
+        self.restarts += 1
+        self.failures += 1
+        if self.failures > self.retries:
+            self.fail(f'{reason}, gave up after {self.retries} retries without progress')
+            return
+        if self.state == VERIFYING and self.verified != self.confirmed:
+            self.verify()
+        else:
+            self.start()
+
+    def poll(self):
+        """ start again when the board went quiet """
+        if self.running() and self.clock() - self.heard > self.timeout:
+            self.restart(f'no reply while {self.state}')
+
+    def stop(self):
+        """ the link is gone, start() on the next one resumes """
+        if self.running():
+            self.state = STOPPED
+
+    def fail(self, message):
+        self.state = FAILED
+        self.error = message
+        self.finished = self.clock()
+
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished if self.finished is not None else self.clock()) - self.started
+
+    def bytesPerSecond(self) -> float:
+        """ confirmed bytes per s since the start """
+        elapsed = self.elapsed()
+        return self.confirmed / elapsed if elapsed > 0 else 0.0
+
+
+async def bulkWrite(bluno, data, offset=0, progress=None, segment=512, timeout=0.5, retries=5,
+                    interval=0.02):
+    """ data (bytes, or a BulkSender to resume) into the EEPROM through a transport.AsyncBluno
+
+        Commands given meanwhile wait until the transfer is done. Returns the
+        BulkSender, raises BulkError when the board refuses or the retries are
+        used up and ConnectionError when the link goes, the sender then has the
+        progress to resume with.
+    """
+    if isinstance(data, BulkSender):
+        sender = data
+    else:
+        sender = BulkSender(data, offset, segment=segment, timeout=timeout, retries=retries,
+                            progress=progress, clock=asyncio.get_event_loop().time)
+    sender.write = bluno.sendUnacked
+    sender.payload = bluno.packets.payloadSize
+    await bluno.exclusive(sender.replyReceived)
+    try:
+        sender.start()
+        while sender.running():
+            if not bluno.transport.connected:
+                sender.stop()
+                raise ConnectionError(f'link lost after {sender.confirmed} of {sender.total} bytes')
+            await asyncio.sleep(interval)
+            sender.poll()
+    finally:
+        bluno.release()
+    if sender.state == FAILED:
+        raise BulkError(sender.error)
+    return sender
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+"""
+ Capture of the traffic with a bluno, and replay of a capture
+     every write and notification is recorded with a monotonic timestamp,
+     direction, handle and payload. Recording only queues the record, a
+     background thread writes the file.
+
+ File:   b'BLUNOCAP' | version (u16)
+         records: time_ns (i64) | direction (u8) | handle (u16) | length (u16) | payload
+
+   python3 capture.py dump session.cap
+   python3 capture.py replay session.cap [--speed 10 | --asap]
+"""
+import sys, time, mmap, queue, struct, argparse, threading
+
+MAGIC    = b'BLUNOCAP'
+VERSION  = 1
+FILEHEAD = struct.Struct('<8sH')
+RECORD   = struct.Struct('<qBHH')
+
+# directions
+WRITE  = 0
+NOTIFY = 1
+READ   = 2
+DIRECTIONS = {WRITE: 'write', NOTIFY: 'notify', READ: 'read'}
+
+_STOP = None
+
+
+class CaptureWriter:
+
+    def __init__(self, filename, bufsize=1 << 16):
+        self.filename = filename
+        self.file     = open(filename, 'wb', buffering=bufsize)
+        self.file.write(FILEHEAD.pack(MAGIC, VERSION))
+        self.queue    = queue.SimpleQueue()
+        self.records  = 0
+        self.thread   = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def record(self, direction, handle, data):
+        """ called on the hot path: only timestamps and queues """
+        self.queue.put((time.monotonic_ns(), direction, handle, bytes(data)))
+
+    def write(self, handle, data):
+        self.record(WRITE, handle, data)
+
+    def notify(self, handle, data):
+        self.record(NOTIFY, handle, data)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            t, direction, handle, data = item
+            self.file.write(RECORD.pack(t, direction, handle, len(data)))
+            self.file.write(data)
+            self.records += 1
+        self.file.close()
+
+    def close(self):
+        self.queue.put(_STOP)
+        self.thread.join()
+
+
+class CaptureReader:
+    """ memory mapped capture, records are (time_ns, direction, handle, payload bytes)
+        payloads are copies, so close() does not depend on what the caller keeps
+    """
+
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        self.map  = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = FILEHEAD.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{filename} is not a bluno capture')
+
+    def __iter__(self):
+        pos = FILEHEAD.size
+        end = len(self.map)
+        while pos + RECORD.size <= end:
+            t, direction, handle, length = RECORD.unpack_from(self.map, pos)
+            pos += RECORD.size
+            if pos + length > end:
+                break          # capture cut off while writing
+            yield t, direction, handle, self.map[pos:pos + length]
+            pos += length
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+def replay(reader, notify, write=None, speed=1.0, sleep=time.sleep):
+    """ feed a capture back: notify(handle, data) for notifications and reads,
+        write(handle, data) for writes. speed None is as fast as possible.
+    """
+    start = None
+    startWall = time.monotonic()
+    for t, direction, handle, data in reader:
+        if start is None:
+            start = t
+        if speed:
+            wait = (t - start) / 1e9 / speed - (time.monotonic() - startWall)
+            if wait > 0:
+                sleep(wait)
+        if direction == WRITE:
+            if write is not None:
+                write(handle, data)
+        else:
+            notify(handle, data)
+
+
+def replayInto(reader, pipeline, speed=None):
+    """ replay through a CommandPipeline: writes become commands again, so the
+        replies are matched just like in the session. Returns the futures.
+    """
+    futures = []
+    pending = bytearray()
+
+    def write(handle, data):
+        pending.extend(data)
+        while b'\r' in pending:
+            end = pending.index(b'\r')
+            futures.append(pipeline.submit(pending[:end].decode(errors='replace')))
+            del pending[:end + 1]
+
+    replay(reader, lambda handle, data: pipeline.feed(data), write, speed)
+    return futures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bluno capture files')
+    sub = parser.add_subparsers(dest='action')
+    p = sub.add_parser('dump', help='print the records')
+    p.add_argument('capture')
+    p = sub.add_parser('replay', help='replay through the command pipeline')
+    p.add_argument('capture')
+    p.add_argument('--speed', type=float, default=1.0, help='1 is real time')
+    p.add_argument('--asap', action='store_true', help='as fast as possible')
+    args = parser.parse_args()
+    if args.action is None:
+        parser.print_help()
+        sys.exit(1)
+
+    reader = CaptureReader(args.capture)
+    if args.action == 'dump':
+        start = None
+        for t, direction, handle, data in reader:
+            start = t if start is None else start
+            print(f'{(t - start) / 1e6:10.3f} ms {DIRECTIONS.get(direction, "?"):6s} '
+                  f'0x{handle:04x} {bytes(data)!r}')
+    else:
+        from pipeline import CommandPipeline
+        pipeline = CommandPipeline(lambda data: None, window=1 << 16, timeout=float('inf'))
+        start = time.perf_counter()
+        futures = replayInto(reader, pipeline, None if args.asap else args.speed)
+        elapsed = time.perf_counter() - start
+        for f in futures:
+            if f.done() and f.exception() is None:
+                print(f.result().decode(errors='replace'))
+            else:
+                print('<no reply>')
+        print(f'{len(futures)} commands replayed in {elapsed * 1e3:.1f} ms', file=sys.stderr)
+    reader.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+ Coalesced updates for the QML side
+     notifications can come in at hundreds per second, a binding on a
+     property that is notified for each of them repaints for each of them.
+     The Coalescer collects the changes and publishes them together, at most
+     rate times per second (default 60, a display frame). No timer runs
+     while nothing changes.
+
+     ui = Coalescer(60, parent)
+     ui.mark('bluno', self.characChanged.emit)     # emitted once at the next frame
+     ui.add([cmd, reply])                          # in the batch of published
+"""
+from PyQt5.QtCore import QObject, QTimer, Qt, QVariant, pyqtSignal
+
+
+class Coalescer(QObject):
+
+    published = pyqtSignal(QVariant)      # the items added since the last frame
+
+    def __init__(self, rate=60, parent=None):
+        super().__init__(parent)
+        self.changed  = {}       # key -> emit, called once per frame
+        self.batch    = []
+        self.posted   = 0        # changes and items since the start
+        self.frames   = 0        # times published
+        self.timer    = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.flush)
+        self.setRate(rate)
+
+    def setRate(self, rate):
+        self.rate = max(1, rate)
+        self.timer.setInterval(int(1000 / self.rate))
+
+    def mark(self, key, emit):
+        self.changed[key] = emit
+        self.posted += 1
+        self.schedule()
+
+    def add(self, item):
+        self.batch.append(item)
+        self.posted += 1
+        self.schedule()
+
+    def schedule(self):
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self):
+        changed, self.changed = self.changed, {}
+        batch, self.batch = self.batch, []
+        self.frames += 1
+        for emit in changed.values():
+            emit()
+        if batch:
+            self.published.emit(batch)
@@ -0,0 +1,386 @@
+"""
+ Emulated bluno: test3.ino in python behind a model of the BLE link
+     for measuring pipelining, framing and scheduling without a board.
+
+     transport = EmulatedTransport(Bluno(), Link(interval=0.0075, loss=0.01, seed=1))
+     async with AsyncBluno(transport) as bluno:
+         await bluno.request('e')
+
+ Bluno follows the firmware byte by byte, including its quirks:
+     - the command buffer is 10 bytes and is not cleared, a command of 10
+       characters wraps to an empty buffer and gets no reply, a longer one
+       continues at the start of the buffer
+     - values are read with atoi() up to the end of the buffer, so the digits
+       of an earlier, longer command can follow (pl12345 then pl9 sets 92345)
+     - replies longer than the 21 characters of printstr are counted in overflows
+ test3.ino has no encoder interrupts and no controller: the encoders keep the
+ value read from the EEPROM, only X1 changes them. Bluno(follow=True) moves
+ them towards the setpoints at 'speed' counts/s while the control is on.
+ Bluno(bulk=True) adds the bulk mode of bulk.py (W, S), which test3.ino does not have.
+ Bluno(binary=True) answers B1 with 'Bin: 1' and talks arq.py frames from the
+ first SYNC byte on (text is ASCII): commands and replies in DATA frames,
+ SETPOINT frames answered with ack. Until then B1 can be repeated.
+
+ Link delivers packets of at most 'payload' bytes at connection events,
+ 'perEvent' packets per event and direction, with jitter and notification loss.
+ The serial line between the board and its BLE chip adds 10 bits per byte.
+ EmulatedTransport.send() writes with response, one write per two connection
+ events (request and response), sendUnacked() without.
+"""
+import math, time, random, asyncio
+
+from transport import Transport
+from arq import crc16, ArqLink, SYNC, DATA, SETPOINT, decodeSetpoint
+from bulk import EEPROMSIZE, EEPROMLAYOUT, IDLE
+
+CR = 13
+COMMANDSIZE = 10
+PRINTSIZE   = 22
+BULKCREDIT  = 64      # the serial receive buffer
+
+UP   = 'up'       # host -> board
+DOWN = 'down'     # board -> host
+
+
+def int32(n: int) -> int:
+    return (n + 2 ** 31) % 2 ** 32 - 2 ** 31
+
+
+def atoi(buf, pos: int) -> int:
+    """ C atoi on a buffer that is not NUL terminated: stops at the end of the buffer """
+    end = len(buf)
+    while pos < end and buf[pos] in b' \t\n\v\f\r':
+        pos += 1
+    negative = pos < end and buf[pos] == ord('-')
+    if pos < end and buf[pos] in b'+-':
+        pos += 1
+    value = 0
+    while pos < end and 48 <= buf[pos] <= 57:
+        value = value * 10 + buf[pos] - 48
+        pos += 1
+    return int32(-value if negative else value)
+
+
+class Bluno:
+    """ test3.ino, receive() gets the bytes from the BLE chip and returns the serial output """
+
+    def __init__(self, eeprom=None, speed=2000.0, bulk=False, follow=False, binary=False,
+                 clock=time.monotonic):
+        self.eeprom    = bytearray(eeprom if eeprom is not None else bytes(EEPROMSIZE))
+        self.speed     = speed
+        self.follow    = follow
+        self.bulk      = bulk
+        self.binary    = binary
+        self.clock     = clock
+        self.command   = bytearray(COMMANDSIZE)
+        self.comind    = 0
+        self.setpoint1 = self.setpoint2 = 0
+        self.encoder1  = self.encoder2 = 0
+        self.control   = 0
+        self.speed1    = 0
+        self.pids      = (0,) * 6
+        self.commands  = 0
+        self.overflows = 0
+        self.last      = clock()
+        # bulk mode
+        self.bulkAt    = 0
+        self.bulkLeft  = 0
+        self.bulkDone  = 0
+        self.heard     = self.last
+        # binary mode
+        self.link      = None         # arq.ArqLink after B1
+        self.linkOut   = bytearray()
+        self.framed    = False        # the host sent a frame, no more text
+
+        # setup()
+        self.retrieve()
+        self.setpoint1, self.setpoint2 = self.encoder1, self.encoder2
+
+    def receive(self, data) -> bytes:
+        self.heard = self.clock()
+        if self.framed:
+            return self.linkReceived(data)
+        return self.receiveText(data)
+
+    def receiveText(self, data) -> bytes:
+        out = bytearray()
+        for pos, b in enumerate(data):
+            if self.bulkLeft:
+                out += self.store(b)
+            elif b == SYNC and self.link is not None and not self.framed:
+                # after B1 the first frame ends the text
+                self.framed = True
+                return bytes(out + self.linkReceived(data[pos:]))
+            elif b == CR:
+                if self.comind > 0:
+                    out += self.execute()
+            else:
+                self.command[self.comind] = b
+                self.comind += 1
+                if self.comind > COMMANDSIZE - 1:     # throw away commands that are too long
+                    self.comind = 0
+        return bytes(out)
+
+    def execute(self) -> bytes:
+        self.commands += 1
+        self.advance()
+        cmd = self.command
+        reply = b'ack\r'
+        mot = cmd[1] - ord('l')
+        kind = cmd[0]
+        if kind == ord('i'):
+            reply = b'XXInfo: %d, %d\r' % (self.setpoint1, self.setpoint2)
+        elif kind == ord('X'):
+            if cmd[1] == ord('0'):
+                self.save()
+            else:
+                self.retrieve()
+        elif kind == ord('e'):
+            reply = b'Enc: %d, %d\r' % (self.encoder1, self.encoder2)
+        elif kind == ord('p'):
+            if not mot:
+                self.setpoint1 = atoi(cmd, 2)
+            else:
+                self.setpoint2 = atoi(cmd, 2)
+        elif kind == ord('c'):
+            self.control = int(cmd[1] != ord('0'))
+            reply = b'Control: %d\r' % self.control
+        elif kind == ord('q'):
+            self.control = 0
+            self.speed1 = atoi(cmd, 1) & 0xFF
+        elif self.bulk and kind in (ord('W'), ord('S')):
+            reply = self.bulkCommand(kind, bytes(cmd[1:self.comind]))
+        elif self.binary and kind == ord('B') and cmd[1] == ord('1'):
+            reply = b'Bin: 1\r'
+            if self.link is None:
+                self.link = ArqLink(self.linkOut.extend, self.frameReceived, clock=self.clock)
+        self.comind = 0
+        if len(reply) > PRINTSIZE - 1:
+            self.overflows += 1
+        return reply
+
+    def advance(self):
+        """ with follow, the encoders move to the setpoints while the control is on """
+        if not self.follow:
+            return
+        now = self.clock()
+        step = int(self.speed * (now - self.last))
+        if step <= 0:
+            return
+        self.last = now
+        if self.control:
+            self.encoder1 += max(-step, min(step, self.setpoint1 - self.encoder1))
+            self.encoder2 += max(-step, min(step, self.setpoint2 - self.encoder2))
+
+    # bulk mode: the new commands only read the characters received
+    def bulkCommand(self, kind, args) -> bytes:
+        offset, _, count = args.partition(b':')
+        try:
+            offset, count = int(offset), int(count)
+        except ValueError:
+            return b'ack\r'
+        if offset < 0 or count < 0 or offset + count > len(self.eeprom):
+            return b'ack\r'
+        if kind == ord('S'):
+            return b'Sum: %d\r' % crc16(self.eeprom[offset:offset + count])
+        self.bulkAt, self.bulkLeft, self.bulkDone = offset, count, 0
+        return b'Bulk: %d\r' % BULKCREDIT
+
+    def store(self, b) -> bytes:
+        self.eeprom[self.bulkAt] = b
+        self.bulkAt += 1
+        self.bulkLeft -= 1
+        self.bulkDone += 1
+        if not self.bulkLeft:
+            return b'End: %d\r' % self.bulkDone
+        if self.bulkDone % (BULKCREDIT // 2) == 0:
+            return b'Got: %d\r' % self.bulkDone
+        return b''
+
+    def tick(self) -> bytes:
+        """ leaves bulk mode after IDLE s without data, retransmits in binary mode """
+        if self.bulkLeft and self.clock() - self.heard >= IDLE:
+            self.bulkLeft = 0
+            return b'End: %d\r' % self.bulkDone
+        if self.link is not None:
+            self.link.poll()
+            return self.linkOutput()
+        return b''
+
+    def tickIn(self):
+        """ s until tick() has work, None without """
+        if self.bulkLeft:
+            return max(0.0, self.heard + IDLE - self.clock())
+        if self.link is not None and self.link.pending():
+            return self.link.timeout
+        return None
+
+    # binary mode
+    def linkReceived(self, data) -> bytes:
+        self.link.dataReceived(data)
+        return self.linkOutput()
+
+    def linkOutput(self) -> bytes:
+        out = bytes(self.linkOut)
+        self.linkOut.clear()
+        return out
+
+    def frameReceived(self, ftype, payload):
+        if ftype == SETPOINT:
+            motor, value = decodeSetpoint(payload)
+            if not motor:
+                self.setpoint1 = int32(value)
+            else:
+                self.setpoint2 = int32(value)
+            self.link.submit(DATA, b'ack')
+        elif ftype == DATA:
+            # the command buffer of the text commands, a reply per CR
+            for reply in self.receiveText(bytes(payload) + b'\r').split(b'\r')[:-1]:
+                self.link.submit(DATA, reply)
+
+    def save(self):
+        EEPROMLAYOUT.pack_into(self.eeprom, 0, *self.pids, int32(self.encoder1), int32(self.encoder2))
+
+    def retrieve(self):
+        *self.pids, self.encoder1, self.encoder2 = EEPROMLAYOUT.unpack_from(self.eeprom, 0)
+
+
+class Link:
+    """ when packets arrive: connection events, payload size, jitter and loss """
+
+    def __init__(self, interval=0.0075, payload=20, perEvent=4, jitter=0.0, loss=0.0, writeLoss=0.0,
+                 baud=115200, seed=0):
+        self.interval  = interval
+        self.payload   = payload
+        self.perEvent  = perEvent
+        self.jitter    = jitter
+        self.loss      = loss          # notifications
+        self.writeLoss = writeLoss     # writes without response
+        self.baud      = baud
+        self.rng       = random.Random(seed)
+        self.origin    = 0.0
+        self.slots     = {}            # direction -> [event, packets in it]
+        self.last      = {}            # direction -> time of the last delivery
+        self.packets   = 0
+        self.lost      = 0
+
+    def start(self, now):
+        self.origin = now
+        self.slots = {}
+        self.last = {}
+
+    def serialTime(self, nbytes) -> float:
+        return nbytes * 10 / self.baud
+
+    def slot(self, direction, now) -> float:
+        event = math.floor((now - self.origin) / self.interval) + 1
+        current = self.slots.setdefault(direction, [0, 0])
+        if event > current[0]:
+            current[:] = [event, 0]
+        if current[1] == self.perEvent:
+            current[:] = [current[0] + 1, 0]
+        current[1] += 1
+        return self.origin + current[0] * self.interval
+
+    def schedule(self, direction, now, data) -> list:
+        """ [(time, packet), ...] for data sent at now """
+        deliveries = []
+        loss = self.loss if direction == DOWN else self.writeLoss
+        for i in range(0, len(data), self.payload):
+            t = self.slot(direction, now)
+            self.packets += 1
+            if loss and self.rng.random() < loss:
+                self.lost += 1
+                continue
+            if self.jitter:
+                t += self.rng.uniform(0, self.jitter)
+            # packets of one direction stay in order, also for timers at the same time
+            t = max(t, self.last.get(direction, 0.0) + 1e-6)
+            self.last[direction] = t
+            deliveries.append((t, data[i:i + self.payload]))
+        return deliveries
+
+
+class EmulatedTransport(Transport):
+    """ Transport to an emulated bluno, on the asyncio loop clock """
+
+    def __init__(self, board=None, link=None, binary=False):
+        super().__init__()
+        self.board  = board
+        self.link   = link if link is not None else Link()
+        self.binary = binary       # the default board has the binary link of arq.py
+        self.responseAt = 0.0      # the last write with response is answered
+        self.idle   = None         # timer for board.tick()
+
+    async def connect(self):
+        loop = asyncio.get_event_loop()
+        if self.board is None:
+            self.board = Bluno(binary=self.binary, clock=loop.time)
+        self.link.start(loop.time())
+        self.connected = True
+
+    def send(self, data: bytes):
+        # one write request at a time, the next after the response
+        loop = asyncio.get_event_loop()
+        now = max(loop.time(), self.responseAt)
+        arrivals = self.write(now, data)
+        if arrivals:
+            self.responseAt = arrivals[-1] + self.link.interval
+
+    def sendUnacked(self, data: bytes):
+        self.write(asyncio.get_event_loop().time(), data)
+
+    def write(self, now, data) -> list:
+        if not self.connected:
+            raise ConnectionError('emulator not connected')
+        loop = asyncio.get_event_loop()
+        arrivals = []
+        for t, packet in self.link.schedule(UP, now, bytes(data)):
+            loop.call_at(t, self.boardReceived, packet)
+            arrivals.append(t)
+        return arrivals
+
+    def boardReceived(self, packet):
+        if not self.connected:
+            return
+        self.boardOutput(self.board.receive(packet))
+        self.armIdle()
+
+    def armIdle(self):
+        delay = self.board.tickIn()
+        if delay is not None and self.idle is None:
+            self.idle = asyncio.get_event_loop().call_later(delay, self.boardIdle)
+
+    def boardIdle(self):
+        # the board also times out when the link is gone
+        self.idle = None
+        self.boardOutput(self.board.tick())
+        if self.connected:
+            self.armIdle()
+
+    def boardOutput(self, output):
+        if not output:
+            return
+        loop = asyncio.get_event_loop()
+        ready = loop.time() + self.link.serialTime(len(output))
+        for t, notification in self.link.schedule(DOWN, ready, output):
+            loop.call_at(t, self.deliver, notification)
+
+    def deliver(self, notification):
+        if self.connected:
+            self.dataReceived(notification)
+
+
+def addLinkArguments(parser):
+    """ the Link options for the command line tools """
+    parser.add_argument('--interval', type=float, default=0.0075, help='emulator: connection interval in s')
+    parser.add_argument('--per-event', dest='perEvent', type=int, default=4,
+                        help='emulator: packets per connection event and direction')
+    parser.add_argument('--jitter', type=float, default=0.0, help='emulator: extra delay up to this, s')
+    parser.add_argument('--loss', type=float, default=0.0, help='emulator: notification loss, 0..1')
+    parser.add_argument('--seed', type=int, default=0, help='emulator: random seed of jitter and loss')
+
+
+def linkFromArgs(args) -> Link:
+    return Link(interval=args.interval, perEvent=args.perEvent, jitter=args.jitter,
+                loss=args.loss, seed=args.seed)
@@ -0,0 +1,53 @@
+"""
+ Framing of the serial stream of the bluno
+     replies of test3.ino are ended with a carriage return (CR)
+"""
+from ringbuffer import RingBuffer
+
+CR = b'\r'
+
+
+class FrameAssembler:
+    """ Collects notification data and cuts it into CR terminated frames.
+
+        Every complete frame (without the CR) is returned by feed() and,
+        when given, passed to callback.
+        Data is kept in a ring buffer, a full buffer without a CR is garbage
+        and is thrown away (counted in dropped).
+    """
+    def __init__(self, callback=None, delimiter=CR, capacity=4096):
+        self.callback  = callback
+        self.delimiter = delimiter
+        self.ring      = RingBuffer(capacity)
+        self.dropped   = 0
+
+    def feed(self, data) -> list:
+        frames = []
+        data = memoryview(data)
+        while len(data):
+            if self.ring.isFull():
+                self.dropped += self.ring.available()
+                self.ring.clear()
+            room = self.ring.capacity - self.ring.available()
+            n = self.ring.write(data[:room])
+            data = data[n:]
+            self.extract(frames)
+        return frames
+
+    def extract(self, frames):
+        while True:
+            frame = self.ring.readFrame(self.delimiter)
+            if frame is None:
+                return
+            if len(frame) == 0:
+                continue
+            frames.append(frame)
+            if self.callback is not None:
+                self.callback(frame)
+
+    def pending(self) -> bytes:
+        """ data received after the last CR """
+        return self.ring.peek()
+
+    def reset(self):
+        self.ring.clear()
@@ -0,0 +1,102 @@
+"""
+ On disk cache of the GATT layout of known devices
+     the bluno DFB0 service never changes, so after the first discovery
+     the Serial characteristic can be used without discovering again.
+
+ Layout (json), keyed by device address:
+   { "50:65:83:99:4B:5E": { "services": [ { "uuid": ..., "name": ..., "type": ...,
+                                             "characteristics": [ { "uuid": ..., "name": ...,
+                                                                    "handle": 37, "properties": 30 } ] } ] } }
+"""
+import os, json
+
+from bluno import PrimarService, SerialPortUUID
+
+CACHEFILE = os.environ.get('BLUNO_GATT_CACHE',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'bluno', 'gatt.json'))
+
+
+def normalUuid(uuid: str) -> str:
+    return uuid.strip('{}').lower()
+
+
+class GattCache:
+
+    def __init__(self, filename=CACHEFILE):
+        self.filename = filename
+        self.devices  = {}
+        try:
+            with open(filename) as f:
+                self.devices = json.load(f)
+        except (OSError, ValueError):
+            self.devices = {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.devices, f, indent=1)
+        os.replace(tmp, self.filename)
+
+    def get(self, address: str):
+        return self.devices.get(address.upper())
+
+    def store(self, address: str, services: list):
+        """ services: list of dicts as in the layout above """
+        self.devices[address.upper()] = {'services': services}
+        self.save()
+
+    def storeService(self, address: str, service: dict):
+        """ add or replace one service of a device """
+        entry = self.devices.setdefault(address.upper(), {'services': []})
+        uuid = normalUuid(service['uuid'])
+        entry['services'] = [s for s in entry['services'] if normalUuid(s['uuid']) != uuid]
+        entry['services'].append(service)
+        self.save()
+
+    def forget(self, address: str):
+        if self.devices.pop(address.upper(), None) is not None:
+            self.save()
+
+    def characteristic(self, address: str, serviceUuid: str, charUuid: str):
+        entry = self.get(address)
+        if entry is None:
+            return None
+        for s in entry['services']:
+            if normalUuid(s['uuid']) != normalUuid(serviceUuid):
+                continue
+            for c in s.get('characteristics', []):
+                if normalUuid(c['uuid']) == normalUuid(charUuid):
+                    return c
+        return None
+
+    def serialHandle(self, address: str):
+        """ value handle of the bluno Serial characteristic, None when unknown """
+        c = self.characteristic(address, PrimarService, SerialPortUUID)
+        return None if c is None else c.get('handle')
+
+
+def bluepySerialHandle(per, cache=None) -> int:
+    """ value handle of the Serial characteristic of a connected bluepy Peripheral.
+        A cached handle is checked with one read, only when that fails the
+        characteristics are discovered (and the cache updated).
+    """
+    if cache is None:
+        cache = GattCache()
+    handle = cache.serialHandle(per.addr)
+    if handle is not None:
+        try:
+            per.readCharacteristic(handle)
+            return handle
+        except Exception:
+            print('Warning: cached Serial handle failed, discovering')
+
+    c = per.getCharacteristics(uuid=SerialPortUUID)[0]
+    cache.storeService(per.addr, {
+        'uuid': PrimarService,
+        'name': '',
+        'type': '',
+        'characteristics': [{'uuid': SerialPortUUID, 'name': 'Serial',
+                             'handle': c.getHandle(), 'properties': c.properties}],
+    })
+    return c.getHandle()
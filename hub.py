@@ -0,0 +1,205 @@
+"""
+ Session hub: many bluno boards connected at the same time
+     every board gets a BlunoSession with its own controller, command
+     pipeline and reply framing. All sessions run on the Qt event loop,
+     there are no threads per device.
+
+ From Python:
+     hub = SessionHub()
+     hub.addDevice(Pianos['Piano 001'])
+     future = hub.request(Pianos['Piano 001'], 'e')
+ From QML (registered as Bluno.SessionHub):
+     hub.addDevice(address); hub.send(address, 'e'); onReplyReceived: ...
+"""
+from concurrent.futures import Future
+
+from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot, pyqtProperty, QVariant, QByteArray, QTimer
+from PyQt5 import QtBluetooth as QtBt
+
+from bluno import PrimarService, SerialPortUUID
+from pipeline import CommandPipeline
+from scheduler import chain
+from packets import PacketWriter
+
+
+class BlunoSession(QObject):
+
+    ready          = pyqtSignal(str)                     # address
+    disconnected   = pyqtSignal(str)
+    replyReceived  = pyqtSignal(str, str, QByteArray)    # address, command, reply
+    notified       = pyqtSignal(str, QByteArray)         # address, raw notification
+    errorOccurred  = pyqtSignal(str, str)                # address, message
+
+    def __init__(self, address: str, window=4, parent=None):
+        super().__init__(parent)
+        self.address = address
+        self.service = None
+        self.serial  = None          # the Serial QLowEnergyCharacteristic
+        self.isReady = False
+        self.writeMode = QtBt.QLowEnergyService.WriteMode.WriteWithResponse
+
+        self.packets  = PacketWriter(self.writeSerial)
+        self.pipeline = CommandPipeline(self.packets.write, window=window,
+                                        completed=self.commandCompleted,
+                                        flush=self.packets.flush,
+                                        defer=lambda flush: QTimer.singleShot(0, flush))
+        # commands given before the Serial channel is ready
+        self.backlog  = []
+
+        info = QtBt.QBluetoothDeviceInfo(QtBt.QBluetoothAddress(address), '', 0)
+        info.setCoreConfigurations(QtBt.QBluetoothDeviceInfo.LowEnergyCoreConfiguration)
+        self.controller = QtBt.QLowEnergyController.createCentral(info, self)
+        self.controller.connected.connect(self.deviceConnected)
+        self.controller.disconnected.connect(self.deviceDisconnected)
+        self.controller.error.connect(self.controllerError)
+        self.controller.discoveryFinished.connect(self.serviceScanDone)
+
+        self.timeoutTimer = QTimer(self)
+        self.timeoutTimer.setInterval(100)
+        self.timeoutTimer.timeout.connect(self.pipeline.checkTimeouts)
+
+    def connectToDevice(self):
+        self.controller.connectToDevice()
+
+    def disconnectFromDevice(self):
+        self.controller.disconnectFromDevice()
+
+    @pyqtSlot()
+    def deviceConnected(self):
+        self.controller.discoverServices()
+
+    @pyqtSlot()
+    def serviceScanDone(self):
+        self.service = self.controller.createServiceObject(QtBt.QBluetoothUuid(PrimarService), self)
+        if self.service is None:
+            self.fail('No bluno serial service')
+            return
+        self.service.stateChanged.connect(self.serviceStateChanged)
+        self.service.characteristicChanged.connect(self.charChanged)
+        self.service.error.connect(self.serviceError)
+        self.service.discoverDetails()
+
+    @pyqtSlot(QtBt.QLowEnergyService.ServiceState)
+    def serviceStateChanged(self, state):
+        if state != QtBt.QLowEnergyService.ServiceDiscovered:
+            return
+        self.serial = self.service.characteristic(QtBt.QBluetoothUuid(SerialPortUUID))
+        if not self.serial.isValid():
+            self.fail('No Serial characteristic')
+            return
+        if hasattr(self.controller, 'mtu'):
+            self.packets.setMtu(self.controller.mtu())
+        self.isReady = True
+        self.timeoutTimer.start()
+        self.ready.emit(self.address)
+        backlog, self.backlog = self.backlog, []
+        for cmd, future in backlog:
+            # cancelled while waiting: not sent
+            if future.set_running_or_notify_cancel():
+                chain(self.pipeline.submit(cmd), future)
+
+    def failBacklog(self, reason):
+        backlog, self.backlog = self.backlog, []
+        for cmd, future in backlog:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(ConnectionError(reason))
+
+    def fail(self, message):
+        """ the session will not get ready: fail the commands waiting for it """
+        self.failBacklog(f'{self.address}: {message}')
+        self.errorOccurred.emit(self.address, message)
+
+    @pyqtSlot()
+    def deviceDisconnected(self):
+        self.isReady = False
+        self.timeoutTimer.stop()
+        self.packets.clear()
+        self.pipeline.clear(f'{self.address} disconnected')
+        self.failBacklog(f'{self.address} disconnected')
+        self.disconnected.emit(self.address)
+
+    @pyqtSlot(QtBt.QLowEnergyController.Error)
+    def controllerError(self, error):
+        self.fail(self.controller.errorString() or f'controller error {error}')
+
+    @pyqtSlot(QtBt.QLowEnergyService.ServiceError)
+    def serviceError(self, error):
+        self.errorOccurred.emit(self.address, f'service error {error}')
+
+    # commands
+    def request(self, cmd: str):
+        """ queue cmd (without CR), returns a Future with the reply """
+        if self.isReady:
+            return self.pipeline.submit(cmd)
+        future = Future()
+        self.backlog.append((cmd, future))
+        return future
+
+    def writeSerial(self, data: bytes, mode=None):
+        self.service.writeCharacteristic(self.serial, data, self.writeMode if mode is None else mode)
+
+    @pyqtSlot(QtBt.QLowEnergyCharacteristic, QByteArray)
+    def charChanged(self, c, value):
+        self.notified.emit(self.address, value)
+        self.pipeline.feed(bytes(value))
+
+    def commandCompleted(self, cmd, reply):
+        self.replyReceived.emit(self.address, cmd.text, QByteArray(reply))
+
+
+class SessionHub(QObject):
+
+    sessionsChanged = pyqtSignal()
+    deviceReady     = pyqtSignal(str)
+    deviceLost      = pyqtSignal(str)
+    replyReceived   = pyqtSignal(str, str, QByteArray)    # address, command, reply
+    errorOccurred   = pyqtSignal(str, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.sessions = {}          # type: Dict[str, BlunoSession]
+
+    @pyqtSlot(str)
+    def addDevice(self, address: str):
+        if address in self.sessions:
+            return
+        session = BlunoSession(address, parent=self)
+        session.ready.connect(self.deviceReady)
+        session.disconnected.connect(self.deviceLost)
+        session.replyReceived.connect(self.replyReceived)
+        session.errorOccurred.connect(self.errorOccurred)
+        self.sessions[address] = session
+        session.connectToDevice()
+        self.sessionsChanged.emit()
+
+    @pyqtSlot(str)
+    def removeDevice(self, address: str):
+        session = self.sessions.pop(address, None)
+        if session is None:
+            return
+        session.disconnectFromDevice()
+        session.deleteLater()
+        self.sessionsChanged.emit()
+
+    def session(self, address: str) -> BlunoSession:
+        return self.sessions[address]
+
+    def request(self, address: str, cmd: str):
+        return self.sessions[address].request(cmd)
+
+    def broadcast(self, cmd: str) -> dict:
+        """ send cmd to all boards, returns address -> Future """
+        return {address: s.request(cmd) for address, s in self.sessions.items()}
+
+    @pyqtSlot(str, str)
+    def send(self, address: str, cmd: str):
+        self.request(address, cmd)
+
+    @pyqtSlot(str)
+    def sendAll(self, cmd: str):
+        self.broadcast(cmd)
+
+    def getAddresses(self):
+        return list(self.sessions.keys())
+
+    addresses = pyqtProperty(QVariant, getAddresses, notify=sessionsChanged)
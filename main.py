@@ -1,10 +1,71 @@
-import sys, time
+import os, sys, time, json
+
+# startup milestones are measured from here, see benchmark.py startup
+STARTED = time.perf_counter()
 
 from PyQt5.QtGui import QGuiApplication
 from PyQt5.QtQml import QQmlApplicationEngine, qmlRegisterType
-from PyQt5.QtCore import QVariant, QObject, pyqtSignal, pyqtSlot, pyqtProperty, QMetaObject, Qt, QTimer, QByteArray
+from PyQt5.QtCore import QVariant, QObject, pyqtSignal, pyqtSlot, pyqtProperty, QMetaObject, Qt, QTimer, QByteArray, QUrl, QFile
 from PyQt5 import QtBluetooth as QtBt
 
+from pipeline import CommandPipeline
+from scheduler import CommandScheduler
+from packets import PacketWriter
+from hub import SessionHub
+from gattcache import GattCache, normalUuid
+from bluno import Pianos, PrimarService, SerialPortUUID
+from models import ObjectListModel, ObjectPool
+from telemetry import TelemetryStreamer
+from capture import CaptureWriter, READ
+from metrics import Metrics
+from coalesce import Coalescer
+from bulk import BulkSender, pidTable, STOPPED, DONE
+import reconnect
+
+# QBluetoothUuid registers its meta type when the first one is made. Before the
+# slots of Device are declared, or they do not match a python signal made later
+# with it (qtemulator, imported when it is used)
+QtBt.QBluetoothUuid()
+
+# seconds since STARTED of the first time something happened
+milestones = {}
+
+
+def milestone(name):
+    if name not in milestones:
+        milestones[name] = time.perf_counter() - STARTED
+
+
+def connectOnce(signal, slot):
+    """ connect, unless it is connected already """
+    try:
+        signal.disconnect(slot)
+    except TypeError:
+        pass
+    signal.connect(slot)
+
+
+def advertisesBluno(info: QtBt.QBluetoothDeviceInfo) -> bool:
+    """ advertises the bluno serial service """
+    uuids = info.serviceUuids()
+    if isinstance(uuids, tuple):      # Qt 5: (uuids, completeness)
+        uuids = uuids[0]
+    return any(normalUuid(u.toString()) == PrimarService for u in uuids)
+
+
+def cached(getter):
+    """ display fields are computed once, the *Changed signal clears the cache """
+    key = getter.__name__
+
+    def wrapper(self):
+        try:
+            return self.m_cache[key]
+        except KeyError:
+            value = self.m_cache[key] = getter(self)
+            return value
+    wrapper.__name__ = key
+    return wrapper
+
 
 class DeviceInfo(QObject):
 
@@ -12,15 +73,25 @@ class DeviceInfo(QObject):
 
     def __init__(self, d=None):
         QObject.__init__(self)
-        if d is not None:
-            self.device = d
+        self.m_cache = {}
+        self.device = d if d is not None else QtBt.QBluetoothDeviceInfo()
+        self.deviceChanged.connect(self.m_cache.clear)
 
+    @cached
     def getAddress(self):
         return self.device.address().toString()
 
+    @cached
     def getName(self):
         return self.device.name()
 
+    @cached
+    def getRssi(self):
+        return self.device.rssi()
+
+    def isBluno(self):
+        return advertisesBluno(self.device)
+
     def getDevice(self):
         return self.device
 
@@ -30,6 +101,7 @@ class DeviceInfo(QObject):
 
     deviceName = pyqtProperty(str, getName, notify=deviceChanged)
     deviceAddress = pyqtProperty(str, getAddress, notify=deviceChanged)
+    deviceRssi = pyqtProperty(int, getRssi, notify=deviceChanged)
 
 
 class ServiceInfo(QObject):
@@ -38,17 +110,24 @@ class ServiceInfo(QObject):
 
     def __init__(self, s: QtBt.QLowEnergyService = None):
         QObject.__init__(self)
-        if s is not None:
-            self.serv = s
+        self.m_cache = {}
+        self.serv = s
+        self.serviceChanged.connect(self.m_cache.clear)
 
     def service(self):
         return self.serv
 
+    def setService(self, s: QtBt.QLowEnergyService):
+        self.serv = s
+        self.serviceChanged.emit()
+
+    @cached
     def getName(self) -> str:
         if self.serv is None:
             return ''
         return self.serv.serviceName()
 
+    @cached
     def getType(self):
         if self.serv is None:
             return ''
@@ -64,6 +143,7 @@ class ServiceInfo(QObject):
         result = '<' + result + '>'
         return result
 
+    @cached
     def getUuid(self):
         if self.serv is None:
             return ''
@@ -94,8 +174,9 @@ class CharacteristicInfo(QObject):
 
     def __init__(self, characteristic: QtBt.QLowEnergyCharacteristic = None):
         QObject.__init__(self)
-        if characteristic is not None:
-            self.characteristic = characteristic
+        self.m_cache = {}
+        self.characteristic = characteristic
+        self.characteristicChanged.connect(self.m_cache.clear)
 
     def setCharacteristic(self, characteristic: QtBt.QLowEnergyCharacteristic):
         self.characteristic = characteristic
@@ -104,6 +185,7 @@ class CharacteristicInfo(QObject):
     def getDescriptor(self, uuid):
         return self.characteristic.descriptor(uuid)
 
+    @cached
     def getName(self) -> str:
         name = self.characteristic.name()
         if name is not '':
@@ -122,6 +204,7 @@ class CharacteristicInfo(QObject):
 
         return name
 
+    @cached
     def getUuid(self) -> str:
         uuid = self.characteristic.uuid()
         success = False
@@ -133,6 +216,7 @@ class CharacteristicInfo(QObject):
             return '0x' + str(result32)
         return uuid.toString()  # {} er nog afhalen
 
+    @cached
     def getValue(self) -> str:
         a = self.characteristic.value()
         result = ''
@@ -145,9 +229,11 @@ class CharacteristicInfo(QObject):
         # result += a.toHex()
         return str(result)
 
+    @cached
     def getHandle(self) -> str:
         return '0x' + str(self.characteristic.handle())    # nog hex van maken
 
+    @cached
     def getPermission(self) -> str:
         properties = '( '
         permission = self.characteristic.properties()
@@ -196,54 +282,179 @@ class Device(QObject):
     stateChanged           = pyqtSignal()
     disconnected           = pyqtSignal()
     randomAddressChanged   = pyqtSignal()
+    serialReady            = pyqtSignal()     # Serial channel ready without selecting it
+    reconnected            = pyqtSignal()     # Serial channel back after a dropout
+    connectionStateChanged = pyqtSignal()
+    scanFilterChanged      = pyqtSignal()
 
     def __init__(self, parent=None):
         super().__init__(parent)
 
         # instance variables. Er is maar 1 instance?
         self.currentDevice     = DeviceInfo()     # type: DeviceInfo
-        self.devices           = []               # type: List[DeviceInfo]
-        self.m_services        = []               # type: List[QObject]
+        # list models for the views, items are streamed in
+        self.devices           = ObjectListModel([('deviceName', DeviceInfo.getName),
+                                                  ('deviceAddress', DeviceInfo.getAddress),
+                                                  ('deviceRssi', DeviceInfo.getRssi)], self,
+                                                 key=DeviceInfo.getAddress)
+        self.m_services        = ObjectListModel([('serviceName', ServiceInfo.getName),
+                                                  ('serviceUuid', ServiceInfo.getUuid),
+                                                  ('serviceType', ServiceInfo.getType)], self,
+                                                 key=ServiceInfo.getUuid)
         self.currentService    = None
+        self.wiredService      = None     # service with the Serial handlers connected
         self.currentCharacteristic = None
-        self.m_characteristics = []               # type: List[QObject]
+        self.m_characteristics = ObjectListModel([('characteristicName', CharacteristicInfo.getName),
+                                                  ('characteristicUuid', CharacteristicInfo.getUuid),
+                                                  ('characteristicValue', CharacteristicInfo.getValue),
+                                                  ('characteristicHandle', CharacteristicInfo.getHandle),
+                                                  ('characteristicPermission', CharacteristicInfo.getPermission)],
+                                                 self, key=lambda c: normalUuid(c.getUuid()))
+        # one info object per address / uuid, reused for every scan and connection
+        self.devicePool        = ObjectPool(DeviceInfo, DeviceInfo.setDevice, limit=256)
+        self.servicePool       = ObjectPool(ServiceInfo, self.reuseService, limit=64)
+        self.characteristicPool = ObjectPool(CharacteristicInfo, CharacteristicInfo.setCharacteristic, limit=256)
         self.m_previousAddress = ''
         self.m_message         = ''
         self.connected         = False
         self.m_deviceScanState = False
         self.randomAddress     = False
+        # targeted discovery: only blunos and/or the wanted addresses,
+        #   the scan stops when all wanted addresses are found
+        self.m_onlyBlunos      = False
+        self.wanted            = set()
+        self.seen              = set()    # wanted addresses found by the current scan
+
+        # known GATT layouts, skip selecting service and characteristic
+        self.gattCache         = GattCache()
+        self.fastPath          = False
 
         self.blcomm            = ''
         self.blresult          = QByteArray()
 
-        self.discoveryAgent = QtBt.QBluetoothDeviceDiscoveryAgent()
-        self.discoveryAgent.setLowEnergyDiscoveryTimeout(5000)
-
-        self.discoveryAgent.deviceDiscovered.connect(self.addDevice)
-        self.discoveryAgent.error.connect(self.deviceScanError)
-        self.discoveryAgent.finished.connect(self.deviceScanFinished)
+        # commands to the bluno, replies are matched in FIFO order
+        #   and written in MTU sized packets. Waiting commands are sent by
+        #   priority, superseded setpoints and duplicate polls are not sent
+        self.packets           = PacketWriter(self.writeSerial)
+        self.scheduler         = CommandScheduler()
+        self.pipeline          = CommandPipeline(self.packets.write, window=4,
+                                                 completed=self.commandCompleted,
+                                                 unsolicited=self.unsolicitedReply,
+                                                 flush=self.packets.flush,
+                                                 defer=lambda flush: QTimer.singleShot(0, flush),
+                                                 scheduler=self.scheduler)
+        self.m_writeNoResponse = False
+        self.pipelineTimer     = QTimer(self)
+        self.pipelineTimer.setInterval(100)
+        self.pipelineTimer.timeout.connect(self.checkPipeline)
+
+        # instrumentation, stats property and a Prometheus text file
+        self.metrics           = Metrics()
+        self.metricsFile       = os.environ.get('BLUNO_METRICS_FILE', '')
+        self.statsTimer        = QTimer(self)
+        self.statsTimer.setInterval(1000)
+        self.statsTimer.timeout.connect(self.publishStats)
+        self.statsTimer.start()
+
+        # supervised connection: reconnect after a dropout
+        self.m_connectionState = reconnect.UNCONNECTED
+        self.reconnectPolicy   = reconnect.REPLAY
+        self.backoff           = reconnect.Backoff()
+        self.userDisconnect    = False
+        self.lostAt            = 0.0
+        self.wasStreaming      = False
+        self.reconnectTimer    = QTimer(self)
+        self.reconnectTimer.setSingleShot(True)
+        self.reconnectTimer.timeout.connect(self.reconnectAttempt)
+
+        # capture of writes and notifications, see capture.py
+        self.capture           = None
+
+        # polling of the encoders
+        self.m_telemetry       = TelemetryStreamer(self.sendtoBluno, parent=self)
+
+        # bulk transfer to the EEPROM, holds the commands while it runs
+        self.bulk              = None
+        self.bulkTimer         = QTimer(self)
+        self.bulkTimer.setInterval(20)
+        self.bulkTimer.timeout.connect(self.bulkTick)
+
+        # replies reach the views at most once per display frame
+        self.ui                = Coalescer(60, self)
+        self.ui.published.connect(self.repliesReceived)
+
+        # created on the first scan, opening the adapter does not delay the first frame
+        self.discoveryAgent = None
+        # an emulated bluno next to (or instead of) the real ones, see qtemulator.py
+        self.emulator = None
+        if os.environ.get('BLUNO_EMULATOR'):
+            from qtemulator import Emulator
+            self.setEmulator(Emulator())
 
         self.controller = None
         self.setUpdate('Search')
 
+    def agent(self):
+        if self.discoveryAgent is None:
+            self.discoveryAgent = QtBt.QBluetoothDeviceDiscoveryAgent(self)
+            self.discoveryAgent.setLowEnergyDiscoveryTimeout(5000)
+
+            self.discoveryAgent.deviceDiscovered.connect(self.addDevice)
+            if hasattr(self.discoveryAgent, 'deviceUpdated'):        # Qt 5.12
+                self.discoveryAgent.deviceUpdated.connect(self.addDevice)
+            self.discoveryAgent.error.connect(self.deviceScanError)
+            self.discoveryAgent.finished.connect(self.deviceScanFinished)
+            self.discoveryAgent.canceled.connect(self.deviceScanFinished)
+            milestone('agentCreated')
+        return self.discoveryAgent
+
     # Discoverling devices
+    #   devices are streamed into the list as they are found, a device seen
+    #   again (or an rssi update) updates its row
     @pyqtSlot(QtBt.QBluetoothDeviceInfo)
     def addDevice(self, info):
         # print(f'Device discovered: {info.name()}')
-        if info.coreConfigurations() & QtBt.QBluetoothDeviceInfo.LowEnergyCoreConfiguration:
+        if not info.coreConfigurations() & QtBt.QBluetoothDeviceInfo.LowEnergyCoreConfiguration:
+            return
+        if self.mergeDevice(info):
+            milestone('firstDevice')
             self.setUpdate(f'Last device added: {info.name()}')
+            self.devicesUpdated.emit()
+        address = info.address().toString()
+        if address in self.wanted:
+            self.seen.add(address)
+        # the list keeps devices of earlier scans, only what this scan found counts
+        if self.wanted and self.wanted <= self.seen and self.discoveryAgent.isActive():
+            # everything we were looking for is there, no need to wait for the timeout
+            self.discoveryAgent.stop()
+
+    def mergeDevice(self, info) -> bool:
+        """ add or update the device, True when it was added """
+        address = info.address().toString()
+        known = self.devices.find(address)
+        if known is not None:
+            known.setDevice(info)
+            return False
+        if self.m_onlyBlunos and not (address in self.wanted or advertisesBluno(info)):
+            return False
+        if self.wanted and not self.m_onlyBlunos and address not in self.wanted:
+            return False
+        d = self.devicePool.get(address, info)
+        self.devices.append(d, d.deviceChanged)
+        return True
 
     @pyqtSlot()
     def deviceScanFinished(self):
-        foundDevices = self.discoveryAgent.discoveredDevices()
-        for nextDevice in foundDevices:
+        # backends that do not report every device on the way
+        for nextDevice in self.discoveryAgent.discoveredDevices():
             if nextDevice.coreConfigurations() & QtBt.QBluetoothDeviceInfo.LowEnergyCoreConfiguration:
-                self.devices.append(DeviceInfo(nextDevice))
+                self.mergeDevice(nextDevice)
 
         self.devicesUpdated.emit()
         self.m_deviceScanState = False
         self.stateChanged.emit()
-        if self.devices is []:
+        milestone('scanFinished')
+        if len(self.devices) == 0:
             self.setUpdate('No Low Engergy devices found...')
         else:
             self.setUpdate('Done! Scan Again!')
@@ -262,20 +473,64 @@ class Device(QObject):
         self.m_deviceScanState = False
         self.devicesUpdated.emit()
         self.stateChanged.emit()
+        milestone('scanFinished')
 
     # called from main.qml when menu button pressed
+    #   the list is kept, found devices are merged into it
     @pyqtSlot()
     def startDeviceDiscovery(self):
-        self.devices = []  # en de rest?
-        self.devicesUpdated.emit()
+        if self.discoveryAgent is not None and self.discoveryAgent.isActive():
+            return
+
+        if self.emulator is not None:
+            # found at once, no adapter needed
+            if self.mergeDevice(self.emulator.deviceInfo()):
+                milestone('firstDevice')
+            self.devicesUpdated.emit()
+            milestone('scanFinished')
+            self.setUpdate('Done! Scan Again!')
+            return
 
         self.setUpdate('Scanning for devices ...')
-        self.discoveryAgent.start(QtBt.QBluetoothDeviceDiscoveryAgent.DiscoveryMethod(2))  # ?
+        self.seen = set()
+        self.agent().start(QtBt.QBluetoothDeviceDiscoveryAgent.DiscoveryMethod(2))  # ?
 
         if self.discoveryAgent.isActive():
+            milestone('scanStarted')
             self.m_deviceScanState = True
             self.stateChanged.emit()
 
+    @pyqtSlot()
+    def clearDevices(self):
+        self.devices.clear()
+        self.devicePool.clear()
+        self.devicesUpdated.emit()
+
+    @pyqtSlot()
+    def findPianos(self):
+        """ scan for the known boards only, stops as soon as they are all found """
+        self.setWanted(list(Pianos.values()))
+        self.setOnlyBlunos(True)
+        self.startDeviceDiscovery()
+
+    def setEmulator(self, emulator):
+        """ qtemulator.Emulator, scans find it and connecting to its address uses it; None: the adapter """
+        self.emulator = emulator
+
+    def getOnlyBlunos(self):
+        return self.m_onlyBlunos
+
+    def setOnlyBlunos(self, only):
+        self.m_onlyBlunos = only
+        self.scanFilterChanged.emit()
+
+    def getWanted(self):
+        return sorted(self.wanted)
+
+    def setWanted(self, addresses):
+        self.wanted = {a.upper() for a in addresses or []}
+        self.scanFilterChanged.emit()
+
     def getDevices(self):
         return self.devices
 
@@ -291,28 +546,30 @@ class Device(QObject):
     # called from main.qml when service scanning is selected, switching to Services.qml
     @pyqtSlot(str)
     def scanServices(self, address: str):
-        for d in self.devices:
-            if d.getAddress() == address:
-                self.currentDevice.setDevice(d.getDevice())
-                break
-            
+        d = self.devices.find(address)
+        if d is not None:
+            self.currentDevice.setDevice(d.getDevice())
+
         if not self.currentDevice.getDevice().isValid():
             print(f'Warning: Not a valid device')
             return
 
-        self.m_characteristics = []
+        self.m_characteristics.clear()
         self.characteristicsUpdated.emit()
-        self.m_services = []
+        self.m_services.clear()
         self.servicesUpdated.emit()
 
         self.setUpdate('Back\n(Connecting to device...)')
+        self.fastPath = self.gattCache.serialHandle(self.currentDevice.getAddress()) is not None
 
         if self.controller and self.m_previousAddress != self.currentDevice.getAddress():
-            self.controller.disconnectFromDevice()
-            self.controller = None
+            self.releaseController()
 
         if self.controller is None:
-            self.controller = QtBt.QLowEnergyController.createCentral(self.currentDevice.getDevice())
+            if self.emulator is not None and self.currentDevice.getAddress() == self.emulator.address:
+                self.controller = self.emulator.controller()
+            else:
+                self.controller = QtBt.QLowEnergyController.createCentral(self.currentDevice.getDevice())
             self.controller.connected.connect(self.deviceConnected)
             self.controller.error.connect(self.errorReceived)
             self.controller.disconnected.connect(self.deviceDisconnected)
@@ -323,10 +580,31 @@ class Device(QObject):
             self.controller.setRemoteAddressType(QtBt.QLowEnergyController.RandomAddress)
         else:
             self.controller.setRemoteAddressType(QtBt.QLowEnergyController.PublicAddress)
+        self.userDisconnect = False
+        self.setConnectionState(reconnect.CONNECTING)
         self.controller.connectToDevice()
 
         self.m_previousAddress = self.currentDevice.getAddress()
 
+    def releaseController(self):
+        """ the old controller (and its services) go, without their signals reaching us """
+        controller, self.controller = self.controller, None
+        self.unwireService()
+        self.currentService = None
+        for serviceInfo in self.servicePool.objects.values():
+            serviceInfo.serv = None           # children of the controller
+        self.m_services.clear()
+        for signal in (controller.connected, controller.error, controller.disconnected,
+                       controller.serviceDiscovered, controller.discoveryFinished):
+            signal.disconnect()
+        if hasattr(controller, 'mtuChanged'):
+            try:
+                controller.mtuChanged.disconnect()
+            except TypeError:
+                pass
+        controller.disconnectFromDevice()
+        controller.deleteLater()
+
     # Slots with scanServices
     @pyqtSlot()
     def deviceConnected(self):
@@ -337,52 +615,152 @@ class Device(QObject):
     @pyqtSlot(QtBt.QLowEnergyController.Error)
     def errorReceived(self, error=None):
         self.setUpdate(f'Back\n{self.controller.errorString()}')
+        self.metrics.count('errors')
+        if self.m_connectionState == reconnect.RECONNECTING:
+            self.scheduleReconnect()
         # en verder?
 
     @pyqtSlot()
     def deviceDisconnected(self):
         print('Warning Disconnect from device')
+        self.metrics.count('disconnects')
+        if self.m_connectionState == reconnect.RECONNECTING:
+            self.scheduleReconnect()
+            return
+        if self.m_connectionState == reconnect.READY and not self.userDisconnect:
+            # dropout: keep the session and reconnect
+            self.lostAt = time.monotonic()
+            self.wasStreaming = self.m_telemetry.isRunning()
+            self.m_telemetry.stop()
+            self.pipeline.pause()
+            if self.bulk is not None:
+                self.bulk.stop()
+            # the queued packets hold commands of the pipeline, they go again or not at all
+            self.packets.clear()
+            if self.reconnectPolicy == reconnect.REPLAY:
+                self.pipeline.requeue()
+            else:
+                self.pipeline.clear('disconnected')
+            self.backoff.reset()
+            self.setConnectionState(reconnect.RECONNECTING)
+            self.scheduleReconnect()
+            return
+        self.giveUp()
+
+    def giveUp(self):
+        self.reconnectTimer.stop()
+        self.unwireService()
+        self.m_telemetry.stop()
+        if self.bulk is not None:
+            self.bulk.fail('disconnected')
+            self.finishBulk()
+        self.packets.clear()
+        self.pipeline.clear('disconnected')
+        self.pipeline.resume()
+        self.setConnectionState(reconnect.UNCONNECTED)
         self.disconnected.emit()
 
+    def scheduleReconnect(self):
+        if self.reconnectTimer.isActive():
+            return
+        delay = self.backoff.next()
+        if delay is None:
+            print('Warning: reconnect failed, giving up')
+            self.giveUp()
+            return
+        self.setUpdate(f'Back\n(Reconnecting, attempt {self.backoff.attempt})')
+        self.reconnectTimer.start(int(delay * 1000))
+
+    @pyqtSlot()
+    def reconnectAttempt(self):
+        if self.controller is None or self.userDisconnect:
+            return
+        # straight to the Serial channel again
+        self.m_characteristics.clear()
+        self.m_services.clear()
+        self.fastPath = True
+        self.controller.connectToDevice()
+
+    def sessionResumed(self):
+        recover = time.monotonic() - self.lostAt
+        print(f'Reconnected after {recover:.2f} s')
+        self.metrics.recovered(recover)
+        # a bulk transfer resumes first, see bulkTick
+        if self.bulk is None:
+            self.pipeline.resume()
+        if self.wasStreaming:
+            self.m_telemetry.start()
+        self.reconnected.emit()
+
+    def setConnectionState(self, state):
+        self.m_connectionState = state
+        self.connectionStateChanged.emit()
+
+    def getConnectionState(self):
+        return self.m_connectionState
+
+    def getReconnectPolicy(self):
+        return self.reconnectPolicy
+
+    def setReconnectPolicy(self, policy):
+        if policy in (reconnect.REPLAY, reconnect.FAIL):
+            self.reconnectPolicy = policy
+
     @pyqtSlot(QtBt.QBluetoothUuid)
     def addLowEnergyService(self, servUuid: QtBt.QBluetoothUuid):
-        service = self.controller.createServiceObject(servUuid)
+        # a child of the controller, it goes with it
+        service = self.controller.createServiceObject(servUuid, self.controller)
         if not service:
             print('Warning: Cannot create service for uuid')
             return
-        serv = ServiceInfo(service)
-        self.m_services.append(serv)
+        serv = self.servicePool.get(self.poolKey(servUuid), service)
+        # the view gets the row inserted, no servicesUpdated for every service
+        self.m_services.append(serv, serv.serviceChanged)
         # print(f'Added {serv.getName()}  lijst {self.m_services}')
-        self.servicesUpdated.emit()
+
+    def poolKey(self, *uuids):
+        """ services and characteristics are pooled per device, the same uuid on another device is another object """
+        return (self.currentDevice.getAddress(),) + tuple(normalUuid(u.toString()) for u in uuids)
+
+    def reuseService(self, serviceInfo, service):
+        """ pooled ServiceInfo gets the service object of this connection, the old one is deleted """
+        old = serviceInfo.service()
+        if old is not None and old is not service:
+            if old is self.wiredService:
+                self.unwireService()
+            if old is self.currentService:
+                self.currentService = None
+            old.deleteLater()
+        serviceInfo.setService(service)
+
+    def listCharacteristics(self, service):
+        for ch in service.characteristics():
+            c = self.characteristicPool.get(self.poolKey(service.serviceUuid(), ch.uuid()), ch)
+            self.m_characteristics.append(c, c.characteristicChanged)
 
     @pyqtSlot()
     def serviceScanDone(self):
         self.setUpdate('Back\n(Service scan done!)')
-        if self.m_services == []:
-            self.servicesUpdated.emit()
+        self.servicesUpdated.emit()
+        if self.fastPath:
+            # only the bluno service needs its details
+            self.connectToService(normalUuid(PrimarService))
 
 
     # called from Services.qml when service is selected and switching to Characteristic.qml
     @pyqtSlot(str)
     def connectToService(self, uuid: str):
-        for s in self.m_services:
-            serviceInfo = s
-            if not serviceInfo:
-                continue
-
-            if serviceInfo.getUuid() == uuid:
-                service = serviceInfo.service()
-                self.currentService = service
-                break
-
-        if not service:
+        serviceInfo = self.m_services.find(uuid)
+        if serviceInfo is None or not serviceInfo.service():
             return
+        service = serviceInfo.service()
+        self.currentService = service
 
-        self.m_characteristics = []
+        self.m_characteristics.clear()
         self.characteristicsUpdated.emit()
 
         if service.state() == QtBt.QLowEnergyService.DiscoveryRequired:
-            service.stateChanged.connect(self.serviceDetailsDiscovered)
+            connectOnce(service.stateChanged, self.serviceDetailsDiscovered)
             service.discoverDetails()
             self.setUpdate('Back\n(Discovering details...)')
             return
@@ -390,14 +768,11 @@ class Device(QObject):
         print('Wanneer deze code hier?')
         # andere states:  InvalidService, DiscoveringServices, ServiceDiscovered, LocalService
 
-        # Dit staat verderop nog een keer
-        chars = service.characteristics()
-        for ch in chars:
-            c = CharacteristicInfo(ch)
-            self.m_characteristics.append(c)
+        self.listCharacteristics(service)
 
         # ik snap het, trigger de update in een andere thread
         QTimer.singleShot(0, self.characteristicsUpdated)
+        self.detailsReady(service)
 
     # callback from service.discoverDetails in connectToService
     @pyqtSlot(QtBt.QLowEnergyService.ServiceState)
@@ -412,13 +787,41 @@ class Device(QObject):
         if not service:
             return
 
-        chars = service.characteristics()
-        for ch in chars:
-            c = CharacteristicInfo(ch)
-            # print(f'Characteristic name {c.getName()}, Permission {c.getPermission()}')
-            self.m_characteristics.append(c)
+        self.listCharacteristics(service)
 
         self.characteristicsUpdated.emit()
+        self.detailsReady(service)
+
+    # service details are known: store them, and go to the Serial channel if it was cached
+    def detailsReady(self, service):
+        address = self.currentDevice.getAddress()
+        serv = self.servicePool.get(self.poolKey(service.serviceUuid()), service)
+        self.gattCache.storeService(address, {
+            'uuid': serv.getUuid(),
+            'name': serv.getName(),
+            'type': serv.getType(),
+            'characteristics': [{'uuid': normalUuid(c.getUuid()),
+                                 'name': c.getName(),
+                                 'handle': c.getCharacteristic().handle(),
+                                 'properties': int(c.getCharacteristic().properties())}
+                                for c in self.m_characteristics],
+        })
+
+        if not self.fastPath or service.serviceUuid() != QtBt.QBluetoothUuid(PrimarService):
+            return
+        self.fastPath = False
+        resuming = self.m_connectionState == reconnect.RECONNECTING
+        c = self.m_characteristics.find(normalUuid(SerialPortUUID))
+        if c is not None and self.controlBluno(c):
+            self.setUpdate('Back\n(Serial channel ready)')
+            if not resuming:
+                self.serialReady.emit()
+            return
+        # cached layout is wrong, the user selects it again
+        print('Warning: cached Serial characteristic not found')
+        self.gattCache.forget(address)
+        if resuming:
+            self.giveUp()
 
     def state(self):
         return self.m_deviceScanState
@@ -430,6 +833,8 @@ class Device(QObject):
 
     @pyqtSlot()
     def disconnectFromDevice(self):
+        self.userDisconnect = True
+        self.reconnectTimer.stop()
         if self.controller.state() != QtBt.QLowEnergyController.UnconnectedState:
             self.controller.disconnectFromDevice()
         else:
@@ -445,25 +850,35 @@ class Device(QObject):
         self.RandomAddress = newValue
         self.randomAddressChanged.emit()
 
-    devicesList = pyqtProperty(QVariant, getDevices, notify=devicesUpdated)
-    servicesList = pyqtProperty(QVariant, getServices, notify=servicesUpdated)
-    characteristicList = pyqtProperty(QVariant, getCharacteristics, notify=characteristicsUpdated)
+    devicesList = pyqtProperty(QObject, getDevices, constant=True)
+    servicesList = pyqtProperty(QObject, getServices, constant=True)
+    characteristicList = pyqtProperty(QObject, getCharacteristics, constant=True)
     update = pyqtProperty(str, getUpdate, setUpdate, notify=updateChanged)
     useRandomAddress = pyqtProperty(bool, isRandomAddress, setRandomAddress, notify=randomAddressChanged)
     state = pyqtProperty(bool, state, notify=stateChanged)
     controllerError = pyqtProperty(bool, hasControllerError)
+    onlyBlunos = pyqtProperty(bool, getOnlyBlunos, setOnlyBlunos, notify=scanFilterChanged)
+    wantedAddresses = pyqtProperty(QVariant, getWanted, setWanted, notify=scanFilterChanged)
 
     """
     Send command to bluno
     """
     commandChanged = pyqtSignal()
     characChanged = pyqtSignal()
+    replyReceived = pyqtSignal(str, QByteArray)    # command, reply
+    repliesReceived = pyqtSignal(QVariant)         # [[command, reply], ...] since the last frame
+    uiRateChanged = pyqtSignal()
+    windowChanged = pyqtSignal()
+    packetsSavedChanged = pyqtSignal()
+    statsChanged = pyqtSignal()
+    writeModeChanged = pyqtSignal()
+    bulkProgress = pyqtSignal(int, int)            # bytes confirmed by the board, total
+    bulkFinished = pyqtSignal(bool, str)           # ok, result with bytes/s or the error
 
     @pyqtSlot(str)
     def setCommand(self, com):
         print(f'setCommand to {com}')
-        com += '\r'
-        self.blcomm = com
+        self.blcomm = com + '\r'
         self.sendtoBluno(com)
 
     @pyqtSlot()
@@ -477,8 +892,46 @@ class Device(QObject):
         return self.blresult
 
 
+    def getWindow(self):
+        return self.pipeline.window
+
+    def setWindow(self, n):
+        self.pipeline.setWindow(n)
+        self.windowChanged.emit()
+
+    def getWriteNoResponse(self):
+        return self.m_writeNoResponse
+
+    def setWriteNoResponse(self, value):
+        self.m_writeNoResponse = value
+        self.writeModeChanged.emit()
+
+    def getPacketsSaved(self):
+        return self.packets.saved
+
+    def getTelemetry(self):
+        return self.m_telemetry
+
+    def getStats(self):
+        return self.metrics.snapshot()
+
+    def getUiRate(self):
+        return self.ui.rate
+
+    def setUiRate(self, rate):
+        self.ui.setRate(rate)
+        self.uiRateChanged.emit()
+
     command = pyqtProperty(str, getCommand, setCommand, notify=commandChanged)
     bluno   = pyqtProperty(QByteArray, getCharac, notify=characChanged)    
+    window  = pyqtProperty(int, getWindow, setWindow, notify=windowChanged)
+    writeWithoutResponse = pyqtProperty(bool, getWriteNoResponse, setWriteNoResponse, notify=writeModeChanged)
+    packetsSaved = pyqtProperty(int, getPacketsSaved, notify=packetsSavedChanged)
+    telemetry = pyqtProperty(QObject, getTelemetry, constant=True)
+    uiRate  = pyqtProperty(int, getUiRate, setUiRate, notify=uiRateChanged)
+    stats = pyqtProperty(QVariant, getStats, notify=statsChanged)
+    connectionState = pyqtProperty(str, getConnectionState, notify=connectionStateChanged)
+    policy = pyqtProperty(str, getReconnectPolicy, setReconnectPolicy)
 
 
     """
@@ -489,7 +942,7 @@ class Device(QObject):
     def controlBluno(self, c):
         if c.getName() != "b'Serial'":
             print(f' Error: {c.getName()} selected as characteristic')
-            return
+            return False
         self.currentCharacteristic = c
         """
         print(f'the char  {c.getPermission()}')
@@ -497,19 +950,169 @@ class Device(QObject):
         print(f'the char  {c.getCharacteristic().descriptors()[0].name()}')
         print(f'the char  {c.getCharacteristic().descriptors()[0].value()}')
         """
-        self.currentService.characteristicWritten.connect(self.writtenToBluno)
-        self.currentService.error.connect(self.errorBluno)
-        self.currentService.characteristicChanged.connect(self.charChanged)
-        self.currentService.characteristicRead.connect(self.charRead)        
+        self.wireService(self.currentService)
+
+        # payload size follows the negotiated MTU (Qt >= 5.11)
+        if hasattr(self.controller, 'mtu'):
+            self.packets.setMtu(self.controller.mtu())
+            connectOnce(self.controller.mtuChanged, self.packets.setMtu)
 
         # Bluno does not have a ClientCharacteristicConfiguration voor deze service!
         #    notification is on per default, but there are none!
-
-    def sendtoBluno(self, charinfo):
+        resuming = self.m_connectionState == reconnect.RECONNECTING
+        self.setConnectionState(reconnect.READY)
+        if resuming:
+            self.sessionResumed()
+        return True
+
+    def serviceHandlers(self, service):
+        return ((service.characteristicWritten, self.writtenToBluno),
+                (service.error, self.errorBluno),
+                (service.characteristicChanged, self.charChanged),
+                (service.characteristicRead, self.charRead))
+
+    def wireService(self, service):
+        """ the handlers are connected to one service at a time, once """
+        if service is self.wiredService:
+            return
+        self.unwireService()
+        for signal, slot in self.serviceHandlers(service):
+            signal.connect(slot)
+        self.wiredService = service
+
+    def unwireService(self):
+        service, self.wiredService = self.wiredService, None
+        if service is None:
+            return
+        for signal, slot in self.serviceHandlers(service):
+            try:
+                signal.disconnect(slot)
+            except (TypeError, RuntimeError):
+                pass          # already gone with its controller
+
+    def sendtoBluno(self, com):
+        """ queue command (without CR), returns a Future with the reply """
+        future = self.pipeline.submit(com)
+        if not self.pipelineTimer.isActive():
+            self.pipelineTimer.start()
+        return future
+
+    def writeSerial(self, data: bytes):
+        c = self.currentCharacteristic.getCharacteristic()
+        if self.m_writeNoResponse:
+            mode = QtBt.QLowEnergyService.WriteMode.WriteWithoutResponse
+        else:
+            mode = QtBt.QLowEnergyService.WriteMode.WriteWithResponse
+        self.currentService.writeCharacteristic(c, data, mode)
+        self.metrics.count('writes')
+        self.metrics.count('bytesOut', len(data))
+        if self.capture is not None:
+            self.capture.write(c.handle(), data)
+
+    def writeUnacked(self, data: bytes):
+        """ bulk data, always without response """
         c = self.currentCharacteristic.getCharacteristic()
-        self.currentService.writeCharacteristic(c, charinfo.encode(), QtBt.QLowEnergyService.WriteMode.WriteWithResponse)
-        # hier doen?
-        # self.currentService.readCharacteristic(c)
+        self.currentService.writeCharacteristic(c, data, QtBt.QLowEnergyService.WriteMode.WriteWithoutResponse)
+        self.metrics.count('writes')
+        self.metrics.count('bytesOut', len(data))
+        if self.capture is not None:
+            self.capture.write(c.handle(), data)
+
+    def writeBlock(self, offset, data, confirmed=0):
+        """ bulk transfer of data to EEPROM address offset (see bulk.py), returns the BulkSender.
+            confirmed: bytes already stored by an earlier transfer of the same block.
+            When the transfer cannot start: None, and bulkFinished(False, why)
+        """
+        if self.bulk is not None:
+            self.bulkFinished.emit(False, 'a bulk transfer is running')
+            return None
+        try:
+            bulk = BulkSender(data, offset, write=self.writeUnacked, payload=self.packets.payloadSize,
+                              progress=self.bulkProgress.emit, confirmed=confirmed)
+        except ValueError as e:
+            self.bulkFinished.emit(False, str(e))
+            return None
+        self.bulk = bulk
+        # commands given meanwhile wait, the ones in flight are answered first
+        self.pipeline.pause()
+        self.bulkTimer.start()
+        return self.bulk
+
+    @pyqtSlot(QVariant)
+    def savePidTable(self, values):
+        """ pval1, ival1, dval1, pval2, ival2, dval2, pos1, pos2 into the EEPROM in one transfer """
+        try:
+            values = [int(v) for v in values or []]
+            if len(values) != 8:
+                raise ValueError(f'a PID table has 8 values, not {len(values)}')
+            block = pidTable(*values)
+        except (TypeError, ValueError) as e:
+            self.bulkFinished.emit(False, f'PID table: {e}')
+            return
+        self.writeBlock(0, block)
+
+    @pyqtSlot()
+    def bulkTick(self):
+        bulk = self.bulk
+        if bulk is None:
+            self.bulkTimer.stop()
+            return
+        if bulk.state == STOPPED:
+            # (again) after the replies in flight, or after a reconnect
+            self.pipeline.checkTimeouts()
+            if not self.pipeline.inflight and self.m_connectionState == reconnect.READY:
+                bulk.start()
+            return
+        bulk.poll()
+        if not bulk.running():
+            self.finishBulk()
+
+    def finishBulk(self):
+        bulk, self.bulk = self.bulk, None
+        self.bulkTimer.stop()
+        if bulk.state == DONE:
+            message = f'{bulk.total} bytes in {bulk.elapsed():.2f} s, {bulk.bytesPerSecond():.0f} B/s'
+        else:
+            message = bulk.error or 'stopped'
+        print(f'Bulk transfer: {message}')
+        if self.m_connectionState == reconnect.READY:
+            self.pipeline.resume()
+        self.bulkFinished.emit(bulk.state == DONE, message)
+
+    @pyqtSlot(str)
+    def startCapture(self, filename):
+        self.stopCapture()
+        self.capture = CaptureWriter(filename)
+
+    @pyqtSlot()
+    def stopCapture(self):
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
+
+    def commandCompleted(self, cmd, reply):
+        self.metrics.observe(cmd.text, time.monotonic() - cmd.sent)
+        self.blresult = QByteArray(reply)
+        self.replyReceived.emit(cmd.text, self.blresult)
+        # the bindings are updated once per frame, with the latest reply
+        self.ui.mark('bluno', self.characChanged.emit)
+        self.ui.mark('packetsSaved', self.packetsSavedChanged.emit)
+        self.ui.add([cmd.text, bytes(reply).decode(errors='replace')])
+        if self.pipeline.depth() == 0:
+            self.pipelineTimer.stop()
+
+    @pyqtSlot()
+    def checkPipeline(self):
+        self.pipeline.checkTimeouts()
+        if self.pipeline.depth() == 0:
+            self.pipelineTimer.stop()
+
+    def unsolicitedReply(self, frame):
+        # while a bulk transfer runs, no commands are in flight
+        if self.bulk is not None and self.bulk.replyReceived(frame):
+            return
+        self.metrics.count('unsolicited')
+        print(f'Unsolicited reply {frame}')
 
     @pyqtSlot()
     def dddd(self):
@@ -527,17 +1130,40 @@ class Device(QObject):
 
     @pyqtSlot(QtBt.QLowEnergyCharacteristic, QByteArray)
     def charChanged(self, c, result):
-        print(f'Changed callback {c}   {result}')
+        # print(f'Changed callback {c}   {result}')
+        self.metrics.count('notifications')
+        self.metrics.count('bytesIn', len(result))
+        if self.capture is not None:
+            self.capture.notify(c.handle(), result)
+        self.pipeline.feed(bytes(result))
 
     @pyqtSlot(QtBt.QLowEnergyCharacteristic, QByteArray)
     def charRead(self, c, result):
         print(f'Read callback {c}   {result}')
+        if self.capture is not None:
+            self.capture.record(READ, c.handle(), result)
         self.blresult = result
-        self.characChanged.emit()
-        
+        self.ui.mark('bluno', self.characChanged.emit)
+
     @pyqtSlot(QtBt.QLowEnergyService.ServiceError)
     def errorBluno(self, e):
         print(f'errorBluno {e}')
+        self.metrics.count('errors')
+
+    @pyqtSlot()
+    def publishStats(self):
+        m = self.metrics
+        m.queueDepth = self.pipeline.depth()
+        m.counters['timeouts'] = self.pipeline.timeouts
+        m.counters['superseded'] = self.scheduler.superseded
+        m.counters['dropped'] = self.scheduler.dropped
+        self.statsChanged.emit()
+        if self.metricsFile:
+            try:
+                m.writePrometheus(self.metricsFile)
+            except OSError as e:
+                print(f'Warning: cannot write metrics: {e}')
+                self.metricsFile = ''
 
 
 def startit():
@@ -551,14 +1177,60 @@ def startit():
     engine = QQmlApplicationEngine()
     # Register Device class with QML
     qmlRegisterType(Device, 'Bluno', 1, 0, 'Device')
+    qmlRegisterType(SessionHub, 'Bluno', 1, 0, 'SessionHub')
 
     # Load the qml file into the engine
-    engine.load("assets/main.qml")
+    #   compiled resources (pyrcc5 resources.qrc -o resources.py) when available,
+    #   QML files are cached compiled by Qt, so only the first start parses them
+    try:
+        import resources
+    except ImportError:
+        resources = None
+    if resources is not None and QFile.exists(':/assets/main.qml'):
+        engine.load(QUrl('qrc:/assets/main.qml'))
+    else:
+        engine.load(QUrl.fromLocalFile(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                    'assets', 'main.qml')))
+    milestone('qmlLoaded')
+
+    windows = engine.rootObjects()
+    if windows:
+        windows[0].frameSwapped.connect(lambda: milestone('firstFrame'))
+        if os.environ.get('BLUNO_STARTUP_FILE'):
+            startupReport(app, windows[0])
 
     engine.quit.connect(app.quit)
     sys.exit(app.exec_())
 
 
+def startupReport(app, window, timeout=30000):
+    """ benchmark mode: scan after the first frame, write the milestones as json and quit """
+    device = window.findChild(Device)
+
+    def firstFrame():
+        window.frameSwapped.disconnect(firstFrame)
+        if device is not None:
+            device.startDeviceDiscovery()
+        QTimer.singleShot(0, check)
+
+    def check():
+        if 'firstDevice' in milestones or 'scanFinished' in milestones or device is None:
+            done()
+        else:
+            QTimer.singleShot(10, check)
+
+    def done():
+        if 'timedOut' in milestones:
+            return
+        milestones['timedOut'] = not ('firstDevice' in milestones or 'scanFinished' in milestones)
+        with open(os.environ['BLUNO_STARTUP_FILE'], 'w') as f:
+            json.dump(milestones, f)
+        app.quit()
+
+    window.frameSwapped.connect(firstFrame)
+    QTimer.singleShot(timeout, done)
+
+
 if __name__ == "__main__":
     startit()
 # end
@@ -0,0 +1,139 @@
+"""
+ Metrics of the link with the bluno
+     counters, a fixed size latency histogram per command type and a
+     Prometheus text format export.
+
+ The histogram is HDR style: 16 linear sub buckets per power of two of
+ microseconds, so relative error is below 1/16 and memory is fixed.
+"""
+import os, time
+from array import array
+
+SUBBITS    = 4
+SUBBUCKETS = 1 << SUBBITS
+MAXEXP     = 32                 # up to 2^36 us, over 19 hours
+NBUCKETS   = SUBBUCKETS + MAXEXP * SUBBUCKETS
+
+
+def bucketOf(us: int) -> int:
+    if us < SUBBUCKETS:
+        return max(0, us)
+    e = us.bit_length() - SUBBITS - 1
+    return min(NBUCKETS - 1, SUBBUCKETS + e * SUBBUCKETS + (us >> e) - SUBBUCKETS)
+
+
+def bucketHigh(index: int) -> int:
+    """ highest value (us) in bucket index """
+    if index < SUBBUCKETS:
+        return index
+    e, sub = divmod(index - SUBBUCKETS, SUBBUCKETS)
+    return ((sub + SUBBUCKETS + 1) << e) - 1
+
+
+class Histogram:
+
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * NBUCKETS))
+        self.count  = 0
+        self.sum    = 0.0          # seconds
+        self.max    = 0.0
+
+    def record(self, seconds: float):
+        self.counts[bucketOf(int(seconds * 1e6))] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p: float) -> float:
+        """ value in seconds below which p percent of the samples are """
+        if self.count == 0:
+            return 0.0
+        wanted = max(1, int(round(p / 100 * self.count)))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= wanted:
+                return min(bucketHigh(index) / 1e6, self.max)
+        return self.max
+
+    def reset(self):
+        self.counts = array('Q', bytes(8 * NBUCKETS))
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+COUNTERS = ('writes', 'notifications', 'errors', 'timeouts', 'bytesOut', 'bytesIn', 'unsolicited',
+            'disconnects', 'reconnects', 'superseded', 'dropped')
+QUANTILES = (50, 90, 99)
+
+
+class Metrics:
+
+    def __init__(self):
+        self.counters   = dict.fromkeys(COUNTERS, 0)
+        self.latency    = {}        # command type (first char) -> Histogram
+        self.queueDepth = 0
+        self.recovery   = Histogram()     # time to recover after a dropout
+        self.lastRecovery = 0.0
+        self.started    = time.monotonic()
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def observe(self, command: str, seconds: float):
+        kind = command[:1] or '?'
+        histogram = self.latency.get(kind)
+        if histogram is None:
+            histogram = self.latency[kind] = Histogram()
+        histogram.record(seconds)
+
+    def snapshot(self) -> dict:
+        """ plain values, for the QML stats property """
+        stats = dict(self.counters)
+        stats['queueDepth'] = self.queueDepth
+        stats['uptime'] = time.monotonic() - self.started
+        for kind, h in self.latency.items():
+            for q in QUANTILES:
+                stats[f'{kind}_p{q}_ms'] = h.percentile(q) * 1e3
+            stats[f'{kind}_count'] = h.count
+        if self.recovery.count:
+            stats['recover_last_s'] = self.lastRecovery
+            stats['recover_p50_s'] = self.recovery.percentile(50)
+        return stats
+
+    def recovered(self, seconds: float):
+        self.lastRecovery = seconds
+        self.recovery.record(seconds)
+        self.count('reconnects')
+
+    def prometheus(self) -> str:
+        lines = []
+        for name, value in self.counters.items():
+            metric = 'bluno_' + ''.join('_' + c.lower() if c.isupper() else c for c in name) + '_total'
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric} {value}')
+        lines.append('# TYPE bluno_queue_depth gauge')
+        lines.append(f'bluno_queue_depth {self.queueDepth}')
+        lines.append('# TYPE bluno_command_latency_seconds summary')
+        for kind, h in sorted(self.latency.items()):
+            label = kind.replace('\\', '\\\\').replace('"', '\\"')
+            for q in QUANTILES:
+                lines.append(f'bluno_command_latency_seconds{{command="{label}",quantile="{q / 100}"}} '
+                             f'{h.percentile(q):.6f}')
+            lines.append(f'bluno_command_latency_seconds_sum{{command="{label}"}} {h.sum:.6f}')
+            lines.append(f'bluno_command_latency_seconds_count{{command="{label}"}} {h.count}')
+        lines.append('# TYPE bluno_recover_seconds summary')
+        for q in QUANTILES:
+            lines.append(f'bluno_recover_seconds{{quantile="{q / 100}"}} {self.recovery.percentile(q):.6f}')
+        lines.append(f'bluno_recover_seconds_sum {self.recovery.sum:.6f}')
+        lines.append(f'bluno_recover_seconds_count {self.recovery.count}')
+        return '\n'.join(lines) + '\n'
+
+    def writePrometheus(self, filename):
+        """ atomic write, for the node_exporter textfile collector """
+        tmp = filename + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(tmp, filename)
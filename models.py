@@ -0,0 +1,149 @@
+"""
+ List models for the QML views
+     items are appended with beginInsertRows/endInsertRows, so a view only
+     creates the delegate of the new item. A changed item only updates its
+     own row.
+
+ Roles: 'info' is the object itself (e.g. for device.controlBluno(model.info)),
+ the other roles are the display properties of the object.
+ With a key function the objects are also indexed, find(key) is O(1).
+
+ ObjectPool keeps one info object per key (address, uuid), so every scan and
+ connection reuses the objects of the previous one instead of making new ones.
+ With a limit the least recently used objects are dropped, e.g. for devices
+ with rotating random addresses.
+"""
+from functools import partial
+from collections import OrderedDict
+
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, Qt, QByteArray, pyqtSignal, pyqtProperty, pyqtSlot, QObject
+
+
+class ObjectListModel(QAbstractListModel):
+
+    countChanged = pyqtSignal()
+
+    def __init__(self, roles, parent=None, key=None):
+        """ roles: list of (name, getter), getter(object) gives the value
+            key: key(object) for the index used by find()
+        """
+        super().__init__(parent)
+        self.objects  = []       # type: List[QObject]
+        self.rows     = {}       # id(object) -> row
+        self.key      = key
+        self.keys     = {}       # key -> object
+        self.connections = []    # (signal, connection) of the changed signals, undone by clear()
+        self.getters  = [lambda o: o] + [getter for name, getter in roles]
+        self.names    = {Qt.UserRole + i: QByteArray(name.encode())
+                         for i, name in enumerate(['info'] + [name for name, getter in roles])}
+
+    # Qt model interface
+    def roleNames(self):
+        return self.names
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.objects)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self.objects):
+            return None
+        if role == Qt.DisplayRole:
+            role = Qt.UserRole
+        getter = role - Qt.UserRole
+        if not 0 <= getter < len(self.getters):
+            return None
+        return self.getters[getter](self.objects[index.row()])
+
+    # python side
+    def __len__(self):
+        return len(self.objects)
+
+    def __iter__(self):
+        return iter(self.objects)
+
+    def __getitem__(self, row):
+        return self.objects[row]
+
+    def append(self, obj, changed=None):
+        """ add obj at the end, changed is a signal of obj that means its row must be repainted """
+        row = len(self.objects)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.objects.append(obj)
+        self.rows[id(obj)] = row
+        if self.key is not None:
+            self.keys[self.key(obj)] = obj
+        self.endInsertRows()
+        if changed is not None:
+            self.connections.append((changed, changed.connect(partial(self.objectChanged, obj))))
+        self.countChanged.emit()
+
+    def objectChanged(self, obj):
+        row = self.rows.get(id(obj))
+        if row is None:
+            return
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+    def find(self, key):
+        return self.keys.get(key)
+
+    def rowOf(self, obj) -> int:
+        return self.rows.get(id(obj), -1)
+
+    def clear(self):
+        for signal, connection in self.connections:
+            signal.disconnect(connection)
+        self.connections = []
+        if not self.objects:
+            return
+        self.beginResetModel()
+        self.objects = []
+        self.rows = {}
+        self.keys = {}
+        self.endResetModel()
+        self.countChanged.emit()
+
+    @pyqtSlot(int, result=QObject)
+    def get(self, row):
+        return self.objects[row]
+
+    def getCount(self):
+        return len(self.objects)
+
+    count = pyqtProperty(int, getCount, notify=countChanged)
+
+
+class ObjectPool:
+
+    def __init__(self, create, update, limit=None):
+        """ create(value) makes the object for a key, update(obj, value) reuses it,
+            at most limit objects are kept (None: no limit)
+        """
+        self.create  = create
+        self.update  = update
+        self.limit   = limit
+        self.objects = OrderedDict()     # least recently used first
+        self.evicted = 0
+
+    def get(self, key, value):
+        obj = self.objects.get(key)
+        if obj is None:
+            obj = self.objects[key] = self.create(value)
+            if self.limit is not None and len(self.objects) > self.limit:
+                self.objects.popitem(last=False)
+                self.evicted += 1
+        else:
+            self.objects.move_to_end(key)
+            self.update(obj, value)
+        return obj
+
+    def discard(self, key):
+        self.objects.pop(key, None)
+
+    def clear(self):
+        self.objects.clear()
+
+    def __len__(self):
+        return len(self.objects)
@@ -0,0 +1,69 @@
+"""
+ Writing to the Serial characteristic in ATT sized packets
+     long writes are split on the payload boundary (MTU - 3, default 20)
+     and short queued commands are packed together in one packet.
+"""
+
+ATT_HEADER  = 3
+DEFAULT_MTU = 23      # gives the 20 byte payload of BLE 4.0
+
+
+class PacketWriter:
+
+    def __init__(self, send, mtu=DEFAULT_MTU):
+        """ send(bytes) writes one packet to the characteristic """
+        self.send     = send
+        self.queued   = []      # type: List[bytes]
+        self.setMtu(mtu)
+
+        # counters
+        self.packets  = 0       # packets sent
+        self.writes   = 0       # payloads queued
+        self.saved    = 0       # packets saved compared to one write per payload
+
+    def setMtu(self, mtu):
+        if not mtu or mtu <= ATT_HEADER:
+            mtu = DEFAULT_MTU
+        self.mtu = mtu
+        self.payloadSize = mtu - ATT_HEADER
+
+    def write(self, data: bytes):
+        """ queue data, nothing is sent until flush() """
+        self.queued.append(bytes(data))
+
+    def flush(self):
+        if not self.queued:
+            return
+        queued, self.queued = self.queued, []
+        size = self.payloadSize
+        packets = []
+        current = b''
+        naive = 0
+        for data in queued:
+            naive += -(-len(data) // size)
+            self.writes += 1
+            if len(current) + len(data) <= size:
+                current += data
+                continue
+            if current:
+                packets.append(current)
+            # only split payloads that do not fit in a packet on their own
+            while len(data) > size:
+                packets.append(data[:size])
+                data = data[size:]
+            current = data
+        if current:
+            packets.append(current)
+
+        self.packets += len(packets)
+        self.saved += naive - len(packets)
+        for packet in packets:
+            self.send(packet)
+
+    def clear(self):
+        """ drop what is queued, e.g. after a disconnect """
+        self.queued = []
+
+    def writeNow(self, data: bytes):
+        self.write(data)
+        self.flush()
@@ -0,0 +1,191 @@
+"""
+ Command pipeline for the bluno
+     keeps up to 'window' commands in flight and matches the CR terminated
+     replies in FIFO order (test3.ino answers every command, default 'ack').
+     A reply goes to the first command in flight waiting for its type
+     (replies.expectedReply), the commands before it lost their reply.
+
+ Not thread safe, use it from one thread (the Qt event loop or the thread
+ that owns the bluepy Peripheral).
+"""
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from framing import FrameAssembler
+from replies import replyType, expectedReply
+
+
+class ReplyLost(TimeoutError):
+    """ no reply on a command, the reply on a later one came first """
+
+
+class Command:
+
+    def __init__(self, text: str):
+        self.text    = text
+        self.payload = (text + '\r').encode()
+        self.expects = expectedReply(text)
+        self.future  = Future()    # result: the reply (bytes, without CR)
+        self.sent    = None        # time.monotonic() when written
+
+
+class CommandPipeline:
+
+    def __init__(self, write, window=4, timeout=2.0, completed=None, unsolicited=None, flush=None,
+                 scheduler=None, defer=None):
+        """ write(bytes) sends a payload to the bluno
+            flush() when given sends what write() queued (see packets.py), after
+                a burst of writes. With defer(callback), e.g. a zero timer, it is
+                called once per event loop pass, so commands given together are
+                packed together. A flush that raises fails the commands it had.
+            completed(command, reply) is called for every matched reply
+            unsolicited(frame) for replies without a pending command
+            scheduler orders the waiting commands (see scheduler.py), default FIFO
+        """
+        self.write       = write
+        self.window      = max(1, window)
+        self.timeout     = timeout
+        self.completed   = completed
+        self.unsolicited = unsolicited
+        self.flush       = flush
+        self.defer       = defer
+        self.scheduler   = scheduler
+        self.waiting     = scheduler if scheduler is not None else deque()    # type: Deque[Command]
+        self.inflight    = deque()    # type: Deque[Command]
+        self.unflushed   = []         # written, waiting for flush
+        self.flushPending = False
+        self.assembler   = FrameAssembler(callback=self.replyReceived)
+        self.timeouts    = 0
+        self.paused      = False
+
+    def submit(self, text: str) -> Future:
+        cmd = Command(text)
+        self.waiting.append(cmd)
+        self.pump()
+        return cmd.future
+
+    def setWindow(self, n: int):
+        self.window = max(1, n)
+        self.pump()
+
+    def pump(self):
+        burst = []
+        while not self.paused and self.waiting and self.hasRoom():
+            cmd = self.waiting.popleft()
+            # requeued commands are already running
+            if not cmd.future.running() and not cmd.future.set_running_or_notify_cancel():
+                continue
+            cmd.sent = time.monotonic()
+            self.inflight.append(cmd)
+            try:
+                self.write(cmd.payload)
+                burst.append(cmd)
+            except Exception as ex:
+                self.inflight.remove(cmd)
+                cmd.future.set_exception(ex)
+        if burst and self.flush is not None:
+            self.unflushed += burst
+            self.scheduleFlush()
+
+    def scheduleFlush(self):
+        """ flush now, or with defer once in this event loop pass """
+        if self.defer is None:
+            self.flushNow()
+        elif not self.flushPending:
+            self.flushPending = True
+            self.defer(self.flushNow)
+
+    def flushNow(self):
+        self.flushPending = False
+        try:
+            self.flush()
+        except Exception as ex:
+            self.flushed(ex)
+            return
+        self.flushed()
+
+    def flushed(self, error=None):
+        """ the commands written before the flush are sent, or failed with error:
+            they are not in flight then, the waiting ones get their place
+        """
+        unflushed, self.unflushed = self.unflushed, []
+        if error is None:
+            return
+        for cmd in unflushed:
+            if cmd in self.inflight:
+                self.inflight.remove(cmd)
+                cmd.future.set_exception(error)
+        self.pump()
+
+    def hasRoom(self) -> bool:
+        if len(self.inflight) < self.window:
+            return True
+        # one extra slot for control commands: a stop does not wait for a full window
+        return self.scheduler is not None and len(self.inflight) == self.window and self.scheduler.urgent()
+
+    # data from a notification
+    def feed(self, data):
+        self.assembler.feed(data)
+
+    def replyReceived(self, frame: bytes):
+        kind = replyType(frame)
+        skip = next((i for i, cmd in enumerate(self.inflight) if kind in cmd.expects), None)
+        if skip is None:
+            if self.unsolicited is not None:
+                self.unsolicited(frame)
+            return
+        # a notification got lost: fail the commands before, don't shift the replies
+        for _ in range(skip):
+            cmd = self.inflight.popleft()
+            cmd.future.set_exception(ReplyLost(f'no reply on {cmd.text!r}, got {bytes(frame)!r}'))
+            self.timeouts += 1
+        cmd = self.inflight.popleft()
+        cmd.future.set_result(frame)
+        if self.completed is not None:
+            self.completed(cmd, frame)
+        self.pump()
+
+    def checkTimeouts(self):
+        """ fail in flight commands older than timeout, call this periodically.
+            Without sequence numbers a late reply is matched to the next command
+            waiting for the same type of reply.
+        """
+        now = time.monotonic()
+        expired = False
+        while self.inflight and now - self.inflight[0].sent > self.timeout:
+            cmd = self.inflight.popleft()
+            cmd.future.set_exception(TimeoutError(f'no reply on {cmd.text!r}'))
+            self.timeouts += 1
+            expired = True
+        if expired:
+            self.pump()
+
+    def pause(self):
+        """ keep commands queued, e.g. while reconnecting """
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+        self.pump()
+
+    def requeue(self):
+        """ put the commands in flight back in front of the queue, their replies are lost """
+        while self.inflight:
+            self.waiting.appendleft(self.inflight.pop())
+        self.unflushed = []
+        self.assembler.reset()
+
+    def clear(self, reason='pipeline cleared'):
+        """ fail all pending commands, e.g. after a disconnect """
+        while self.inflight:
+            self.inflight.popleft().future.set_exception(ConnectionError(reason))
+        self.unflushed = []
+        while self.waiting:
+            cmd = self.waiting.popleft()
+            if cmd.future.running() or cmd.future.set_running_or_notify_cancel():
+                cmd.future.set_exception(ConnectionError(reason))
+        self.assembler.reset()
+
+    def depth(self) -> int:
+        return len(self.waiting) + len(self.inflight)
@@ -0,0 +1,348 @@
+"""
+ Emulated bluno for the Qt side: main.Device without an adapter or a board
+     EmulatedController stands in for the QLowEnergyController of
+     createCentral(), with the services and characteristics of a bluno.
+     Writes to the Serial characteristic go through an emulator.Link to an
+     emulator.Bluno, its serial output comes back as characteristicChanged,
+     on the Qt event loop (QTimer) instead of asyncio.
+
+     emulator = Emulator(link=Link(loss=0.01))
+     device.setEmulator(emulator)        # or BLUNO_EMULATOR=1 python3 main.py
+     device.startDeviceDiscovery()       # finds the emulated bluno at ADDRESS
+
+ The board lives as long as the Emulator, so the EEPROM and the setpoints
+ survive a reconnect like on the real board. The QLowEnergyCharacteristic in
+ the signals is an empty one, Qt has no way to make it for a handle.
+"""
+import time, heapq, itertools
+
+from PyQt5.QtCore import QObject, pyqtSignal, QTimer, QByteArray, Qt
+from PyQt5 import QtBluetooth as QtBt
+
+from emulator import Bluno, Link, UP, DOWN
+from bluno import PrimarService, ModelNumberStringUUID, CommandUUID, SerialPortUUID
+from gattcache import normalUuid
+
+ADDRESS = '00:00:00:00:B1:00'
+DEVICEINFORMATION = '0000180a-0000-1000-8000-00805f9b34fb'
+
+Char = QtBt.QLowEnergyCharacteristic
+# service uuid: name, [(uuid, user description, handle, properties, value)]
+SERVICES = {
+    DEVICEINFORMATION: ('Device Information', [
+        (ModelNumberStringUUID, '', 0x0e, Char.Read, b'DF Bluno'),
+    ]),
+    PrimarService: ('Unknown Service', [
+        (SerialPortUUID, 'Serial', 0x25, Char.Read | Char.WriteNoResponse | Char.Write | Char.Notify, b''),
+        (CommandUUID, 'Command', 0x28, Char.Read | Char.WriteNoResponse | Char.Write | Char.Notify, b''),
+    ]),
+}
+
+
+class Emulator:
+    """ the emulated board and link, Device.setEmulator() """
+
+    def __init__(self, board=None, link=None, address=ADDRESS):
+        self.board   = board if board is not None else Bluno(bulk=True)
+        self.link    = link if link is not None else Link()
+        self.address = address
+
+    def deviceInfo(self) -> QtBt.QBluetoothDeviceInfo:
+        """ what a scan finds: a low energy device advertising the bluno service """
+        info = QtBt.QBluetoothDeviceInfo(QtBt.QBluetoothAddress(self.address), 'Bluno (emulated)', 0)
+        info.setCoreConfigurations(QtBt.QBluetoothDeviceInfo.LowEnergyCoreConfiguration)
+        info.setServiceUuids([QtBt.QBluetoothUuid(PrimarService)], QtBt.QBluetoothDeviceInfo.DataComplete)
+        return info
+
+    def controller(self, parent=None):
+        return EmulatedController(self, parent)
+
+
+class Timeline(QObject):
+    """ callbacks at loop times (time.monotonic), in order, on one timer """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.queue = []
+        self.order = itertools.count()
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.fire)
+
+    def at(self, t, callback, *args):
+        heapq.heappush(self.queue, (t, next(self.order), callback, args))
+        self.arm()
+
+    def later(self, delay, callback, *args):
+        self.at(time.monotonic() + delay, callback, *args)
+
+    def arm(self):
+        if self.queue:
+            self.timer.start(max(0, int((self.queue[0][0] - time.monotonic()) * 1000)))
+
+    def fire(self):
+        now = time.monotonic()
+        while self.queue and self.queue[0][0] <= now:
+            _, _, callback, args = heapq.heappop(self.queue)
+            callback(*args)
+        self.arm()
+
+    def clear(self):
+        self.queue = []
+        self.timer.stop()
+
+
+class Overloaded:
+    """ a signal that is also a method, like error in QLowEnergyController """
+
+    def __init__(self, signal, method):
+        self.signal = signal
+        self.method = method
+
+    def __call__(self, *args):
+        return self.method(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.signal, name)
+
+
+class EmulatedDescriptor:
+
+    def __init__(self, description: str):
+        self.description = description
+
+    def type(self):
+        return QtBt.QBluetoothUuid.CharacteristicUserDescription
+
+    def value(self) -> QByteArray:
+        return QByteArray(self.description.encode())
+
+
+class EmulatedCharacteristic:
+    """ the QLowEnergyCharacteristic methods Device uses """
+
+    def __init__(self, uuid, description, handle, properties, value):
+        self.m_uuid = QtBt.QBluetoothUuid(uuid)
+        self.m_descriptors = [EmulatedDescriptor(description)] if description else []
+        self.m_handle = handle
+        self.m_properties = properties
+        self.m_value = QByteArray(value)
+
+    def isValid(self):
+        return True
+
+    def uuid(self):
+        return self.m_uuid
+
+    def name(self):
+        return ''          # like the bluno: the Serial name is in the user description
+
+    def handle(self):
+        return self.m_handle
+
+    def properties(self):
+        return self.m_properties
+
+    def value(self):
+        return self.m_value
+
+    def descriptors(self):
+        return self.m_descriptors
+
+    def descriptor(self, uuid):
+        return next((d for d in self.m_descriptors if d.type() == uuid), None)
+
+
+class EmulatedService(QObject):
+    """ the QLowEnergyService methods and signals Device uses """
+
+    stateChanged          = pyqtSignal(QtBt.QLowEnergyService.ServiceState)
+    characteristicWritten = pyqtSignal(QtBt.QLowEnergyCharacteristic, QByteArray)
+    characteristicChanged = pyqtSignal(QtBt.QLowEnergyCharacteristic, QByteArray)
+    characteristicRead    = pyqtSignal(QtBt.QLowEnergyCharacteristic, QByteArray)
+    error                 = pyqtSignal(QtBt.QLowEnergyService.ServiceError)
+
+    def __init__(self, controller, uuid: str, parent=None):
+        super().__init__(parent)
+        self.controller = controller
+        self.uuid = uuid
+        self.name, chars = SERVICES[uuid]
+        self.chars = [EmulatedCharacteristic(*c) for c in chars]
+        self.m_state = QtBt.QLowEnergyService.DiscoveryRequired
+
+    def serviceUuid(self):
+        return QtBt.QBluetoothUuid(self.uuid)
+
+    def serviceName(self):
+        return self.name
+
+    def type(self):
+        return QtBt.QLowEnergyService.PrimaryService
+
+    def state(self):
+        return self.m_state
+
+    def setState(self, state):
+        self.m_state = state
+        self.stateChanged.emit(state)
+
+    def discoverDetails(self):
+        if self.m_state != QtBt.QLowEnergyService.DiscoveryRequired:
+            return
+        self.setState(QtBt.QLowEnergyService.DiscoveringServices)
+        self.controller.afterEvents(2, self.setState, QtBt.QLowEnergyService.ServiceDiscovered)
+
+    def characteristics(self):
+        return list(self.chars) if self.m_state == QtBt.QLowEnergyService.ServiceDiscovered else []
+
+    def writeCharacteristic(self, c, data, mode=QtBt.QLowEnergyService.WriteWithResponse):
+        if not self.controller.isConnected():
+            self.error.emit(QtBt.QLowEnergyService.OperationError)
+            return
+        data = bytes(data)
+        withResponse = mode == QtBt.QLowEnergyService.WriteWithResponse
+        if normalUuid(c.uuid().toString()) == SerialPortUUID:
+            answered = self.controller.boardWrite(data, withResponse)
+        else:
+            answered = self.controller.afterEvents(1 if withResponse else 0)
+        if withResponse:
+            self.controller.timeline.at(answered, self.characteristicWritten.emit,
+                                        QtBt.QLowEnergyCharacteristic(), QByteArray(data))
+
+    def readCharacteristic(self, c):
+        self.controller.afterEvents(2, self.characteristicRead.emit, QtBt.QLowEnergyCharacteristic(), c.value())
+
+    def notify(self, data):
+        self.characteristicChanged.emit(QtBt.QLowEnergyCharacteristic(), QByteArray(data))
+
+
+class EmulatedController(QObject):
+    """ the QLowEnergyController methods and signals Device uses """
+
+    connected         = pyqtSignal()
+    disconnected      = pyqtSignal()
+    errorSignal       = pyqtSignal(QtBt.QLowEnergyController.Error)
+    serviceDiscovered = pyqtSignal(QtBt.QBluetoothUuid)
+    discoveryFinished = pyqtSignal()
+    mtuChanged        = pyqtSignal(int)
+
+    def __init__(self, emulator, parent=None):
+        super().__init__(parent)
+        self.emulator   = emulator
+        self.board      = emulator.board
+        self.link       = emulator.link
+        self.timeline   = Timeline(self)
+        self.services   = {}          # uuid -> EmulatedService
+        self.m_state    = QtBt.QLowEnergyController.UnconnectedState
+        self.responseAt = 0.0         # the last write with response is answered
+        self.idleArmed  = False       # board.tick() is on the timeline
+
+    # QLowEnergyController
+    def state(self):
+        return self.m_state
+
+    @property
+    def error(self):
+        return Overloaded(self.errorSignal, lambda: QtBt.QLowEnergyController.NoError)
+
+    def errorString(self):
+        return ''
+
+    def mtu(self):
+        return self.link.payload + 3
+
+    def setRemoteAddressType(self, addressType):
+        pass
+
+    def connectToDevice(self):
+        if self.m_state != QtBt.QLowEnergyController.UnconnectedState:
+            return
+        self.m_state = QtBt.QLowEnergyController.ConnectingState
+        self.afterEvents(3, self.linkUp)
+
+    def linkUp(self):
+        self.link.start(time.monotonic())
+        self.responseAt = 0.0
+        self.m_state = QtBt.QLowEnergyController.ConnectedState
+        self.connected.emit()
+
+    def discoverServices(self):
+        self.m_state = QtBt.QLowEnergyController.DiscoveringState
+        self.afterEvents(4, self.servicesFound)
+
+    def servicesFound(self):
+        self.m_state = QtBt.QLowEnergyController.DiscoveredState
+        for uuid in SERVICES:
+            self.serviceDiscovered.emit(QtBt.QBluetoothUuid(uuid))
+        self.discoveryFinished.emit()
+
+    def createServiceObject(self, uuid, parent=None):
+        uuid = normalUuid(uuid.toString())
+        if uuid not in SERVICES:
+            return None
+        service = self.services[uuid] = EmulatedService(self, uuid, parent)
+        return service
+
+    def disconnectFromDevice(self):
+        if self.m_state == QtBt.QLowEnergyController.UnconnectedState:
+            return
+        self.m_state = QtBt.QLowEnergyController.ClosingState
+        # what is on its way is lost, disconnected comes from the event loop
+        self.timeline.clear()
+        self.idleArmed = False
+        self.timeline.later(0, self.linkDown)
+
+    def linkDown(self):
+        self.m_state = QtBt.QLowEnergyController.UnconnectedState
+        self.disconnected.emit()
+
+    # the link
+    def isConnected(self):
+        return self.m_state in (QtBt.QLowEnergyController.ConnectedState,
+                                QtBt.QLowEnergyController.DiscoveringState,
+                                QtBt.QLowEnergyController.DiscoveredState)
+
+    def afterEvents(self, n, callback=None, *args) -> float:
+        """ time of the n-th next connection event, callback then """
+        t = time.monotonic() + n * self.link.interval
+        if callback is not None:
+            self.timeline.at(t, callback, *args)
+        return t
+
+    def boardWrite(self, data, withResponse) -> float:
+        """ data to the board, returns when a write with response is answered """
+        now = time.monotonic()
+        if withResponse:
+            # one write request at a time, the next after the response
+            now = max(now, self.responseAt)
+        arrivals = self.link.schedule(UP, now, data)
+        for t, packet in arrivals:
+            self.timeline.at(t, self.boardReceived, packet)
+        answered = (arrivals[-1][0] if arrivals else now) + self.link.interval
+        if withResponse:
+            self.responseAt = answered
+        return answered
+
+    def boardReceived(self, packet):
+        self.boardOutput(self.board.receive(packet))
+        self.armIdle()
+
+    def armIdle(self):
+        delay = self.board.tickIn()
+        if delay is not None and not self.idleArmed:
+            self.idleArmed = True
+            self.timeline.later(delay, self.boardIdle)
+
+    def boardIdle(self):
+        self.idleArmed = False
+        self.boardOutput(self.board.tick())
+        self.armIdle()
+
+    def boardOutput(self, output):
+        serial = self.services.get(PrimarService)
+        if not output or serial is None:
+            return
+        ready = time.monotonic() + self.link.serialTime(len(output))
+        for t, notification in self.link.schedule(DOWN, ready, output):
+            self.timeline.at(t, serial.notify, notification)
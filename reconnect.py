@@ -0,0 +1,40 @@
+"""
+ Reconnecting after a dropout
+     delays grow exponentially with jitter, so several boards (or several
+     hosts) do not retry in lock step.
+"""
+import random
+
+# connection states of Device
+UNCONNECTED  = 'unconnected'
+CONNECTING   = 'connecting'
+READY        = 'ready'
+RECONNECTING = 'reconnecting'
+
+# what happens with commands that were pending during the dropout
+REPLAY = 'replay'      # send them again after the reconnect
+FAIL   = 'fail'        # fail them with ConnectionError
+
+
+class Backoff:
+
+    def __init__(self, base=0.25, factor=2.0, maximum=10.0, jitter=0.5, attempts=20, rand=random.random):
+        """ delay n is base * factor**n (at most maximum), randomly shortened by up to jitter * delay """
+        self.base     = base
+        self.factor   = factor
+        self.maximum  = maximum
+        self.jitter   = jitter
+        self.attempts = attempts
+        self.rand     = rand
+        self.attempt  = 0
+
+    def next(self):
+        """ seconds to wait before the next attempt, None when giving up """
+        if self.attempt >= self.attempts:
+            return None
+        delay = min(self.maximum, self.base * self.factor ** self.attempt)
+        self.attempt += 1
+        return delay * (1 - self.jitter * self.rand())
+
+    def reset(self):
+        self.attempt = 0
@@ -0,0 +1,217 @@
+"""
+ Replies of test3.ino as typed records
+     parseReply() decodes one frame (bytes, bytearray or memoryview, without
+     the CR) into a record, matched in place on the buffer without decoding
+     it to a string. decodeStream() does a whole recorded stream of CR
+     terminated replies at once with NumPy, no python loop per reply.
+
+     parseReply(b'Enc: 12, -3')   -> Encoders(enc1=12, enc2=-3)
+     decodeCapture('session.cap')['enc']  -> structured array time, frame, enc1, enc2
+"""
+import re
+from collections import namedtuple
+
+from capture import CaptureReader, FILEHEAD, RECORD, NOTIFY
+
+CR = 13
+
+Info     = namedtuple('Info', 'setpoint1 setpoint2')
+Encoders = namedtuple('Encoders', 'enc1 enc2')
+Control  = namedtuple('Control', 'state')
+Ack      = namedtuple('Ack', '')
+# bulk mode, see bulk.py
+Bulk     = namedtuple('Bulk', 'credit')
+Got      = namedtuple('Got', 'count')
+End      = namedtuple('End', 'count')
+Sum      = namedtuple('Sum', 'crc')
+# binary link, see arq.py
+Binary   = namedtuple('Binary', 'version')
+
+ACK = Ack()
+_tuple = tuple.__new__          # a record without the keyword handling of its __new__
+
+
+class ReplyType:
+
+    def __init__(self, name, prefix, record):
+        self.name   = name
+        self.prefix = prefix
+        self.record = record
+        self.fields = record._fields
+        self.make   = record._make
+        # '%d, %d' after the prefix, matched in place on the buffer
+        self.numbers = re.compile(b', *'.join([rb' *(-?\d+)'] * len(self.fields)) if self.fields else b'')
+
+
+# prefix -> ReplyType, in the order they are tried
+PARSERS = {}
+# first byte -> reply types with a prefix starting with it
+FIRSTBYTE = {}
+# first letter of a command -> names of the replies test3.ino answers it with
+EXPECTED = {}
+
+
+def register(name, prefix: bytes, record, commands=''):
+    """ replies starting with prefix are decoded into record, one int per field.
+        commands are the command letters answered with this reply.
+    """
+    if any(48 <= b <= 57 for b in prefix):
+        # the bulk decoder counts the numbers in a reply
+        raise ValueError(f'prefix {prefix!r} contains digits')
+    kind = PARSERS[prefix] = ReplyType(name, prefix, record)
+    FIRSTBYTE.setdefault(prefix[0], []).append(kind)
+    for letter in commands:
+        EXPECTED[letter] = EXPECTED.get(letter, ()) + (name,)
+
+
+register('info', b'XXInfo: ', Info, commands='i')
+register('enc', b'Enc: ', Encoders, commands='e')
+register('control', b'Control: ', Control, commands='c')
+# firmware without the binary link answers B1 with ack
+register('ack', b'ack', Ack, commands='B')
+register('bulk', b'Bulk: ', Bulk)
+register('got', b'Got: ', Got)
+register('end', b'End: ', End)
+register('sum', b'Sum: ', Sum)
+register('binary', b'Bin: ', Binary, commands='B')
+
+
+def _kind(frame):
+    if not len(frame):
+        return None
+    for kind in FIRSTBYTE.get(frame[0], ()):
+        if frame[:len(kind.prefix)] == kind.prefix:
+            return kind
+    return None
+
+
+def parseReply(frame):
+    """ the record for a reply, None for replies that are not registered """
+    if frame[:5] == b'Enc: ':
+        # the telemetry poll, many per second: split instead of the regex
+        try:
+            enc1, enc2 = frame.split(b',')
+            return _tuple(Encoders, (int(enc1[5:]), int(enc2)))
+        except (ValueError, AttributeError):      # AttributeError: a memoryview
+            pass
+    kind = _kind(frame)
+    if kind is None:
+        return None
+    if not kind.fields:
+        return kind.record()
+    match = kind.numbers.match(frame, len(kind.prefix))
+    if match is None:
+        return None
+    return kind.make(map(int, match.groups()))
+
+
+def replyType(frame):
+    """ name of the reply type, '' for unknown replies """
+    kind = _kind(frame)
+    return '' if kind is None else kind.name
+
+
+def expectedReply(command: str) -> tuple:
+    """ names of the reply types for a command, ('ack',) for the commands without their own """
+    return EXPECTED.get(command[:1], ('ack',))
+
+
+# bulk decoding
+def _numbers(buf):
+    """ all decimal ints in buf: (start offset, value) arrays """
+    import numpy as np
+    digit = (buf >= 48) & (buf <= 57)
+    if not digit.any():
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    before = np.concatenate(([False], digit[:-1]))
+    after = np.concatenate((digit[1:], [False]))
+    starts = np.flatnonzero(digit & ~before)
+    ends = np.flatnonzero(digit & ~after)            # last digit
+
+    # horner over the digit positions: a step per digit of the longest number
+    lengths = ends - starts + 1
+    values = np.zeros(len(starts), np.int64)
+    for k in range(int(lengths.max())):
+        more = np.flatnonzero(lengths > k)
+        values[more] = values[more] * 10 + (buf[starts[more] + k] - 48)
+
+    minus = np.zeros(len(starts), bool)
+    hasBefore = starts > 0
+    minus[hasBefore] = buf[starts[hasBefore] - 1] == 45
+    values[minus] = -values[minus]
+    return starts, values
+
+
+def decodeStream(data, chunkEnds=None, chunkTimes=None):
+    """ replies (CR terminated) in data -> {name: structured array}
+
+        Every array has the fields 'frame' (index of the reply in the stream),
+        'time' and the record fields. data can be made of chunks (notifications)
+        ending at offsets chunkEnds and received at chunkTimes; the time of a
+        reply is the time of the chunk with its CR. Without them time is nan.
+    """
+    import numpy as np
+    buf = np.frombuffer(data, dtype=np.uint8)
+    crs = np.flatnonzero(buf == CR)
+    firsts = np.concatenate(([0], crs + 1))[:len(crs)].astype(np.int64)
+    lengths = crs - firsts
+
+    starts, values = _numbers(buf)
+    frameOf = np.searchsorted(crs, starts)            # reply in which a number is
+    inReply = frameOf < len(crs)
+    starts, values, frameOf = starts[inReply], values[inReply], frameOf[inReply]
+    counts = np.bincount(frameOf, minlength=len(crs))
+    firstNumber = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    result = {}
+    claimed = np.zeros(len(crs), bool)
+    for prefix, kind in PARSERS.items():
+        n = len(prefix)
+        match = (lengths >= n) & ~claimed
+        for i, b in enumerate(prefix):
+            candidates = np.flatnonzero(match)
+            match[candidates] = buf[firsts[candidates] + i] == b
+        claimed |= match
+        nfields = len(kind.fields)
+        frames = np.flatnonzero(match & (counts >= nfields))
+
+        dtype = [('frame', np.int64), ('time', np.float64)] + [(f, np.int64) for f in kind.fields]
+        records = np.zeros(len(frames), dtype=dtype)
+        records['frame'] = frames
+        if chunkEnds is None:
+            records['time'] = np.nan
+        else:
+            records['time'] = chunkTimes[np.searchsorted(chunkEnds, crs[frames], side='right')]
+        for k, field in enumerate(kind.fields):
+            records[field] = values[firstNumber[frames] + k]
+        result[kind.name] = records
+    return result
+
+
+def decodeCapture(filename):
+    """ decodeStream() of the notifications in a capture, with their times in s """
+    import numpy as np
+    reader = CaptureReader(filename)
+    try:
+        view = reader.map
+        pos = FILEHEAD.size
+        end = len(view)
+        chunks = []
+        chunkTimes = []
+        unpack = RECORD.unpack_from
+        while pos + RECORD.size <= end:
+            t, direction, handle, length = unpack(view, pos)
+            pos += RECORD.size
+            if pos + length > end:
+                break
+            if direction == NOTIFY and length:
+                chunks.append(view[pos:pos + length])
+                chunkTimes.append((t, length))
+            pos += length
+        data = b''.join(chunks)
+    finally:
+        reader.close()
+    if not chunkTimes:
+        return decodeStream(b'')
+    t, lengths = np.array(chunkTimes, dtype=np.int64).T
+    return decodeStream(data, np.cumsum(lengths), (t - t[0]) / 1e9)
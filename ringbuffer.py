@@ -0,0 +1,126 @@
+"""
+ Fixed size, thread safe byte ring buffer
+     producer: the notification callback (write)
+     consumer: frame extraction (readFrame, read, peek)
+ The buffer is allocated once, writing a notification copies only its own bytes.
+"""
+import threading
+
+
+class RingBuffer:
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.buf      = bytearray(capacity)
+        self.view     = memoryview(self.buf)
+        self.head     = 0        # read position
+        self.size     = 0        # bytes in buffer
+        self.searched = 0        # bytes from head known to contain no delimiter
+        self.lock     = threading.Lock()
+
+        # overflow accounting
+        self.overflow = 0        # bytes dropped because the buffer was full
+        self.written  = 0        # bytes accepted
+
+    # producer
+    def write(self, data) -> int:
+        """ append data, returns the number of bytes stored. What does not fit is dropped """
+        data = memoryview(data)
+        with self.lock:
+            n = min(len(data), self.capacity - self.size)
+            self.overflow += len(data) - n
+            tail = (self.head + self.size) % self.capacity
+            first = min(n, self.capacity - tail)
+            self.view[tail:tail + first] = data[:first]
+            if n > first:
+                self.view[0:n - first] = data[first:n]
+            self.size += n
+            self.written += n
+        return n
+
+    # consumers
+    def available(self) -> int:
+        return self.size
+
+    def isFull(self) -> bool:
+        return self.size == self.capacity
+
+    def read(self, n=None) -> bytes:
+        with self.lock:
+            return self._read(self.size if n is None else min(n, self.size))
+
+    def peek(self) -> bytes:
+        with self.lock:
+            return self._copy(self.size)
+
+    def skip(self, n):
+        with self.lock:
+            self._skip(min(n, self.size))
+
+    def find(self, delimiter: bytes) -> int:
+        """ offset of delimiter from the read position, -1 if not there """
+        with self.lock:
+            return self._find(delimiter)
+
+    def readFrame(self, delimiter=b'\r'):
+        """ returns the data up to delimiter (removing both), None if there is no complete frame """
+        with self.lock:
+            end = self._find(delimiter)
+            if end < 0:
+                return None
+            frame = self._read(end)
+            self._skip(len(delimiter))
+            return frame
+
+    def clear(self):
+        with self.lock:
+            self.head = 0
+            self.size = 0
+            self.searched = 0
+
+    # below: call with lock held
+    def _copy(self, n) -> bytes:
+        first = min(n, self.capacity - self.head)
+        if first == n:
+            return bytes(self.view[self.head:self.head + n])
+        return bytes(self.view[self.head:]) + bytes(self.view[:n - first])
+
+    def _skip(self, n):
+        self.head = (self.head + n) % self.capacity
+        self.size -= n
+        self.searched = max(0, self.searched - n)
+        if self.size == 0:
+            self.head = 0
+
+    def _read(self, n) -> bytes:
+        data = self._copy(n)
+        self._skip(n)
+        return data
+
+    def _find(self, delimiter) -> int:
+        # search both parts of the ring and the seam between them, skipping what was searched before
+        k = len(delimiter)
+        firstLen = min(self.size, self.capacity - self.head)
+        start = self.searched
+        if start < firstLen:
+            i = self.buf.find(delimiter, self.head + start, self.head + firstLen)
+            if i >= 0:
+                return self._found(i - self.head)
+            if k > 1 and self.size > firstLen:
+                # a delimiter of more than one byte can straddle the end of the buffer
+                a, b = max(start, firstLen - k + 1), min(self.size, firstLen + k - 1)
+                seam = bytes(self.view[self.head + a:self.head + firstLen]) + bytes(self.view[:b - firstLen])
+                i = seam.find(delimiter)
+                if i >= 0:
+                    return self._found(a + i)
+            start = firstLen
+        i = self.buf.find(delimiter, start - firstLen, self.size - firstLen)
+        if i >= 0:
+            return self._found(firstLen + i)
+        # the start of a delimiter may be at the end, it is searched again with the next bytes
+        self.searched = max(0, self.size - k + 1)
+        return -1
+
+    def _found(self, offset) -> int:
+        self.searched = offset
+        return offset
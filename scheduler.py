@@ -0,0 +1,109 @@
+"""
+ Priority lanes for the commands waiting in the pipeline
+     control (c0/c1) > setpoints and runs (p, q) > polls (e, i, ..) > EEPROM (X)
+
+     A newer setpoint for a motor replaces the one still waiting, and a
+     poll that is already waiting is not queued twice: the superseded
+     command gets the reply of the command that replaced it. Commands in
+     flight are never touched, replies are matched in FIFO order.
+
+     pipeline = CommandPipeline(write, scheduler=CommandScheduler())
+"""
+from collections import deque
+from concurrent.futures import CancelledError
+
+CONTROL  = 0
+SETPOINT = 1
+POLL     = 2
+EEPROM   = 3
+LANES    = ('control', 'setpoint', 'poll', 'eeprom')
+
+
+def laneOf(text: str) -> int:
+    kind = text[:1]
+    if kind == 'c':
+        return CONTROL
+    if kind in ('p', 'q'):
+        return SETPOINT
+    if kind == 'X':
+        return EEPROM
+    return POLL
+
+
+def coalesceKey(text: str):
+    """ commands with the same key mean the same thing when waiting together, None: never coalesce """
+    if text[:1] == 'p' and len(text) > 1:
+        return text[:2]                  # the setpoint of one motor, newest wins
+    if text in ('e', 'i'):
+        return text                      # the same poll
+    return None
+
+
+def chain(source, target):
+    """ target gets the outcome of source, a cancelled source cancels target
+        (a running target can not be cancelled, it gets a CancelledError)
+    """
+    def copy(f):
+        if target.done():
+            return
+        if f.cancelled():
+            if not target.cancel():
+                target.set_exception(CancelledError(f'{f} cancelled'))
+        elif f.exception() is not None:
+            target.set_exception(f.exception())
+        else:
+            target.set_result(f.result())
+    source.add_done_callback(copy)
+
+
+class CommandScheduler:
+    """ the waiting queue of a CommandPipeline (deque interface), one FIFO per lane """
+
+    def __init__(self):
+        self.lanes      = [deque() for _ in LANES]
+        self.keyed      = {}        # coalesce key -> waiting Command
+        self.superseded = 0         # setpoints replaced by a newer one
+        self.dropped    = 0         # polls that were already waiting
+
+    def append(self, cmd):
+        key = coalesceKey(cmd.text)
+        waiting = self.keyed.get(key) if key is not None else None
+        if waiting is not None:
+            if key[0] == 'p':
+                # same place in the queue, newest value
+                lane = self.lanes[laneOf(cmd.text)]
+                lane[lane.index(waiting)] = cmd
+                self.keyed[key] = cmd
+                chain(cmd.future, waiting.future)
+                self.superseded += 1
+            else:
+                chain(waiting.future, cmd.future)
+                self.dropped += 1
+            return
+        if key is not None:
+            self.keyed[key] = cmd
+        self.lanes[laneOf(cmd.text)].append(cmd)
+
+    def appendleft(self, cmd):
+        """ requeued after a dropout: in front of its lane, not coalesced """
+        self.lanes[laneOf(cmd.text)].appendleft(cmd)
+
+    def popleft(self):
+        for lane in self.lanes:
+            if lane:
+                cmd = lane.popleft()
+                key = coalesceKey(cmd.text)
+                if key is not None and self.keyed.get(key) is cmd:
+                    del self.keyed[key]
+                return cmd
+        raise IndexError('pop from an empty scheduler')
+
+    def urgent(self) -> bool:
+        """ a control command is waiting """
+        return bool(self.lanes[CONTROL])
+
+    def __len__(self):
+        return sum(len(lane) for lane in self.lanes)
+
+    def __bool__(self):
+        return any(self.lanes)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+"""
+ Soak test of the connection lifecycle against a bluno
+     every cycle connects, selects the Serial channel (twice, like going
+     back and forth between the pages), polls 'e' and disconnects.
+     Memory, live info objects, notification handler calls per reply and
+     the reply time should stay flat over the cycles.
+
+   python3 soak.py 50:65:83:99:4B:5E --cycles 300
+   python3 soak.py emulator --cycles 100 --loss 0.01      # qtemulator.py, no board
+"""
+import os, gc, sys, time, argparse
+
+from PyQt5.QtCore import QCoreApplication, QTimer
+from PyQt5 import QtBluetooth as QtBt
+
+from main import Device, DeviceInfo, ServiceInfo, CharacteristicInfo
+from gattcache import normalUuid
+from bluno import PrimarService, SerialPortUUID
+from emulator import addLinkArguments, linkFromArgs
+from qtemulator import Emulator
+
+
+def rss() -> int:
+    """ resident memory in bytes """
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def infoObjects() -> int:
+    return sum(isinstance(o, (DeviceInfo, ServiceInfo, CharacteristicInfo)) for o in gc.get_objects())
+
+
+class Soak:
+
+    def __init__(self, app, args):
+        self.app     = app
+        self.args    = args
+        self.device  = Device()
+        self.cycle   = 0
+        self.rows    = []
+        self.ready   = False
+        if args.address == 'emulator':
+            emulator = Emulator(link=linkFromArgs(args))
+            self.device.setEmulator(emulator)
+            args.address = emulator.address
+            info = emulator.deviceInfo()
+        else:
+            info = QtBt.QBluetoothDeviceInfo(QtBt.QBluetoothAddress(args.address), 'Bluno', 0)
+            info.setCoreConfigurations(QtBt.QBluetoothDeviceInfo.LowEnergyCoreConfiguration)
+        self.device.currentDevice.setDevice(info)
+
+        d = self.device
+        d.servicesUpdated.connect(self.servicesFound)
+        d.characteristicsUpdated.connect(self.characteristicsFound)
+        d.serialReady.connect(self.serialReady)
+        d.disconnected.connect(self.disconnected)
+
+    def start(self):
+        self.ready = False
+        self.cycleStart = time.monotonic()
+        self.device.scanServices(self.args.address)
+
+    # first cycle: no cached layout, select the service and characteristic like the pages do
+    def servicesFound(self):
+        if not self.ready and not self.device.fastPath and len(self.device.m_services):
+            self.device.connectToService(normalUuid(PrimarService))
+
+    def characteristicsFound(self):
+        c = self.device.m_characteristics.find(normalUuid(SerialPortUUID))
+        if not self.ready and c is not None and self.device.controlBluno(c):
+            self.serialReady()
+
+    def serialReady(self):
+        if self.ready:
+            return
+        self.ready = True
+        # back and forth between the pages selects the channel again
+        self.device.controlBluno(self.device.currentCharacteristic)
+        self.polled = 0
+        self.notifications = self.device.metrics.counters['notifications']
+        self.pollStart = time.monotonic()
+        self.poll()
+
+    def poll(self):
+        if self.polled == self.args.polls:
+            self.cycleDone()
+            return
+        self.polled += 1
+        future = self.device.sendtoBluno('e')
+        future.add_done_callback(lambda f: QTimer.singleShot(0, self.poll))
+
+    def cycleDone(self):
+        d = self.device
+        perReply = (time.monotonic() - self.pollStart) / self.args.polls
+        handlerCalls = (d.metrics.counters['notifications'] - self.notifications) / self.args.polls
+        gc.collect()
+        row = (self.cycle, rss() / 1e6, infoObjects(), handlerCalls, perReply * 1e3)
+        self.rows.append(row)
+        if self.cycle % self.args.every == 0:
+            print('cycle %4d  rss %7.1f MB  info objects %4d  notifications/reply %.2f  reply %6.2f ms' % row)
+        d.disconnectFromDevice()
+
+    def disconnected(self):
+        if not self.ready:
+            print(f'cycle {self.cycle}: disconnected before the Serial channel was ready')
+        self.cycle += 1
+        if self.cycle == self.args.cycles:
+            self.app.quit()
+            return
+        QTimer.singleShot(int(self.args.pause * 1000), self.start)
+
+    def verdict(self) -> bool:
+        if len(self.rows) < 4:
+            print('too few cycles')
+            return False
+        n = max(1, len(self.rows) // 10)
+        first, last = self.rows[n:2 * n], self.rows[-n:]     # skip the warm up
+
+        def mean(rows, i):
+            return sum(r[i] for r in rows) / len(rows)
+        growth = mean(last, 1) - mean(first, 1)
+        objects = mean(last, 2) - mean(first, 2)
+        handlers = mean(last, 3)
+        slower = mean(last, 4) / max(mean(first, 4), 1e-9)
+        print(f'rss growth {growth:.1f} MB, info objects {objects:+.0f}, '
+              f'notifications/reply {handlers:.2f}, reply time x{slower:.2f}')
+        ok = objects <= 0 and handlers < 1.5 and growth < self.args.maxGrowth
+        print('ok' if ok else 'LEAK')
+        return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Connect/navigate/disconnect soak test')
+    parser.add_argument('address', help="bluno address, 'emulator' for the emulated bluno")
+    parser.add_argument('--cycles', type=int, default=300)
+    parser.add_argument('--polls', type=int, default=50, help="'e' polls per cycle")
+    parser.add_argument('--pause', type=float, default=0.5, help='s between cycles')
+    parser.add_argument('--every', type=int, default=10, help='print every n cycles')
+    parser.add_argument('--max-growth', dest='maxGrowth', type=float, default=5.0,
+                        help='allowed rss growth in MB')
+    addLinkArguments(parser)
+    args = parser.parse_args()
+
+    app = QCoreApplication(sys.argv)
+    soak = Soak(app, args)
+    QTimer.singleShot(0, soak.start)
+    app.exec_()
+    sys.exit(0 if soak.verdict() else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""
+ Encoder telemetry
+     polls 'e' (and optionally 'i') at a fixed rate and keeps the values
+     in preallocated NumPy ring buffers: no python objects per sample and
+     a fixed amount of memory.
+
+ Python:  streamer.encoders.window(1000)  -> (times, values[n, 2])
+ QML:     device.telemetry.start(), device.telemetry.latest, device.telemetry.window(n, step)
+
+ NumPy is imported when the streamer is first started, not with the module:
+ main.py makes a streamer at startup.
+"""
+import time
+
+from PyQt5.QtCore import QObject, QTimer, Qt, pyqtSignal, pyqtSlot, pyqtProperty, QVariant
+
+from replies import parseReply, Info, Encoders
+
+
+class TelemetryStore:
+    """ ring buffer of timestamped int32 samples with a fixed number of columns """
+
+    def __init__(self, columns, capacity=100000):
+        import numpy as np
+        self.columns  = tuple(columns)
+        self.capacity = capacity
+        self.times    = np.zeros(capacity, dtype=np.float64)
+        self.values   = np.zeros((capacity, len(self.columns)), dtype=np.int32)
+        self.count    = 0        # samples ever appended
+
+    def append(self, t, *values):
+        i = self.count % self.capacity
+        self.times[i] = t
+        self.values[i] = values
+        self.count += 1
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def window(self, n=None, step=1):
+        """ the last n samples (oldest first), every step-th sample.
+            Views into the store when they do not wrap, else copies.
+        """
+        import numpy as np
+        size = len(self)
+        n = size if n is None else min(n, size)
+        end = self.count % self.capacity
+        start = end - n
+        if start >= 0:
+            times, values = self.times[start:end], self.values[start:end]
+        else:
+            times = np.concatenate((self.times[start:], self.times[:end]))
+            values = np.concatenate((self.values[start:], self.values[:end]))
+        # keep the newest sample when decimating
+        first = (n - 1) % step
+        return times[first::step], values[first::step]
+
+    def since(self, t0):
+        """ samples with a time >= t0 """
+        import numpy as np
+        times, values = self.window()
+        first = np.searchsorted(times, t0)
+        return times[first:], values[first:]
+
+    def latest(self):
+        if self.count == 0:
+            return None
+        i = (self.count - 1) % self.capacity
+        return self.times[i], self.values[i]
+
+    def clear(self):
+        self.count = 0
+
+
+class TelemetryStreamer(QObject):
+
+    runningChanged = pyqtSignal()
+    rateChanged    = pyqtSignal()
+    updated        = pyqtSignal()      # new samples, at most uiRate per second
+
+    def __init__(self, request, rate=100, capacity=100000, uiRate=10, parent=None):
+        """ request(cmd) sends a command and returns a Future with the reply """
+        super().__init__(parent)
+        self.request   = request
+        self.capacity  = capacity
+        self.encoders  = None           # TelemetryStore, made at the first start
+        self.setpoints = None
+        self.m_rate    = rate
+        self.pollInfo  = False
+        self.pending   = set()          # commands with a poll in flight
+        self.lost      = 0              # polls without a usable reply
+        self.fresh     = False
+
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.poll)
+        self.uiTimer = QTimer(self)
+        self.uiTimer.setInterval(int(1000 / uiRate))
+        self.uiTimer.timeout.connect(self.publish)
+
+    @pyqtSlot()
+    def start(self):
+        if self.encoders is None:
+            self.encoders  = TelemetryStore(('enc1', 'enc2'), self.capacity)
+            self.setpoints = TelemetryStore(('setpoint1', 'setpoint2'), self.capacity)
+        self.timer.start(max(1, int(1000 / self.m_rate)))
+        self.uiTimer.start()
+        self.runningChanged.emit()
+
+    @pyqtSlot()
+    def stop(self):
+        self.timer.stop()
+        self.uiTimer.stop()
+        self.runningChanged.emit()
+
+    @pyqtSlot()
+    def poll(self):
+        self.send('e', self.encoders, Encoders)
+        if self.pollInfo:
+            self.send('i', self.setpoints, Info)
+
+    def send(self, cmd, store, record):
+        # one poll per command in flight, a slow link lowers the rate instead of queueing
+        if cmd in self.pending:
+            return
+        self.pending.add(cmd)
+        try:
+            future = self.request(cmd)
+        except Exception:
+            self.pending.discard(cmd)
+            return
+        future.add_done_callback(lambda f: self.received(f, cmd, store, record))
+
+    def received(self, future, cmd, store, record):
+        self.pending.discard(cmd)
+        t = time.monotonic()
+        if future.exception() is not None:
+            self.lost += 1
+            return
+        reply = parseReply(future.result())
+        if type(reply) is not record:
+            self.lost += 1
+            return
+        store.append(t, *reply)
+        self.fresh = True
+
+    @pyqtSlot()
+    def publish(self):
+        if self.fresh:
+            self.fresh = False
+            self.updated.emit()
+
+    # QML interface
+    def isRunning(self):
+        return self.timer.isActive()
+
+    def getRate(self):
+        return self.m_rate
+
+    def setRate(self, rate):
+        self.m_rate = max(1, rate)
+        if self.timer.isActive():
+            self.timer.setInterval(max(1, int(1000 / self.m_rate)))
+        self.rateChanged.emit()
+
+    def getLatest(self):
+        latest = self.encoders.latest() if self.encoders is not None else None
+        if latest is None:
+            return []
+        return [int(v) for v in latest[1]]
+
+    @pyqtSlot(int, int, result=QVariant)
+    def window(self, n, step=1):
+        """ [[t, enc1, enc2], ...] for plotting """
+        if self.encoders is None:
+            return []
+        import numpy as np
+        times, values = self.encoders.window(n, max(1, step))
+        return np.column_stack((times, values)).tolist()
+
+    running = pyqtProperty(bool, isRunning, notify=runningChanged)
+    rate    = pyqtProperty(int, getRate, setRate, notify=rateChanged)
+    latest  = pyqtProperty(QVariant, getLatest, notify=updated)
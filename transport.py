@@ -0,0 +1,336 @@
+"""
+ Transports to the bluno with one asyncio interface
+
+     transport = LoopbackTransport()        # or BluepyTransport(address), QtTransport(address)
+     await transport.connect()
+     await transport.write(b'e\\r')
+     async for frame in transport.notifications():
+         ...
+
+ Backends only deliver raw notification data to dataReceived(), the CR
+ framing is done here. AsyncBluno puts the command pipeline on top, so the
+ command/reply logic is the same for every backend.
+
+ QtTransport needs an asyncio loop running on the Qt event loop (e.g. qasync).
+ BluepyTransport runs the Peripheral in its own thread (blunoTerminal.BlunoIO):
+ that thread sleeps until a notification or a write wakes it, off the event
+ loop.
+"""
+import abc, asyncio
+
+from framing import FrameAssembler
+from pipeline import CommandPipeline
+from packets import PacketWriter, DEFAULT_MTU
+from arq import DATA, ArqLink, negotiate
+
+_CLOSED = object()
+
+
+class Transport(abc.ABC):
+
+    def __init__(self):
+        self.mtu       = DEFAULT_MTU
+        self.frames    = asyncio.Queue()
+        self.assembler = FrameAssembler(callback=self.frames.put_nowait)
+        self.connected = False
+        self.capture   = None       # capture.CaptureWriter, records writes and notifications
+        self.raw       = None       # a link (arq.py) gets the notifications instead of the CR framing
+
+    @abc.abstractmethod
+    async def connect(self):
+        pass
+
+    async def disconnect(self):
+        self.connected = False
+        self.frames.put_nowait(_CLOSED)
+
+    @abc.abstractmethod
+    def send(self, data: bytes):
+        """ write without waiting, for use from synchronous code """
+
+    def sendUnacked(self, data: bytes):
+        """ write without response (bulk data), the backend default when it has no choice """
+        self.send(data)
+
+    async def write(self, data: bytes):
+        self.send(data)
+
+    # called by the backend for every notification
+    def dataReceived(self, data):
+        if self.capture is not None:
+            self.capture.notify(0, data)
+        if self.raw is not None:
+            self.raw(data)
+        else:
+            self.assembler.feed(data)
+
+    async def notifications(self):
+        """ CR framed replies, ends when the transport is disconnected """
+        while True:
+            frame = await self.frames.get()
+            if frame is _CLOSED:
+                return
+            yield frame
+
+
+def standIn(command: bytes) -> bytes:
+    """ minimal stand-in for test3.ino, every command gets a reply """
+    if command[:1] == b'i':
+        return b'XXInfo: 0, 0\r'
+    if command[:1] == b'e':
+        return b'Enc: 0, 0\r'
+    if command[:1] == b'c':
+        return b'Control: %d\r' % (command[1:2] != b'0')
+    return b'ack\r'
+
+
+class LoopbackTransport(Transport):
+    """ in process transport, responder(command) returns the reply of one command """
+
+    def __init__(self, responder=standIn, delay=0.0):
+        super().__init__()
+        self.responder = responder
+        self.delay     = delay
+        self.incoming  = FrameAssembler(callback=self.commandReceived, capacity=64)
+
+    async def connect(self):
+        self.connected = True
+
+    def send(self, data: bytes):
+        if not self.connected:
+            raise ConnectionError('loopback not connected')
+        self.incoming.feed(data)
+
+    def commandReceived(self, command):
+        reply = self.responder(command)
+        if not reply:
+            return
+        loop = asyncio.get_event_loop()
+        if self.delay:
+            loop.call_later(self.delay, self.dataReceived, reply)
+        else:
+            loop.call_soon(self.dataReceived, reply)
+
+
+class BluepyTransport(Transport):
+
+    def __init__(self, address, addrType='public'):
+        super().__init__()
+        self.address  = address
+        self.addrType = addrType
+        self.io       = None
+
+    async def connect(self):
+        loop = asyncio.get_event_loop()
+        self.io = await loop.run_in_executor(None, self.open, loop)
+        self.mtu = self.io.packets.mtu
+        self.connected = True
+        self.io.start()
+
+    def open(self, loop):
+        """ executor: connect and look up the Serial handle """
+        from bluepy.btle import DefaultDelegate, Peripheral
+        from blunoTerminal import BlunoIO
+
+        transport = self
+
+        class Delegate(DefaultDelegate):
+            def handleNotification(self, cHandle, data):
+                loop.call_soon_threadsafe(transport.dataReceived, data)
+
+        per = Peripheral(self.address, self.addrType)
+        per.withDelegate(Delegate())
+        return BlunoIO(per, closed=lambda: loop.call_soon_threadsafe(self.linkClosed))
+
+    def linkClosed(self):
+        if self.connected:
+            self.connected = False
+            self.frames.put_nowait(_CLOSED)
+
+    def send(self, data: bytes):
+        if self.io is None or self.io.finished:
+            raise ConnectionError('bluepy link closed')
+        self.io.write(data)
+
+    async def disconnect(self):
+        if self.io is not None:
+            io, self.io = self.io, None
+            await asyncio.get_event_loop().run_in_executor(None, io.stop)
+        if self.connected:
+            await super().disconnect()
+
+
+class QtTransport(Transport):
+    """ QtBluetooth backend, runs a hub.BlunoSession """
+
+    def __init__(self, address, connectTimeout=20.0):
+        super().__init__()
+        self.address = address
+        self.session = None
+        self.connectTimeout = connectTimeout
+
+    async def connect(self):
+        from hub import BlunoSession
+
+        loop = asyncio.get_event_loop()
+        ready = loop.create_future()
+        self.session = BlunoSession(self.address)
+        self.session.notified.connect(lambda address, value: self.dataReceived(bytes(value)))
+        self.session.ready.connect(lambda address: ready.done() or ready.set_result(True))
+        self.session.errorOccurred.connect(
+            lambda address, message: ready.done() or ready.set_exception(ConnectionError(message)))
+        self.session.disconnected.connect(lambda address: self.sessionDisconnected(ready))
+        self.session.connectToDevice()
+        try:
+            await asyncio.wait_for(ready, self.connectTimeout)
+        except Exception as ex:
+            self.session.disconnectFromDevice()
+            self.session = None
+            if isinstance(ex, asyncio.TimeoutError):
+                raise ConnectionError(f'{self.address} not ready in {self.connectTimeout} s') from None
+            raise
+        self.mtu = self.session.packets.mtu
+        self.connected = True
+
+    def sessionDisconnected(self, ready):
+        if not ready.done():
+            ready.set_exception(ConnectionError(f'{self.address} disconnected'))
+        elif self.connected:
+            self.connected = False
+            self.frames.put_nowait(_CLOSED)
+
+    def send(self, data: bytes):
+        self.session.writeSerial(data)
+
+    def sendUnacked(self, data: bytes):
+        from PyQt5 import QtBluetooth as QtBt
+        self.session.writeSerial(data, QtBt.QLowEnergyService.WriteMode.WriteWithoutResponse)
+
+    async def disconnect(self):
+        if self.session is not None:
+            self.session.disconnectFromDevice()
+            self.session = None
+        await super().disconnect()
+
+
+class AsyncBluno:
+    """ command/reply on top of any transport
+
+        async with AsyncBluno(LoopbackTransport()) as bluno:
+            reply = await bluno.request('e')
+
+        With arq the board is asked for the binary link of arq.py at the start,
+        the commands and replies then go in DATA frames with acks and retries.
+    """
+    def __init__(self, transport: Transport, window=4, timeout=2.0, scheduler=None, arq=False):
+        self.transport = transport
+        self.packets   = PacketWriter(self.sendPacket, mtu=transport.mtu)
+        self.pipeline  = CommandPipeline(self.writeCommand, window=window, timeout=timeout,
+                                         flush=self.packets.flush, scheduler=scheduler,
+                                         defer=lambda flush: asyncio.get_event_loop().call_soon(flush))
+        self.reader    = None
+        self.arq       = arq
+        self.link      = None       # arq.ArqLink or TextLink after negotiate(), None: text
+        self.poller    = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def start(self):
+        if not self.transport.connected:
+            await self.transport.connect()
+        self.packets.setMtu(self.transport.mtu)
+        self.reader = asyncio.ensure_future(self.readReplies())
+        if self.arq:
+            await self.negotiate()
+
+    async def stop(self):
+        if self.poller is not None:
+            self.poller.cancel()
+            self.poller = None
+        await self.transport.disconnect()
+        if self.reader is not None:
+            await self.reader
+            self.reader = None
+
+    async def negotiate(self, attempts=3):
+        """ B1: the board switches to the binary link at the first frame,
+            firmware without it answers ack
+        """
+        for attempt in range(attempts):
+            try:
+                reply = await self.request('B1')
+                break
+            except (asyncio.TimeoutError, TimeoutError):
+                if attempt == attempts - 1:
+                    raise ConnectionError('no answer on B1') from None
+        self.link = negotiate(reply, self.sendFrame, self.frameReceived)
+        self.transport.raw = self.link.dataReceived
+        if isinstance(self.link, ArqLink):
+            self.poller = asyncio.ensure_future(self.pollLink())
+
+    async def pollLink(self):
+        """ retransmits """
+        while self.transport.connected:
+            await asyncio.sleep(self.link.timeout / 2)
+            self.link.poll()
+
+    def writeCommand(self, payload):
+        if self.link is None:
+            self.packets.write(payload)
+        else:
+            self.link.submit(DATA, payload[:-1])      # without the CR
+
+    def sendFrame(self, data):
+        # acks and retransmits also come outside of a burst of commands
+        self.packets.write(data)
+        self.pipeline.scheduleFlush()
+
+    def frameReceived(self, ftype, payload):
+        if ftype == DATA:
+            self.pipeline.replyReceived(payload)
+
+    def sendPacket(self, data):
+        if self.transport.capture is not None:
+            self.transport.capture.write(0, data)
+        self.transport.send(data)
+
+    def sendUnacked(self, data):
+        if self.transport.capture is not None:
+            self.transport.capture.write(0, data)
+        self.transport.sendUnacked(data)
+
+    async def exclusive(self, handler):
+        """ the link for a bulk transfer: hold the commands, wait for the ones in
+            flight, then replies go to handler(frame) until release()
+        """
+        if isinstance(self.link, ArqLink):
+            raise RuntimeError('bulk transfers need the text link')
+        self.pipeline.pause()
+        while self.pipeline.inflight and self.transport.connected:
+            self.pipeline.checkTimeouts()
+            await asyncio.sleep(0.005)
+        self.pipeline.unsolicited = handler
+
+    def release(self):
+        self.pipeline.unsolicited = None
+        self.pipeline.resume()
+
+    async def readReplies(self):
+        async for frame in self.transport.notifications():
+            self.pipeline.replyReceived(frame)
+        self.packets.clear()
+        self.pipeline.clear('transport closed')
+
+    async def request(self, cmd: str, timeout=None):
+        """ send cmd (without CR) and return its reply """
+        future = asyncio.wrap_future(self.pipeline.submit(cmd))
+        try:
+            return await asyncio.wait_for(future, timeout or self.pipeline.timeout)
+        except asyncio.TimeoutError:
+            self.pipeline.checkTimeouts()
+            raise